@@ -15,6 +15,9 @@ from  src.buffer_creator import ui_buffer_creator, buffer_creator
 from  src.integration import ui_integration, integrateXRD
 from  src.reverse_fp import ui_reverse_fp, reverse_fp
 from  src.viewer_2D import ui_viewer_2D, viewer_2D
+from  src.export_stack import ui_export_stack, export_stack
+from  src.batch import ui_batch, batch_integration
+from  src.report import PROGRESS_REGEX, PROGRESS_EXPR
 
 __author__ = 'VALLOT Sylvain'
 __version__ = '1.0.0'
@@ -57,6 +60,8 @@ __description__ = 'Partial and total integration of 2D diffractograms and tools'
     show_restart_button=False,
     richtext_controls=True,
     navigation='SIDEBAR',
+    progress_regex=PROGRESS_REGEX,
+    progress_expr=PROGRESS_EXPR,
 )
 
 def parse_args():
@@ -71,6 +76,8 @@ def parse_args():
     ui_reverse_fp(action)
     ui_buffer_creator(action)
     ui_viewer_2D(action)
+    ui_export_stack(action)
+    ui_batch(action)
 
     return parser.parse_args()
 
@@ -88,5 +95,9 @@ if __name__ == '__main__':
             reverse_fp(args)
         elif action == 'viewer_2D':
             viewer_2D(args)
+        elif action == 'export_stack':
+            export_stack(args)
+        elif action == 'batch':
+            batch_integration(args)
 
     switch(args.action, args)
\ No newline at end of file
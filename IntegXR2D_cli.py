@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Command-line version of IntegXR2D: no graphical interface, the modules of
+# the chosen action are only imported when it runs
+from src.cli import main
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+"""Stage by stage benchmark of the integration on a synthetic series
+
+Every stage of integrateXRD is timed separately on synthetic CBF frames,
+the results are written as JSON with frames/s and MB/s for each stage.
+The integrated diffractograms are checked against pyFAI and, optionally,
+against a reference saved by a previous run.
+
+Usage:
+    python benchmarks/bench_integration.py [--frames 20] [--shape 1024 1024] [--npt 6000]
+        [--output bench.json] [--save-reference ref.npz | --reference ref.npz]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import fabio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.utils as IXR2D
+from src.engine import IntegrationEngine
+from benchmarks.synthetic import make_series
+
+# Aperture of the partial integration in °
+APERTURE = 30
+
+
+class Stages:
+    """Timing of the benchmark stages"""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name: str, frames: int, func, nbytes=None):
+        """Time a stage
+
+        Args:
+            name (str): Name of the stage
+            frames (int): Number of frames processed by the stage
+            func (callable): Stage to run, returns its output
+            nbytes (callable, optional): Number of bytes read or written, called after the stage. Defaults to None.
+
+        Returns:
+            object: Output of the stage
+        """
+        start = time.perf_counter()
+        output = func()
+        elapsed = time.perf_counter() - start
+        result = {'seconds': elapsed, 'frames': frames,
+                  'frames_per_s': frames / elapsed if elapsed > 0 else None}
+        if nbytes is not None:
+            mb = nbytes() / 1e6
+            result.update({'MB': mb, 'MB_per_s': mb / elapsed if elapsed > 0 else None})
+        self.results[name] = result
+        rate = f"{result['frames_per_s']:10.1f} frames/s" if result['frames_per_s'] else ''
+        print(f"{name:<22} {elapsed:9.4f} s {rate}")
+        return output
+
+
+def max_relative_error(value: np.ndarray, reference: np.ndarray) -> float:
+    """Largest difference relative to the largest reference intensity"""
+    return float(np.max(np.abs(np.asarray(value) - np.asarray(reference))) / np.max(np.abs(reference)))
+
+
+def files_size(folder: str, files: list) -> int:
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--shape", type=int, nargs=2, default=(1024, 1024))
+    parser.add_argument("--npt", type=int, default=6000)
+    # pyFAI bins in float32, a few pixels at bin edges can fall in the neighbouring bin
+    parser.add_argument("--tolerance", type=float, default=5e-3,
+                        help="Maximum difference relative to the largest intensity")
+    parser.add_argument("--output", help="JSON file for the results, printed if not given")
+    parser.add_argument("--save-reference", help="Save the integrated diffractograms to this .npz file")
+    parser.add_argument("--reference", help="Compare the integrated diffractograms to this .npz file")
+    parser.add_argument("--keep", help="Keep the synthetic series in this folder")
+    args = parser.parse_args()
+
+    folder = args.keep or tempfile.mkdtemp(prefix="integxr2d_bench_")
+    series = make_series(folder, args.frames, tuple(args.shape))
+    images, n, npt = series['images'], args.frames, args.npt
+    paths = [os.path.join(images, f) for f in series['frames']]
+    dark = fabio.open(series['dark'])
+    stages = Stages()
+    checks = {}
+
+    try:
+        found = stages.run("discovery", n, lambda: IXR2D.file_parser(images, [], [], accel=False))
+
+        decoded = stages.run("decode", n, lambda: [fabio.open(p) for p in paths],
+                             lambda: sum(os.path.getsize(p) for p in paths))
+
+        # Total integration: pyFAI as used before the integration engine, then the engine
+        poni = stages.run("load_poni", 1, lambda: IntegrationEngine(series['poni'], npt, cache_dir=None).poni)
+        total_ref = stages.run("total_pyfai", n, lambda: [
+            poni.integrate2d(im.data, npt, 1, unit="2th_deg", dark=dark.data, method="cython")
+            for im in decoded])
+        total_engine = IntegrationEngine(series['poni'], npt, cache_dir=None)
+        stages.run("total_engine_setup", 1, lambda: total_engine.integrator(decoded[0].data.shape))
+        total = stages.run("total_engine", n, lambda: [
+            total_engine.integrate(im.data, dark.data) for im in decoded])
+        checks['total_vs_pyfai'] = max(
+            max_relative_error(cts[0], ref[0][0]) for (tth, cts), ref in zip(total, total_ref))
+
+        # Partial integration: azim_sum with one integrate1d per interval, then the sector engine
+        axes = IXR2D.azim_angles(APERTURE)
+        partial_ref = stages.run("partial_azim_sum", n, lambda: [
+            [IXR2D.azim_sum(poni, dark, im, axis, npt) for axis in axes] for im in decoded])
+        partial_engine = IntegrationEngine(series['poni'], npt, IXR2D.azim_sectors(APERTURE), cache_dir=None)
+        stages.run("partial_engine_setup", 1, lambda: partial_engine.integrator(decoded[0].data.shape))
+        partial = stages.run("partial_engine", n, lambda: [
+            partial_engine.integrate(im.data, dark.data) for im in decoded])
+        # The 90° axis has no sector through ±180°, both methods integrate the same pixels
+        checks['partial_axis90_vs_azim_sum'] = max(
+            max_relative_error(cts[1], ref[1][1]) for (tth, cts), ref in zip(partial, partial_ref))
+        # The 0° axis: sector around 0° plus sector around 180°, which goes through ±180°.
+        # pyFAI integrates the latter in a single azimuth range once its chi discontinuity is moved
+        # to 0°, chi then going from 0° to 360°
+        half = APERTURE / 2
+        poni_disc_zero = IntegrationEngine(series['poni'], npt, cache_dir=None).poni
+        poni_disc_zero.setChiDiscAtZero()
+        axis0_ref = [
+            IXR2D.azim_integ(poni, dark, im, npt, [-half, half])[1]
+            + IXR2D.azim_integ(poni_disc_zero, dark, im, npt, [180 - half, 180 + half])[1]
+            for im in decoded]
+        checks['partial_axis0_vs_pyfai'] = max(
+            max_relative_error(cts[0], ref) for (tth, cts), ref in zip(partial, axis0_ref))
+
+        # Writing
+        out = os.path.join(folder, "out")
+        os.makedirs(out, exist_ok=True)
+        total_files = [os.path.splitext(f)[0] + '.dat' for f in series['frames']]
+        stages.run("write_saveazi", n, lambda: [
+            IXR2D.saveazi(os.path.join(out, f), cts, tth, [0.0], npt, 1)
+            for f, (tth, cts) in zip(total_files, total)],
+            lambda: files_size(out, total_files))
+        partial_files = []
+        for f, (tth, cts) in zip(series['frames'], partial):
+            index = IXR2D.delimiter_parser(os.path.splitext(f)[0])[0]
+            for i in range(len(cts)):
+                partial_files.append((IXR2D.azim_filename("Synth_S", IXR2D.get_axis(i), APERTURE, index) + '.dat',
+                                      tth, cts[i]))
+        stages.run("write_save_to_file", n, lambda: [
+            IXR2D.save_to_file(os.path.join(out, f), (tth, cts)) for f, tth, cts in partial_files],
+            lambda: files_size(out, [f for f, _, _ in partial_files]))
+
+        # Post-processing and renumbering of the total integration output
+        stages.run("intensity_correction", n, lambda: [
+            IXR2D.intensity_correction(os.path.join(out, f), 10) for f in total_files],
+            lambda: files_size(out, total_files))
+        stages.run("prepend_line", n, lambda: [
+            IXR2D.prepend_line(os.path.join(out, f), f"### Original file: {f}", multi=False)
+            for f in total_files],
+            lambda: files_size(out, total_files))
+        stages.run("renumbering", n, lambda: [
+            os.replace(os.path.join(out, f), os.path.join(out, IXR2D.file_rename(f, "Synth_S", accel=False)))
+            for f in total_files])
+
+        outputs = {
+            'total': np.array([cts[0] for tth, cts in total]),
+            'partial': np.array([cts for tth, cts in partial]),
+        }
+        if args.save_reference:
+            np.savez(args.save_reference, **outputs)
+        if args.reference:
+            with np.load(args.reference) as reference:
+                for key, value in outputs.items():
+                    checks[f'{key}_vs_reference'] = max_relative_error(value, reference[key])
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    failed = {name: error for name, error in checks.items() if error > args.tolerance}
+    for name, error in checks.items():
+        print(f"check {name:<30} {error:.2e} {'FAILED' if name in failed else 'ok'}")
+
+    report = {
+        'config': {'frames': n, 'shape': list(args.shape), 'npt': npt, 'aperture': APERTURE,
+                   'python': platform.python_version(), 'numpy': np.__version__},
+        'stages': stages.results,
+        'checks': checks,
+        'tolerance': args.tolerance,
+        'passed': not failed,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+"""Benchmark of the command-line start time of each action
+
+Every action is started in a fresh interpreter with --help, so the time covers the interpreter,
+the imports and the parser construction. The heavy packages imported by each action are listed.
+
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--output startup.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.cli import ACTIONS
+
+CLI = os.path.join(ROOT, 'IntegXR2D_cli.py')
+# Packages slow to import, only needed by some actions
+HEAVY = ('pyFAI', 'fabio', 'PIL', 'matplotlib', 'gooey', 'wx')
+# Builds the parser of an action and prints the heavy packages it imported
+PROBE = """import sys, json
+sys.path.insert(0, {root!r})
+from src.cli import build_parser
+build_parser([{action!r}])
+print(json.dumps(sorted(name for name in {heavy!r} if name in sys.modules)))
+"""
+
+
+def start_time(args: list, repeat: int) -> float:
+    """Median wall time of a fresh interpreter running the command line
+
+    Returns:
+        float: Start time in ms
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, CLI] + args, check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(times)
+
+
+def heavy_imports(action: str) -> list:
+    """Heavy packages imported when the parser of the action is built"""
+    probe = PROBE.format(root=ROOT, action=action, heavy=HEAVY)
+    output = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    # Reference: start of a bare interpreter
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append((time.perf_counter() - start) * 1e3)
+    interpreter = statistics.median(times)
+    print(f"{'python -c pass':<16} {interpreter:8.1f} ms")
+
+    results = {'interpreter_ms': interpreter, 'actions': {}}
+    for action in [None] + list(ACTIONS):
+        elapsed = start_time(([action] if action else []) + ['--help'], args.repeat)
+        imported = heavy_imports(action) if action else []
+        print(f"{action or '(no action)':<16} {elapsed:8.1f} ms  {', '.join(imported) or '-'}")
+        results['actions'][action or ''] = {'start_ms': elapsed, 'heavy_imports': imported}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
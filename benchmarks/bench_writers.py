@@ -0,0 +1,74 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+"""Benchmark of the per-frame .dat write path
+
+Usage: python benchmarks/bench_writers.py [--npt 6000] [--frames 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.utils as IXR2D
+from src.writers import DatWriter
+
+
+def legacy_save_to_file(file: str, data: object):
+    """Per-point writer used before the bulk writer, kept as the reference"""
+    f = open(file, "w")
+    for i in range(len(data[0])):
+        f.write("%f  " % (data[0][i]))
+        f.write("%.4f" % (data[1][i]))
+        f.write("\n")
+    f.close()
+
+
+def run(name: str, write, folder: str, tth: np.ndarray, patterns: np.ndarray) -> float:
+    """Time the writing of every pattern and print the throughput
+
+    Returns:
+        float: Frames written per second
+    """
+    start = time.perf_counter()
+    for i, cts in enumerate(patterns):
+        write(os.path.join(folder, f"{name}_{i}.dat"), tth, cts)
+    elapsed = time.perf_counter() - start
+    fps = len(patterns) / elapsed
+    print(f"{name:<14} {elapsed / len(patterns) * 1e3:8.3f} ms/frame {fps:10.1f} frames/s")
+    return fps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--npt", type=int, default=6000)
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tth = np.linspace(0.01, 40, args.npt).astype(np.float32)
+    patterns = (rng.random((args.frames, args.npt)) * 1e4).astype(np.float32)
+    writer = DatWriter(args.npt)
+
+    with tempfile.TemporaryDirectory() as folder:
+        legacy = run("legacy", lambda f, x, y: legacy_save_to_file(f, (x, y)), folder, tth, patterns)
+        save = run("save_to_file", lambda f, x, y: IXR2D.save_to_file(f, (x, y)), folder, tth, patterns)
+        run("DatWriter", writer.write, folder, tth, patterns)
+
+        # Both writers must produce the same files
+        with open(os.path.join(folder, "legacy_0.dat")) as a, open(os.path.join(folder, "DatWriter_0.dat")) as b:
+            assert a.read() == b.read(), "Bulk writer output differs from the legacy writer"
+
+    print(f"Speed-up of save_to_file: {save / legacy:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
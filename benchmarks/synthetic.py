@@ -0,0 +1,89 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+"""Synthetic detector geometry and 2D diffraction images for the benchmarks"""
+
+import os
+
+import numpy as np
+import fabio
+import pyFAI
+
+# Pilatus-like pixel size in m
+PIXEL_SIZE = 172e-6
+# Positions in ° 2theta and relative intensities of the synthetic Debye-Scherrer rings
+RINGS = ((6.2, 1.0), (9.8, 0.6), (12.4, 0.8), (16.1, 0.3), (19.7, 0.5))
+
+
+def write_poni(file: str, shape: tuple, distance: float = 0.15, wavelength: float = 0.7e-10) -> str:
+    """Write a .poni file with the beam centre in the middle of the detector
+
+    Args:
+        file (str): Name for the file
+        shape (tuple): Detector shape in pixels
+        distance (float, optional): Sample-detector distance in m. Defaults to 0.15.
+        wavelength (float, optional): Wavelength in m. Defaults to 0.7e-10.
+
+    Returns:
+        str: Name of the file
+    """
+    lines = [
+        "# Synthetic geometry for the IntegXR2D benchmarks",
+        "poni_version: 2",
+        "Detector: Detector",
+        'Detector_config: {"pixel1": %g, "pixel2": %g, "max_shape": [%d, %d]}'
+        % (PIXEL_SIZE, PIXEL_SIZE, shape[0], shape[1]),
+        f"Distance: {distance}",
+        f"Poni1: {shape[0] * PIXEL_SIZE * 0.47}",
+        f"Poni2: {shape[1] * PIXEL_SIZE * 0.53}",
+        "Rot1: 0",
+        "Rot2: 0",
+        "Rot3: 0",
+        f"Wavelength: {wavelength}",
+    ]
+    with open(file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return file
+
+
+def make_series(folder: str, nb_frames: int = 20, shape: tuple = (1024, 1024),
+                pattern: str = "Synth_S", seed: int = 0) -> dict:
+    """Create a series of CBF frames with drifting, azimuthally textured rings, a dark and a .poni file
+
+    Args:
+        folder (str): Output folder, created if needed
+        nb_frames (int, optional): Number of frames. Defaults to 20.
+        shape (tuple, optional): Detector shape. Defaults to (1024, 1024).
+        pattern (str, optional): File name pattern of the frames. Defaults to "Synth_S".
+        seed (int, optional): Seed of the counting noise. Defaults to 0.
+
+    Returns:
+        dict: Paths of the 'images' folder, 'poni' and 'dark' files and list of 'frames'
+    """
+    images = os.path.join(folder, "images")
+    os.makedirs(images, exist_ok=True)
+    poni = write_poni(os.path.join(folder, "synthetic.poni"), shape)
+
+    geometry = pyFAI.load(poni)
+    tth = geometry.center_array(shape, unit="2th_deg")
+    chi = np.radians(geometry.center_array(shape, unit="chi_deg"))
+    rng = np.random.default_rng(seed)
+
+    dark = np.full(shape, 4, dtype=np.int32)
+    fabio.cbfimage.CbfImage(data=dark).write(os.path.join(folder, "dark.cbf"))
+
+    frames = []
+    for i in range(nb_frames):
+        # Rings drift and change texture along the series, like an in-situ measurement
+        signal = np.full(shape, 40.0)
+        for position, height in RINGS:
+            texture = 1 + 0.3 * np.cos(2 * chi + i / max(nb_frames, 1))
+            signal += 2000 * height * texture * np.exp(-0.5 * ((tth - position - 0.01 * i) / 0.05) ** 2)
+        data = rng.poisson(signal).astype(np.int32) + dark
+        name = f"{pattern}_{i:04d}.cbf"
+        fabio.cbfimage.CbfImage(data=data).write(os.path.join(images, name))
+        frames.append(name)
+
+    return {'images': images, 'poni': poni, 'dark': os.path.join(folder, "dark.cbf"), 'frames': frames}
@@ -0,0 +1,122 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Headless integration API, no user interface, no change of working directory
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import fabio
+import src.utils as IXR2D
+from src.engine import IntegrationEngine
+from src.readers import list_frames, read_frame
+
+# Engine and dark of the current process, loaded once per worker
+_api_worker = {}
+
+
+def _groups(sectors) -> tuple:
+    """Groups of sectors from the sectors argument of the API
+
+    Args:
+        sectors (int, list): None for total integration, an aperture in degrees for the 0° and 90° axes
+            or a list of groups of [start, end] sectors in degrees
+
+    Returns:
+        tuple: Groups of sectors, None for total integration
+    """
+    if sectors is None:
+        return None
+    if isinstance(sectors, (int, float)):
+        return IXR2D.azim_sectors(sectors)
+    return tuple(sectors)
+
+
+def _load_dark(dark) -> np.ndarray:
+    """Dark image from a file name or an array, None if no dark is used"""
+    if dark is None:
+        return None
+    if isinstance(dark, (str, os.PathLike)):
+        return fabio.open(os.fspath(dark)).data
+    return np.asarray(dark)
+
+
+def _init_api_worker(poni: str, dark, npt: int, groups: tuple, cache_dir: str):
+    """Load the integration engine and the dark once for the process integrating images"""
+    _api_worker['engine'] = IntegrationEngine(poni, npt, groups, cache_dir)
+    _api_worker['dark'] = _load_dark(dark)
+
+
+def _integrate_path(total: bool, path) -> tuple:
+    """Integrate one image with the engine of the current process
+
+    Returns:
+        tuple: 2theta values and intensities
+    """
+    data = path if isinstance(path, np.ndarray) else read_frame(path)
+    tth, intensities = _api_worker['engine'].integrate(data, _api_worker['dark'])
+    return tth, intensities[0] if total else intensities
+
+
+def integrate_series(paths: list, poni: str, dark=None, npt: int = 6000, sectors=None,
+                     workers: int = 1, cache_dir: str = None):
+    """Integrate a series of 2D images and yield the 1D diffractograms as arrays.
+    Nothing is written to disk unless a cache folder is given, the working directory is not changed.
+
+    Args:
+        paths (list): 2D image files, multi-frame containers (HDF5/NeXus, EDF) or 2D arrays to integrate,
+            each frame of a container being an image of the series
+        poni (str): Detector calibration .poni file
+        dark (str, np.ndarray, optional): Dark file or dark array. Defaults to None.
+        npt (int, optional): Number of points per 1D diffractogram. Defaults to 6000.
+        sectors (int, list, optional): None for total integration, an aperture in degrees for the
+            0° and 90° axes or a list of groups of [start, end] sectors in degrees. Defaults to None.
+        workers (int, optional): Number of processes. Defaults to 1.
+        cache_dir (str, optional): Folder of the integration cache, e.g. src.engine.CACHE_DIR. Defaults to None, no cache.
+
+    Yields:
+        tuple: Index in paths, 2theta values and intensities,
+            an array (npt,) for total integration or (number of groups, npt) for sectors
+    """
+    paths = [path if isinstance(path, np.ndarray) else frame
+             for path in paths
+             for frame in ([path] if isinstance(path, np.ndarray) else list_frames(os.fspath(path)))]
+    poni = os.path.abspath(os.fspath(poni))
+    if isinstance(dark, (str, os.PathLike)):
+        dark = os.path.abspath(os.fspath(dark))
+    groups = _groups(sectors)
+    integrate = partial(_integrate_path, groups is None)
+    initargs = (poni, dark, int(npt), groups, cache_dir)
+
+    if workers <= 1 or len(paths) <= 1:
+        _init_api_worker(*initargs)
+        for index, path in enumerate(paths):
+            yield (index,) + integrate(path)
+        return
+
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_api_worker,
+                             initargs=initargs) as executor:
+        for index, result in enumerate(executor.map(integrate, paths, chunksize=chunksize)):
+            yield (index,) + result
+
+
+def integrate_stack(paths: list, poni: str, dark=None, npt: int = 6000, sectors=None,
+                    workers: int = 1, cache_dir: str = None) -> tuple:
+    """Integrate a series of 2D images into a single stacked array
+
+    Args:
+        Same as integrate_series
+
+    Returns:
+        tuple: 2theta values and intensities, an array (number of images, npt) for total integration
+            or (number of images, number of groups, npt) for sectors
+    """
+    tth, stack = None, []
+    for index, tth, intensity in integrate_series(paths, poni, dark, npt, sectors, workers, cache_dir):
+        stack.append(intensity)
+    if not stack:
+        return None, np.empty((0, int(npt)))
+    return tth, np.stack(stack)
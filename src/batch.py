@@ -0,0 +1,351 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# GUI import
+from colored import stylize, attr, fg, set_tty_aware
+set_tty_aware(False)
+# Imports for the integration of every series of a campaign
+import os
+import json
+import argparse
+import itertools
+from fnmatch import fnmatch
+import src.utils as IXR2D
+from src.readers import frame_basename, CONTAINER_EXTENSIONS
+from src.report import RunReport
+from src.integration import (series_settings, bin_series, evict_results, report_failures, write_report,
+                             init_worker, swap_worker, integrate_image, pool_map, track_results, finalize_outputs,
+                             output_folder, save_stats)
+from src.frame_stats import STATS_SUFFIX
+
+# Configuration of the batch, looked for in the root folder
+CONFIG_FILE = 'integxr2d_batch.json'
+# Options of the integration action given as file paths, relative to the configuration file
+PATH_OPTIONS = ('PONI', 'DARK', 'MONITOR', 'BACKGROUND', 'CACHE_DIR')
+# Options of the integration action without meaning for a batch
+IGNORED_OPTIONS = ('IMAGES_2D', 'FILE_PATTERN', 'DELIMITER_ON', 'TOTAL_INTEG', 'CAKE_INTEG', 'CAKE_EXPORT',
+                   'OUTPUT_FORMAT', 'SWEEP', 'SHARD', 'WATCH', 'STREAM', 'WORKERS', 'REPORT')
+# Values of the options missing from the configuration, as in the integration action
+DEFAULT_OPTIONS = {'DARK': None, 'ACCEL': 'Yes', 'ICOR': 0, 'PARTIAL_INTEG': None}
+
+
+def ui_batch(action):
+    # UI for the integration of every series found below a folder
+    batch = action.add_parser(
+        'batch', prog='Batch integration')
+    groupBatch = batch.add_argument_group(
+        "Integration of every series of a campaign")
+    groupBatch.add_argument(
+        'ROOT',
+        metavar='Campaign folder',
+        help='Folder searched recursively for series of 2D images, named with a - or _ delimiter before the numbering',
+        widget='DirChooser',
+        gooey_options={
+            'full_width': True,
+        }
+    )
+    groupBatch.add_argument(
+        '--CONFIG',
+        metavar='Batch configuration',
+        help=f'JSON file pairing the series with their .poni file, dark and integration options, '
+             f'defaults to {CONFIG_FILE} in the campaign folder',
+        widget='FileChooser',
+        gooey_options={
+            'full_width': True,
+        }
+    )
+    groupBatch.add_argument(
+        '--WORKERS',
+        metavar='Number of workers',
+        default=1, type=int,
+        help='Processes sharing a single queue of the images of every series'
+    )
+    groupBatch.add_argument(
+        '--DRY_RUN',
+        metavar='List the series',
+        action='store_true',
+        help='List the series found with their calibration, without integrating them'
+    )
+    groupBatch.add_argument(
+        '--REPORT',
+        metavar='Run report',
+        action='store_true',
+        help='Save a JSON report of the whole batch in the campaign folder'
+    )
+
+
+def load_config(file: str) -> dict:
+    """Load the configuration of a batch:
+    {"defaults": {options}, "series": {"folder/pattern": {options}}, "exclude": ["folder/pattern"]}
+    Options are those of the integration action, e.g. PONI, DARK, NPT, ICOR, PARTIAL_INTEG, ACCEL.
+    Series keys are shell-style patterns on the folder, relative to the campaign folder, and the file
+    name pattern, e.g. "sample_A/*" or "*/Sample_B": every matching entry applies, the last one wins.
+
+    Args:
+        file (str): JSON configuration file
+
+    Raises:
+        ValueError: Unreadable configuration
+
+    Returns:
+        dict: Configuration, paths made absolute
+    """
+    try:
+        with open(file) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as error:
+        raise ValueError(f"Unreadable batch configuration {file}: {error}") from None
+
+    folder = os.path.dirname(os.path.abspath(file))
+    sections = [config.setdefault('defaults', {})] + list(config.setdefault('series', {}).values())
+    for options in sections:
+        for option in PATH_OPTIONS:
+            if options.get(option):
+                options[option] = os.path.join(folder, options[option])
+    config.setdefault('exclude', [])
+    return config
+
+
+def series_options(config: dict, name: str) -> dict:
+    """Integration options of a series from the configuration
+
+    Args:
+        config (dict): Configuration of the batch
+        name (str): Folder of the series relative to the campaign folder, and file name pattern, e.g. sample_A/Sample_A
+
+    Returns:
+        dict: Options of the integration action
+    """
+    options = dict(DEFAULT_OPTIONS)
+    options.update(config['defaults'])
+    for key, values in config['series'].items():
+        if fnmatch(name, key):
+            options.update(values)
+    return {option: value for option, value in options.items() if option not in IGNORED_OPTIONS}
+
+
+def discover_series(root: str) -> list:
+    """Series of 2D images below a folder, grouped by folder and file name pattern
+
+    Args:
+        root (str): Campaign folder
+
+    Returns:
+        list: (folder, pattern, images) of each series, images sorted by index
+    """
+    series = []
+    for folder, folders, files in os.walk(root):
+        # Hidden folders and work folders of the sharded integration are skipped
+        folders[:] = sorted(name for name in folders if not name.startswith('.') and not name.endswith('_SHARDS'))
+        if not any(name.endswith(('.cbf',) + CONTAINER_EXTENSIONS) for name in files):
+            continue
+
+        imagesArray = []
+        IXR2D.file_parser(folder, imagesArray, [], accel=False)
+        patterns = {}
+        for img in imagesArray:
+            try:
+                pattern = IXR2D.delimiter_parser(frame_basename(img))[1]
+            except ValueError:
+                continue
+            patterns.setdefault(pattern, []).append(img)
+        series.extend((folder, pattern, images) for pattern, images in sorted(patterns.items()))
+    return series
+
+
+def prepare_series(root: str, config: dict) -> list:
+    """Integration settings of every series of a campaign
+
+    Args:
+        root (str): Campaign folder
+        config (dict): Configuration of the batch
+
+    Returns:
+        list: (name, PONI, DARK, settings, images) of each series to integrate
+    """
+    prepared = []
+    for folder, pattern, images in discover_series(root):
+        name = os.path.relpath(os.path.join(folder, pattern), root).replace(os.sep, '/')
+        if any(fnmatch(name, key) for key in config['exclude']):
+            continue
+        options = series_options(config, name)
+        options['ACCEL'] = 'Yes' if options['ACCEL'] in (True, 'Yes') else 'No'
+        if not options.get('PONI') or not options.get('NPT'):
+            print(stylize(f'>> {name}: no PONI or NPT in the configuration, series skipped', fg("red") + attr("bold")))
+            continue
+
+        args = argparse.Namespace(**dict(options, IMAGES_2D=folder, FILE_PATTERN=pattern, DELIMITER_ON=True,
+                                         TOTAL_INTEG=not options['PARTIAL_INTEG']))
+        try:
+            settings = series_settings(args)
+        except (OSError, ValueError) as error:
+            print(stylize(f'>> {name}: {error}, series skipped', fg("red") + attr("bold")))
+            continue
+
+        # Acceleration frames have an odd numbering
+        if settings['accel']:
+            images = [img for img in images if IXR2D.delimiter_parser(frame_basename(img))[0] % 2 == 0]
+        BIN_SIZE = options.get('BIN_SIZE', 1) or 1
+        if BIN_SIZE > 1:
+            images = bin_series(images, settings, BIN_SIZE, options.get('BIN_STEP', 0) or 0)
+        prepared.append((name, options['PONI'], options['DARK'], settings, images))
+    return prepared
+
+
+# Integration contexts of the series of a batch in the current process
+_batch = {}
+
+
+def _init_batch_worker(series: list):
+    """Keep the calibration and settings of every series of a batch, the integration contexts
+    being created by the process on first use
+
+    Args:
+        series (list): (PONI, DARK, settings) of each series
+    """
+    _batch['series'] = series
+    _batch['contexts'] = {}
+    _batch['current'] = None
+
+
+def _use_series(i: int) -> dict:
+    """Switch the process to the integration context of a series: engine, dark and result cache.
+    Series with the same calibration, dark and sectors share their context.
+
+    Args:
+        i (int): Index of the series in the batch
+
+    Returns:
+        dict: Integration settings of the series
+    """
+    PONI, DARK, settings = _batch['series'][i]
+    key = (PONI, DARK, settings['npt_tth'], repr(settings['axes']), settings['low_memory'],
+           settings['cache_dir'], settings['result_cache'])
+    if key != _batch['current']:
+        previous = swap_worker(_batch['contexts'].get(key))
+        if _batch['current'] is not None:
+            _batch['contexts'][_batch['current']] = previous
+        if key not in _batch['contexts']:
+            init_worker(PONI, DARK, settings)
+        _batch['current'] = key
+    return settings
+
+
+def _integrate_batch_image(item: tuple) -> tuple:
+    """Integrate one 2D image of a series of a batch
+
+    Args:
+        item (tuple): Index of the series and 2D image
+
+    Returns:
+        tuple: Index of the series followed by the result of integrate_image
+    """
+    i, img = item
+    return (i,) + integrate_image(_use_series(i), img)
+
+
+def integrate_batch(series: list, images: list, workers: int = 1):
+    """Integrate the images of several series through a single work queue: the workers go on
+    with the next series instead of waiting for the last images of a series.
+    Results are yielded in the order of the series and of their images.
+
+    Args:
+        series (list): (PONI, DARK, settings) of each series
+        images (list): 2D images of each series
+        workers (int, optional): Number of processes. Defaults to 1.
+
+    Yields:
+        tuple: Index of the series, image name, list of written .dat files with the statistics of the frame
+            (None if the integration failed) and traceback of the failure (None if successful)
+    """
+    items = [(i, img) for i, series_images in enumerate(images) for img in series_images]
+
+    if workers <= 1 or len(items) <= 1:
+        _init_batch_worker(series)
+        yield from map(_integrate_batch_image, items)
+        return
+
+    # Lookup table of each calibration, shared by the series with the same sectors
+    engines = {}
+    for (PONI, DARK, settings), series_images in zip(series, images):
+        key = (PONI, settings['npt_tth'], repr(settings['axes']))
+        if series_images and key not in engines:
+            engines[key] = (PONI, settings, series_images[0])
+
+    yield from pool_map(_integrate_batch_image, items, workers, _init_batch_worker, (series,),
+                        list(engines.values()))
+
+
+def process_batch(series: list, images: list, workers: int = 1, report: RunReport = None) -> tuple:
+    """Integrate several series through a single work queue. Each series is finalized as soon as
+    its last image is integrated: diffractograms moved to its output folder and renumbered,
+    frame statistics saved.
+
+    Args:
+        series (list): (PONI, DARK, settings) of each series, with .dat outputs
+        images (list): 2D images of each series
+        workers (int, optional): Number of processes. Defaults to 1.
+        report (RunReport, optional): Report of the run, completed with the timings. Defaults to None.
+
+    Returns:
+        tuple: List of the images integrated and list of (image, traceback) failures, with the folder of the series
+    """
+    if report is None:
+        report = RunReport()
+
+    integrated = []
+    failures = []
+    report.start_frames(sum(len(series_images) for series_images in images))
+    results = integrate_batch(series, images, workers)
+    for i, group in itertools.groupby(results, key=lambda result: result[0]):
+        PONI, DARK, settings = series[i]
+        print(stylize(f">> Series {settings['pattern']} in {settings['folder']}", attr("bold")))
+        processedArray = []
+        series_integrated = []
+        series_failures = []
+        stats = []
+        with report.stage('integration'):
+            group = (result[1:] for result in group)
+            for img, written, error in track_results(group, settings, report, series_integrated, series_failures, stats):
+                processedArray.extend(written)
+
+        finalize_outputs(settings, processedArray, report)
+        save_stats(settings, stats, os.path.join(output_folder(settings), settings['pattern'] + STATS_SUFFIX))
+        integrated.extend(os.path.join(settings['folder'], img) for img in series_integrated)
+        failures.extend((os.path.join(settings['folder'], img), error) for img, error in series_failures)
+    return integrated, failures
+
+
+def batch_integration(args):
+    ROOT = os.path.abspath(args.ROOT)
+    CONFIG = os.path.abspath(args.CONFIG) if args.CONFIG else os.path.join(ROOT, CONFIG_FILE)
+    WORKERS = getattr(args, 'WORKERS', 1) or 1
+
+    try:
+        config = load_config(CONFIG)
+    except ValueError as error:
+        print(stylize(f'>> {error}', fg("red") + attr("bold")))
+        return
+
+    print(stylize(f">> Search of the series in {ROOT}", attr("bold")))
+    series = prepare_series(ROOT, config)
+    for name, PONI, DARK, settings, images in series:
+        mode = 'total' if settings['total'] else f"partial {settings['aperture']}°"
+        dark = os.path.basename(DARK) if DARK else 'no dark'
+        print(f"{name}: {len(images)} images, {os.path.basename(PONI)}, {dark}, {mode}")
+    if not series or getattr(args, 'DRY_RUN', False):
+        return
+
+    total = sum(len(images) for *_, images in series)
+    print(stylize(f">> Integration of {total} images of {len(series)} series shared between {WORKERS} workers",
+                  attr("bold")))
+    report = RunReport({key: value for key, value in vars(args).items() if key != 'action'})
+    integrated, failures = process_batch([(PONI, DARK, settings) for _, PONI, DARK, settings, _ in series],
+                                         [images for *_, images in series], WORKERS, report)
+    for settings in {settings['cache_dir']: settings for _, _, _, settings, _ in series}.values():
+        evict_results(settings)
+
+    report_failures(failures)
+    write_report(report, {'report': getattr(args, 'REPORT', False), 'folder': ROOT, 'pattern': 'batch'})
@@ -0,0 +1,75 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the binning of consecutive frames
+import numpy as np
+from src.readers import read_frame
+from src.frame_stats import image_stats
+
+# Extension of the name of a group of frames, integrated as a single image
+BIN_EXTENSION = '.bin'
+
+
+def bin_frames(frames: list, size: int, step: int = 0) -> list:
+    """Group consecutive frames, the last frames not filling a complete group are left out
+
+    Args:
+        frames (list): Frames sorted by index
+        size (int): Number of frames of a group
+        step (int, optional): Shift between two groups, smaller than size for a sliding window. Defaults to 0, step = size.
+
+    Returns:
+        list: List of the groups of frames
+    """
+    step = step or size
+    return [frames[start:start + size] for start in range(0, len(frames) - size + 1, step)]
+
+
+def bin_name(pattern: str, index: int, delimiter: bool) -> str:
+    """Name of a group of frames, numbered like the frames of the series
+
+    Args:
+        pattern (str): File name pattern
+        index (int): Index of the group
+        delimiter (bool): File names have a - or _ delimiter before the numbering
+
+    Returns:
+        str: e.g. Sample_X_3.bin
+    """
+    return f"{pattern}{'_' if delimiter else ''}{index}{BIN_EXTENSION}"
+
+
+def read_bin(frames: list, folder: str = '', out: np.ndarray = None, saturation: float = None):
+    """Average of a group of frames.
+    With a saturation level, the statistics of the frames are accumulated while they are read:
+    total counts and saturated pixels of every frame, largest maximum. A pixel saturated in a single
+    frame is then counted, which the mean image would hide.
+
+    Args:
+        frames (list): Image files or frames of multi-frame containers
+        folder (str, optional): Folder of relative image files. Defaults to ''.
+        out (np.ndarray, optional): Buffer receiving the mean image, e.g. reused float32 frame buffer. Defaults to None.
+        saturation (float, optional): Counts from which a pixel is saturated. Defaults to None, no statistics.
+
+    Returns:
+        np.ndarray: Mean 2D image, followed by the statistics of the frames (see image_stats) with a saturation level
+    """
+    data = read_frame(frames[0], folder)
+    stats = None if saturation is None else image_stats(data, saturation)
+    if out is None:
+        total = np.array(data, dtype=np.float64)
+    else:
+        total = out
+        np.copyto(total, data, casting='unsafe')
+    for frame in frames[1:]:
+        data = read_frame(frame, folder)
+        total += data
+        if stats is not None:
+            frame_stats = image_stats(data, saturation)
+            stats[[0, 2]] += frame_stats[[0, 2]]
+            stats[1] = max(stats[1], frame_stats[1])
+    del data
+    total /= len(frames)
+    return total if stats is None else (total, stats)
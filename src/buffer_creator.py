@@ -10,6 +10,9 @@ set_tty_aware(False)
 # Imports for buffer creation
 from math import *
 import os
+import numpy as np
+from src.catalog import scan
+from src.frame_stats import exclude_files
 
 
 def ui_buffer_creator(action):
@@ -50,6 +53,28 @@ def ui_buffer_creator(action):
         help='All diffractograms will be added to the buffer file',
         action='store_true',
     )
+    # Choice of the diffractograms of a partial buffer
+    groupBuffer.add_argument(
+        '--selection',
+        metavar='Selection of the diffractograms',
+        choices=['uniform', 'changes'],
+        default='uniform',
+        help='uniform: 1 diffractogram every n files, changes: more diffractograms where the patterns change the most'
+    )
+    # Exclusion of frames from the statistics saved during the integration
+    groupBuffer.add_argument(
+        '--EXCLUDE',
+        metavar='Excluded frames',
+        nargs='*',
+        help='Exclude the diffractograms whose frame matches one of the conditions on the frame statistics, '
+             'e.g. saturated>0 total<1e6'
+    )
+    groupBuffer.add_argument(
+        '--STATS',
+        metavar='Frame statistics',
+        help='Table of frame statistics (*_frame_stats.csv), defaults to the one in the folder of the diffractograms',
+        widget='FileChooser'
+    )
 
 
 def create_buffer_file(file: str, dat_files: list) -> object:
@@ -72,6 +97,65 @@ def create_buffer_file(file: str, dat_files: list) -> object:
         "green")))
 
 
+def series_order(files: list) -> list:
+    """Sort diffractograms by their numbering
+
+    Args:
+        files (list): Diffractograms
+
+    Returns:
+        list: Diffractograms sorted by their pattern and index
+    """
+    folder = os.path.dirname(os.path.abspath(files[0]))
+    return scan(folder, (os.path.splitext(files[0])[1],)).sort(files)
+
+
+def load_intensities(files: list) -> np.ndarray:
+    """Load the intensities of a series of 2-column XY diffractograms in one array
+
+    Args:
+        files (list): Diffractograms with the same 2theta points
+
+    Returns:
+        np.ndarray: Intensities, an array (files, npt)
+    """
+    intensities = [np.loadtxt(file, comments='#', usecols=1) for file in files]
+    if len({len(cts) for cts in intensities}) > 1:
+        raise ValueError("Diffractograms do not have the same number of points")
+    return np.array(intensities)
+
+
+def select_changes(intensities: np.ndarray, size: int) -> np.ndarray:
+    """Choose the diffractograms describing best the evolution of a series.
+    The cumulated frame-to-frame change is split in equal steps, so that the
+    selected diffractograms are dense where the patterns change and sparse elsewhere.
+
+    Args:
+        intensities (np.ndarray): Intensities of the series in order, an array (frames, npt)
+        size (int): Number of diffractograms to select
+
+    Returns:
+        np.ndarray: Sorted indices of the selected diffractograms, always including the first and last ones
+    """
+    nb_frames = len(intensities)
+    if size >= nb_frames:
+        return np.arange(nb_frames)
+
+    changes = np.linalg.norm(np.diff(intensities, axis=0), axis=1)
+    cumulated = np.concatenate(([0], np.cumsum(changes)))
+    steps = np.linspace(0, cumulated[-1], size)
+    selected = np.unique(np.minimum(np.searchsorted(cumulated, steps), nb_frames - 1))
+    selected = np.union1d(selected, [0, nb_frames - 1])
+
+    # Several steps can fall on the same frame after a large change: the remaining
+    # diffractograms are taken in the middle of the largest gaps of the selection
+    while len(selected) < size:
+        gaps = np.diff(selected)
+        largest = np.argmax(gaps)
+        selected = np.insert(selected, largest + 1, selected[largest] + gaps[largest] // 2)
+    return selected
+
+
 def buffer_creator(args: object):
     """Create a buffer file from arguments received from the Gooey interface
 
@@ -84,21 +168,28 @@ def buffer_creator(args: object):
     path = args.buffer[0].replace(os.path.basename(args.buffer[0]), '')
     file_selection = []
 
+    try:
+        args.buffer = exclude_files(args.buffer, getattr(args, 'EXCLUDE', None), getattr(args, 'STATS', None))
+    except (OSError, ValueError) as error:
+        print(stylize(f'>> {error}', fg("red") + attr("bold")))
+        return
+
     for f in args.buffer:
         file_selection.append(os.path.basename(f))
 
     if args.complete_buffer == False:
         size_buffer = int(args.partial_buffer)
         nb_files = int(len(args.buffer))
-        spacer = ceil(nb_files / size_buffer)
-        print(f"Buffer file with 1 diffractogram on {spacer}")
-
-        i = 0
-        buffer = []
 
-        while i <= len(file_selection):
-            buffer.append(file_selection[i])
-            i += spacer
+        if getattr(args, 'selection', 'uniform') == 'changes':
+            files = series_order(args.buffer)
+            selected = select_changes(load_intensities(files), size_buffer)
+            buffer = [os.path.basename(files[i]) for i in selected]
+            print(f"Buffer file with the {len(buffer)} diffractograms following the largest changes")
+        else:
+            spacer = ceil(nb_files / size_buffer)
+            print(f"Buffer file with 1 diffractogram on {spacer}")
+            buffer = file_selection[::spacer]
 
         create_buffer_file(os.path.join(path, file),  buffer)
 
@@ -0,0 +1,204 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the catalog of the files of a folder
+import os
+import re
+import hashlib
+import numpy as np
+
+# File name pattern and numbering: Sample_X_000, Sample-X-000 or Sample000
+NAME_REGEX = re.compile(r'^(?P<pattern>.*?)[_-]?(?P<index>\d+)$')
+
+# Catalogs already loaded by the process, by folder and extensions
+_catalogs = {}
+
+
+def parse_name(name: str) -> tuple:
+    """Isolate the file name pattern and the numbering of a file
+
+    Args:
+        name (str): File name, with or without extension
+
+    Returns:
+        tuple: File name pattern and index, -1 if the name has no numbering
+    """
+    match = NAME_REGEX.match(os.path.splitext(name)[0])
+    if match is None:
+        return os.path.splitext(name)[0], -1
+    return match.group('pattern'), int(match.group('index'))
+
+
+class Catalog:
+    """Files of a folder with a given extension, as arrays sorted by pattern, index and name.
+
+    Each row is a file: name, pattern and index (-1 without numbering).
+    The catalog is refreshed only when the modification time of the folder changes,
+    i.e. when files are created, deleted or renamed. It holds no size nor date of the files,
+    which a file rewritten in place changes without changing the folder.
+    """
+
+    FIELDS = ('name', 'pattern', 'index')
+
+    def __init__(self, folder: str, extensions: tuple, arrays: dict, folder_mtime: int):
+        """Catalog from its arrays, use scan to build it
+
+        Args:
+            folder (str): Folder of the files
+            extensions (tuple): Extensions of the files
+            arrays (dict): Array of each field
+            folder_mtime (int): Modification time of the folder when it was scanned, in ns
+        """
+        self.folder = folder
+        self.extensions = extensions
+        self.folder_mtime = folder_mtime
+        self.name = arrays['name']
+        self.pattern = arrays['pattern']
+        self.index = arrays['index']
+        self._rows = None
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    @classmethod
+    def from_folder(cls, folder: str, extensions: tuple) -> 'Catalog':
+        """Scan a folder once
+
+        Args:
+            folder (str): Folder to scan
+            extensions (tuple): Extensions of the files to keep
+
+        Returns:
+            Catalog: Catalog of the folder
+        """
+        folder_mtime = os.stat(folder).st_mtime_ns
+        rows = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name)[1] not in extensions or not entry.is_file():
+                    continue
+                rows.append((entry.name, *parse_name(entry.name)))
+
+        columns = list(zip(*rows)) if rows else [()] * len(cls.FIELDS)
+        arrays = {
+            'name': np.array(columns[0], dtype=str),
+            'pattern': np.array(columns[1], dtype=str),
+            'index': np.array(columns[2], dtype=np.int64),
+        }
+        order = np.lexsort((arrays['name'], arrays['index'], arrays['pattern']))
+        return cls(folder, extensions, {key: array[order] for key, array in arrays.items()}, folder_mtime)
+
+    def save(self, file: str):
+        """Save the catalog, written to a temporary file then renamed
+
+        Args:
+            file (str): .npz file
+        """
+        # src.utils imports this module
+        from src.utils import atomic_write
+
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with atomic_write(file, 'wb') as f:
+            np.savez(f, folder=self.folder, extensions=np.array(self.extensions),
+                     folder_mtime=self.folder_mtime,
+                     **{key: getattr(self, key) for key in self.FIELDS})
+
+    @classmethod
+    def load(cls, file: str) -> 'Catalog':
+        """Load a catalog saved with save
+
+        Args:
+            file (str): .npz file
+
+        Returns:
+            Catalog: Catalog of the folder
+        """
+        with np.load(file) as f:
+            return cls(str(f['folder']), tuple(f['extensions'].tolist()),
+                       {key: f[key] for key in cls.FIELDS}, int(f['folder_mtime']))
+
+    def select(self, pattern: str = None, accel: bool = False, numbered: bool = False) -> np.ndarray:
+        """Rows of the catalog matching the criteria
+
+        Args:
+            pattern (str, optional): File name pattern. Defaults to None, all patterns.
+            accel (bool, optional): Keep only the even indices, the odd ones being acquired during the beam acceleration. Defaults to False.
+            numbered (bool, optional): Keep only the files with a numbering. Defaults to False.
+
+        Returns:
+            np.ndarray: Boolean mask of the rows
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if pattern is not None:
+            mask &= self.pattern == pattern
+        if numbered or accel:
+            mask &= self.index >= 0
+        if accel:
+            mask &= self.index % 2 == 0
+        return mask
+
+    def files(self, pattern: str = None, accel: bool = False, numbered: bool = False) -> list:
+        """File names matching the criteria, sorted by pattern and index
+
+        Args:
+            Same as select
+
+        Returns:
+            list: File names
+        """
+        return self.name[self.select(pattern, accel, numbered)].tolist()
+
+    def sort(self, names: list) -> list:
+        """Sort file names of the folder by pattern and index, names outside the catalog come last
+
+        Args:
+            names (list): File names, the folder being ignored
+
+        Returns:
+            list: Same names, sorted
+        """
+        if self._rows is None:
+            self._rows = {name: row for row, name in enumerate(self.name.tolist())}
+        return sorted(names, key=lambda name: self._rows.get(os.path.basename(name), len(self)))
+
+
+def _catalog_file(folder: str, extensions: tuple, cache_dir: str) -> str:
+    key = hashlib.sha1(repr((folder, extensions)).encode()).hexdigest()
+    return os.path.join(cache_dir, key + '.npz')
+
+
+def scan(folder: str, extensions: tuple, cache_dir: str = None) -> Catalog:
+    """Catalog of the files of a folder, scanned again only if the folder changed since the last scan
+
+    Args:
+        folder (str): Folder to scan
+        extensions (tuple): Extensions of the files to keep, e.g. ('.cbf',)
+        cache_dir (str, optional): Folder of the catalogs saved between runs. Defaults to None, catalogs kept in memory only.
+
+    Returns:
+        Catalog: Catalog of the folder
+    """
+    folder = os.path.abspath(folder)
+    extensions = tuple(sorted(extensions))
+    folder_mtime = os.stat(folder).st_mtime_ns
+
+    catalog = _catalogs.get((folder, extensions))
+    if catalog is None and cache_dir:
+        try:
+            catalog = Catalog.load(_catalog_file(folder, extensions, cache_dir))
+        except (OSError, ValueError, KeyError):
+            catalog = None
+
+    if catalog is None or catalog.folder_mtime != folder_mtime:
+        catalog = Catalog.from_folder(folder, extensions)
+        if cache_dir:
+            try:
+                catalog.save(_catalog_file(folder, extensions, cache_dir))
+            except OSError:
+                # The catalog is only a cache, the scan result is still used
+                pass
+
+    _catalogs[(folder, extensions)] = catalog
+    return catalog
@@ -0,0 +1,107 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Command-line entry point, without Gooey nor any display
+import sys
+import argparse
+import importlib
+
+# Action name: module, UI function and processing function of the action
+ACTIONS = {
+    'integration': ('src.integration', 'ui_integration', 'integrateXRD'),
+    'create_buffer': ('src.buffer_creator', 'ui_buffer_creator', 'buffer_creator'),
+    'reverse_fp': ('src.reverse_fp', 'ui_reverse_fp', 'reverse_fp'),
+    'viewer_2D': ('src.viewer_2D', 'ui_viewer_2D', 'viewer_2D'),
+    'export_stack': ('src.export_stack', 'ui_export_stack', 'export_stack'),
+    'batch': ('src.batch', 'ui_batch', 'batch_integration'),
+}
+# Short description of each action, listed without importing its module
+DESCRIPTIONS = {
+    'integration': 'Total, partial or cake integration of 2D diffractograms',
+    'create_buffer': 'Create a WinPLOTR buffer file',
+    'reverse_fp': 'Reverse the diffractogram order',
+    'viewer_2D': 'Convert 2D images to TIFF',
+    'export_stack': 'Export frames of a stacked .ixr file to .dat files',
+    'batch': 'Integration of every series found below a campaign folder',
+}
+# Keyword arguments only understood by GooeyParser
+GOOEY_KWARGS = ('widget', 'gooey_options')
+
+
+class PlainParser:
+    """argparse parser, group or subparsers accepting the Gooey keyword arguments of the
+    ui_xxx functions, which are dropped, so the same UI definitions build the command line
+    """
+
+    def __init__(self, parser: object):
+        self._parser = parser
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._parser, name)
+
+    def add_argument(self, *args, **kwargs) -> argparse.Action:
+        return self._parser.add_argument(*args, **_plain(kwargs))
+
+    def add_argument_group(self, *args, **kwargs) -> 'PlainParser':
+        return PlainParser(self._parser.add_argument_group(*args, **_plain(kwargs)))
+
+    def add_mutually_exclusive_group(self, *args, **kwargs) -> 'PlainParser':
+        return PlainParser(self._parser.add_mutually_exclusive_group(*args, **_plain(kwargs)))
+
+    def add_parser(self, *args, **kwargs) -> 'PlainParser':
+        # The prog of an action is its title in Gooey, the usage shows the command instead
+        kwargs = _plain(kwargs)
+        title = kwargs.pop('prog', None)
+        kwargs.setdefault('description', title)
+        return PlainParser(self._parser.add_parser(*args, **kwargs))
+
+
+def _plain(kwargs: dict) -> dict:
+    """Keyword arguments without the Gooey-only ones.
+    The metavar is the label of the field in Gooey: it is used as help if none is given,
+    argparse then shows the argument name.
+    """
+    kwargs = {key: value for key, value in kwargs.items() if key not in GOOEY_KWARGS}
+    label = kwargs.pop('metavar', None)
+    if label is not None and 'help' not in kwargs:
+        kwargs['help'] = label
+    return kwargs
+
+
+def build_parser(argv: list) -> argparse.ArgumentParser:
+    """Build the command-line parser.
+    Only the module of the action given in argv is imported, the other actions are listed
+    with their description.
+
+    Args:
+        argv (list): Command-line arguments, without the program name
+
+    Returns:
+        argparse.ArgumentParser: Parser of the command line
+    """
+    parser = argparse.ArgumentParser(
+        prog='IntegXR2D_cli', description='Partial and total integration of 2D diffractograms')
+    action = parser.add_subparsers(help='action', dest='action', required=True)
+
+    chosen = argv[0] if argv and argv[0] in ACTIONS else None
+    for name in ACTIONS:
+        if name == chosen:
+            module, ui, _ = ACTIONS[name]
+            getattr(importlib.import_module(module), ui)(PlainParser(action))
+        elif chosen is None:
+            action.add_parser(name, help=DESCRIPTIONS[name])
+    return parser
+
+
+def main(argv: list = None):
+    """Parse the command line and run the chosen action
+
+    Args:
+        argv (list, optional): Command-line arguments, without the program name. Defaults to sys.argv[1:].
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser(argv).parse_args(argv)
+    module, _, run = ACTIONS[args.action]
+    getattr(importlib.import_module(module), run)(args)
@@ -0,0 +1,122 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the integration engine
+import os
+import hashlib
+from src.sector import SectorIntegrator
+from src.utils import atomic_write
+
+# Default folder of the integration matrix cache
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'IntegXR2D')
+
+# Sectors of the total integration: a single 360° sector
+TOTAL_GROUPS = ([[-180, 180]],)
+
+
+class IntegrationEngine:
+    """Integration engine kept for the whole run.
+
+    The sparse lookup table mapping the pixels to the 2theta bins of each sector
+    (see SectorIntegrator) is computed once per image shape, kept in memory and
+    persisted on disk. The cache file is keyed by the content of the .poni file,
+    the detector shape, the number of points and the sectors, so that a new run
+    on the same geometry loads it instead of recomputing the 2theta/chi arrays.
+    """
+
+    def __init__(self, PONI: str, npt: int, groups: tuple = None, cache_dir: str = CACHE_DIR):
+        """Prepare the engine, the geometry is only loaded if the lookup table is not cached
+
+        Args:
+            PONI (str): Detector calibration .poni file
+            npt (int): Number of points of the 1D diffractograms
+            groups (tuple, optional): Groups of [start, end] sectors in degrees. Defaults to None, total integration.
+            cache_dir (str, optional): Folder of the on-disk cache, None to disable it. Defaults to CACHE_DIR.
+        """
+        self.poni_file = PONI
+        self.npt = int(npt)
+        self.groups = groups if groups is not None else TOTAL_GROUPS
+        self.cache_dir = cache_dir
+        with open(PONI, 'rb') as f:
+            self._poni_content = f.read()
+        self._poni = None
+        self._integrators = {}
+
+    @property
+    def poni(self) -> object:
+        """pyFAI geometry, loaded on first use"""
+        if self._poni is None:
+            import pyFAI
+            self._poni = pyFAI.load(self.poni_file)
+        return self._poni
+
+    def cache_key(self, shape: tuple) -> str:
+        """Key of the lookup table in the on-disk cache
+
+        Args:
+            shape (tuple): Shape of the 2D images
+
+        Returns:
+            str: Hash of the geometry and integration parameters
+        """
+        key = hashlib.sha256(self._poni_content)
+        key.update(repr((tuple(int(n) for n in shape), self.npt,
+                         [[tuple(float(a) for a in sector) for sector in group]
+                          for group in self.groups])).encode())
+        return key.hexdigest()
+
+    def integrator(self, shape: tuple) -> SectorIntegrator:
+        """Lookup table for an image shape, from memory, from the on-disk cache or computed
+
+        Args:
+            shape (tuple): Shape of the 2D images
+
+        Returns:
+            SectorIntegrator: Integrator of the sectors of the engine
+        """
+        shape = tuple(int(n) for n in shape)
+        if shape in self._integrators:
+            return self._integrators[shape]
+
+        integrator = None
+        cache_file = None
+        if self.cache_dir:
+            cache_file = os.path.join(self.cache_dir, self.cache_key(shape) + '.npz')
+            if os.path.exists(cache_file):
+                try:
+                    integrator = SectorIntegrator.load(cache_file)
+                except Exception:
+                    integrator = None
+
+        if integrator is None:
+            integrator = SectorIntegrator(self.poni, shape, self.npt, self.groups)
+            if cache_file:
+                self._save(integrator, cache_file)
+
+        self._integrators[shape] = integrator
+        return integrator
+
+    def _save(self, integrator: SectorIntegrator, cache_file: str):
+        """Write a lookup table to the cache, atomically so that concurrent workers never read a partial file"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(cache_file, 'wb') as f:
+                integrator.save(f)
+        except OSError:
+            # The cache is an optimization, integration goes on without it
+            pass
+
+    def integrate(self, data, dark=None) -> tuple:
+        """Integrate every group of sectors of an image
+
+        Args:
+            data (np.ndarray): 2D image
+            dark (np.ndarray, optional): Dark image subtracted from data. Defaults to None.
+
+        Returns:
+            tuple: 2theta values and array (number of groups, npt) of the intensities
+        """
+        integrator = self.integrator(data.shape)
+        return integrator.radial, integrator.integrate(data, dark)
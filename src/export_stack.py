@@ -0,0 +1,65 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# GUI import
+from colored import stylize, attr, fg, set_tty_aware
+set_tty_aware(False)
+# Imports for the export of stacked diffractograms
+import os
+from src.stack import SeriesStack, export_dat
+
+
+def ui_export_stack(action):
+    # UI for exporting diffractograms from a stacked .ixr file
+    export_stack = action.add_parser(
+        'export_stack', prog='Export stacked diffractograms')
+    groupExport = export_stack.add_argument_group(
+        "Export diffractograms from a stacked .ixr file to FullProf .dat files")
+    groupExport.add_argument(
+        'STACK',
+        metavar='Stacked diffractograms',
+        help='.ixr file created by the integration with the stack output format',
+        widget='FileChooser',
+        gooey_options={
+            'validator': {
+                'test': '".ixr" in user_input',
+                'message': 'Invalid .ixr file, check extension'
+            },
+            'full_width': True,
+        }
+    )
+    groupExport.add_argument(
+        '--FIRST',
+        metavar='First frame',
+        default=0, type=int,
+        help='Position of the first frame to export in the series (0 for the first one)'
+    )
+    groupExport.add_argument(
+        '--LAST',
+        metavar='Last frame',
+        type=int,
+        help='Position of the last frame to export in the series, empty for the end of the series'
+    )
+    groupExport.add_argument(
+        '--SECTORS',
+        metavar='Sectors',
+        nargs='*',
+        help='Sectors to export (e.g. axis0 axis90), empty for all sectors'
+    )
+
+
+def export_stack(args):
+    STACK, FIRST, LAST, SECTORS = args.STACK, args.FIRST, args.LAST, args.SECTORS
+
+    stack = SeriesStack.open(STACK)
+    folder = os.path.splitext(STACK)[0]
+    stop = None if LAST is None else LAST + 1
+
+    print(stylize(f">> Export of {STACK}", attr("bold")))
+    print(f"{len(stack)} frames, sectors: {', '.join(stack.sectors)}")
+
+    written = export_dat(STACK, folder, FIRST, stop, SECTORS or None)
+
+    print(stylize(f"{len(written)} diffractograms exported to {folder}", fg("green")))
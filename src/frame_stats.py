@@ -0,0 +1,283 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the statistics of the frames of a series
+import os
+import re
+import csv
+import glob
+import warnings
+import numpy as np
+from src.catalog import parse_name
+from src.utils import atomic_write
+
+# Table of the statistics of a series, saved next to its diffractograms
+STATS_SUFFIX = '_frame_stats.csv'
+# Counts from which a pixel is saturated: 20-bit counter of the Pilatus detectors
+SATURATION = 1048575
+# Statistics of the 2D image, then of the integrated diffractogram
+IMAGE_COLUMNS = ('total', 'max', 'saturated')
+PEAK_COLUMN = 'peak_tth'
+# Condition on a column of the table, e.g. saturated>0 or I_10_12<=1e5
+CONDITION_REGEX = re.compile(r'^\s*(?P<column>\w+)\s*(?P<operator><=|>=|==|!=|<|>)\s*(?P<value>\S+)\s*$')
+OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+def parse_windows(specs: list) -> list:
+    """2theta windows given as min:max
+
+    Args:
+        specs (list): Windows, e.g. ['10:12.5', '20:21']
+
+    Returns:
+        list: (min, max) of each window, in °
+    """
+    windows = []
+    for spec in specs or []:
+        try:
+            low, high = sorted(float(value) for value in spec.split(':'))
+        except ValueError:
+            raise ValueError(f"Invalid 2theta window: {spec}, expected min:max") from None
+        windows.append((low, high))
+    return windows
+
+
+def stats_columns(windows: list) -> tuple:
+    """Columns of the table for the given 2theta windows
+
+    Args:
+        windows (list): (min, max) of each 2theta window
+
+    Returns:
+        tuple: Column names
+    """
+    return IMAGE_COLUMNS + tuple(f"I_{low:g}_{high:g}" for low, high in windows) + (PEAK_COLUMN,)
+
+
+def image_stats(data: np.ndarray, saturation: float) -> np.ndarray:
+    """Total counts, maximum and number of saturated pixels of a 2D image
+
+    Args:
+        data (np.ndarray): 2D image, before the dark subtraction
+        saturation (float): Counts from which a pixel is saturated
+
+    Returns:
+        np.ndarray: Statistics, in the order of IMAGE_COLUMNS
+    """
+    return np.array([data.sum(dtype=np.float64), data.max(), np.count_nonzero(data >= saturation)],
+                    dtype=np.float64)
+
+
+def pattern_stats(radial: np.ndarray, intensities: np.ndarray, windows: list) -> np.ndarray:
+    """Integrated intensity in each 2theta window and position of the strongest peak.
+    The sectors of a partial or cake integration are averaged first.
+
+    Args:
+        radial (np.ndarray): 2theta values
+        intensities (np.ndarray): Intensities, one row per sector
+        windows (list): (min, max) of each 2theta window
+
+    Returns:
+        np.ndarray: Integral of each window then 2theta of the maximum, NaN for an empty window
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        profile = np.nanmean(np.reshape(intensities, (-1, len(radial))), axis=0)
+    valid = np.isfinite(profile)
+
+    stats = np.full(len(windows) + 1, np.nan)
+    for i, (low, high) in enumerate(windows):
+        inside = valid & (radial >= low) & (radial <= high)
+        x, y = radial[inside], profile[inside]
+        if x.size > 1:
+            stats[i] = np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2
+    if valid.any():
+        stats[-1] = radial[valid][np.argmax(profile[valid])]
+    return stats
+
+
+class FrameStats:
+    """Statistics of the frames of a series, one row per integrated frame.
+
+    Each row holds the frame name, the index of its diffractograms (the numbering of the
+    .dat files, or of the frame in a stacked file) and one value per column.
+    """
+
+    def __init__(self, columns: tuple, frame: np.ndarray, index: np.ndarray, values: np.ndarray):
+        """Table from its arrays, use from_rows or load to build it
+
+        Args:
+            columns (tuple): Names of the columns of values
+            frame (np.ndarray): Frame names
+            index (np.ndarray): Index of the diffractograms of each frame
+            values (np.ndarray): Values, an array (frames, columns)
+        """
+        self.columns = tuple(columns)
+        self.frame = frame
+        self.index = index
+        self.values = np.reshape(values, (len(frame), len(self.columns)))
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @classmethod
+    def from_rows(cls, columns: tuple, rows: list) -> 'FrameStats':
+        """Table from (frame, index, values) rows, sorted by index
+
+        Args:
+            columns (tuple): Names of the columns of values
+            rows (list): (frame name, index, values) of each frame
+
+        Returns:
+            FrameStats: Table of the frames
+        """
+        rows = sorted(rows, key=lambda row: (row[1], row[0]))
+        frame = np.array([row[0] for row in rows], dtype=str)
+        index = np.array([row[1] for row in rows], dtype=np.int64)
+        values = np.array([row[2] for row in rows], dtype=np.float64)
+        return cls(columns, frame, index, values)
+
+    def rows(self) -> list:
+        """(frame, index, values) of each frame"""
+        return list(zip(self.frame.tolist(), self.index.tolist(), self.values))
+
+    def update(self, other: 'FrameStats') -> 'FrameStats':
+        """Table completed with the rows of another one, which replace the rows of the same index,
+        like the diffractograms written again in the folder
+
+        Args:
+            other (FrameStats): Statistics of new or integrated again frames
+
+        Returns:
+            FrameStats: Merged table, with the columns of other
+        """
+        if self.columns != other.columns:
+            return other
+        rows = {row[1]: row for row in self.rows()}
+        rows.update({row[1]: row for row in other.rows()})
+        return FrameStats.from_rows(self.columns, list(rows.values()))
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of a column, frame and index included"""
+        if name in ('frame', 'index'):
+            return getattr(self, name)
+        if name not in self.columns:
+            raise ValueError(f"Unknown column: {name}, available: {', '.join(('index',) + self.columns)}")
+        return self.values[:, self.columns.index(name)]
+
+    def select(self, conditions: list) -> np.ndarray:
+        """Rows matching at least one condition, evaluated on whole columns
+
+        Args:
+            conditions (list): Conditions such as 'saturated>0' or 'total<1e6'
+
+        Returns:
+            np.ndarray: Boolean mask of the rows
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        for condition in conditions or []:
+            match = CONDITION_REGEX.match(condition)
+            if match is None:
+                raise ValueError(f"Invalid condition: {condition}, expected e.g. saturated>0")
+            mask |= OPERATORS[match.group('operator')](
+                self.column(match.group('column')), float(match.group('value')))
+        return mask
+
+    def excluded(self, conditions: list) -> set:
+        """Index of the frames matching at least one condition
+
+        Args:
+            conditions (list): Conditions, see select
+
+        Returns:
+            set: Index of the diffractograms to exclude
+        """
+        return set(self.index[self.select(conditions)].tolist())
+
+    def save(self, file: str):
+        """Save the table as CSV, written to a temporary file then renamed
+
+        Args:
+            file (str): .csv file
+        """
+        with atomic_write(file, newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('frame', 'index') + self.columns)
+            for frame, index, values in self.rows():
+                writer.writerow([frame, index] + [f"{value:.10g}" for value in values])
+
+    @classmethod
+    def load(cls, file: str) -> 'FrameStats':
+        """Load a table saved with save
+
+        Args:
+            file (str): .csv file
+
+        Returns:
+            FrameStats: Table of the frames
+        """
+        with open(file, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = [(row[0], int(row[1]), [float(value) for value in row[2:]]) for row in reader]
+        return cls.from_rows(tuple(header[2:]), rows)
+
+
+def find_stats(folder: str) -> str:
+    """Table of statistics saved in a folder
+
+    Args:
+        folder (str): Folder of the diffractograms
+
+    Returns:
+        str: .csv file, None if the folder has no table
+    """
+    files = sorted(glob.glob(os.path.join(glob.escape(folder), '*' + STATS_SUFFIX)))
+    return files[0] if files else None
+
+
+def excluded_indices(folder: str, conditions: list, file: str = None) -> set:
+    """Index of the diffractograms excluded by conditions on the statistics of their frames
+
+    Args:
+        folder (str): Folder of the diffractograms, where the table is looked for
+        conditions (list): Conditions, see FrameStats.select
+        file (str, optional): Table to use instead of the one of the folder. Defaults to None.
+
+    Returns:
+        set: Index of the diffractograms to exclude
+    """
+    if not conditions:
+        return set()
+    file = file or find_stats(folder)
+    if file is None:
+        raise ValueError(f"No table of frame statistics (*{STATS_SUFFIX}) in {folder}")
+    return FrameStats.load(file).excluded(conditions)
+
+
+def exclude_files(files: list, conditions: list, file: str = None) -> list:
+    """Remove the diffractograms whose frame matches a condition on the statistics, without reading them
+
+    Args:
+        files (list): .dat files of a series, numbered like the table of statistics
+        conditions (list): Conditions, see FrameStats.select
+        file (str, optional): Table to use instead of the one of the folder of the files. Defaults to None.
+
+    Returns:
+        list: Files kept, in the same order
+    """
+    if not conditions or not files:
+        return list(files)
+    excluded = excluded_indices(os.path.dirname(os.path.abspath(files[0])), conditions, file)
+    kept = [name for name in files if parse_name(os.path.basename(name))[1] not in excluded]
+    print(f"{len(files) - len(kept)} diffractograms excluded by the frame statistics")
+    return kept
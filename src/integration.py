@@ -8,11 +8,23 @@ from colored import stylize, attr, fg, set_tty_aware
 set_tty_aware(False)
 # Import for handling diffractograms
 import os
-import shutil
-import pyFAI
-import fabio
-import time
+import traceback
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import src.utils as IXR2D
+from src.engine import IntegrationEngine, CACHE_DIR, TOTAL_GROUPS
+from src.result_cache import ResultCache, parameters_key, RESULT_CACHE_SIZE
+from src.pipeline import stream
+from src.watch import watch_folder
+from src.stack import SeriesStack, EXTENSION, export_dat
+from src.report import RunReport, file_size
+from src.readers import read_frame, frame_basename, split_frame, nb_frames
+from src.postprocess import PostProcessing, load_monitor, load_background
+from src.binning import bin_frames, bin_name, read_bin
+from src.frame_stats import (FrameStats, STATS_SUFFIX, SATURATION, parse_windows, stats_columns,
+                             image_stats, pattern_stats)
+import numpy as np
 
 
 
@@ -28,7 +40,7 @@ def ui_integration(action):
     groupInteg.add_argument(
         "IMAGES_2D",
         metavar='Images 2D',
-        help="Folder containing ONLY 2D images to integrate",
+        help="Folder containing ONLY 2D images to integrate: .cbf files or multi-frame HDF5/NeXus (.h5, .nxs) and EDF files",
         widget="DirChooser",
         gooey_options={
             'full_width': True,
@@ -101,6 +113,26 @@ def ui_integration(action):
         metavar='Intensity correction', default=0, type=int,
         help='Intensity to shift the diffractogram'
     )
+    # Normalization of the intensity
+    groupOptionInteg.add_argument(
+        '--SCALE',
+        metavar='Scale factor', default=1.0, type=float,
+        help='Factor applied to the intensity of every diffractogram'
+    )
+    groupOptionInteg.add_argument(
+        "--MONITOR", help="2-column file (frame index, monitor) to normalize each diffractogram by its monitor",
+        widget="FileChooser"
+    )
+    # Background subtraction
+    groupOptionInteg.add_argument(
+        "--BACKGROUND", help="Reference background diffractogram (2-column XY file) to subtract",
+        widget="FileChooser"
+    )
+    groupOptionInteg.add_argument(
+        '--BACKGROUND_POLY',
+        metavar='Fitted background', default=0, type=int,
+        help='Degree of a polynomial background fitted and subtracted from each diffractogram, 0 to disable it'
+    )
     # Creation of a group for a mutually exclusive choice for the circular integration
     azymInteg = groupOptionInteg.add_mutually_exclusive_group(
         required=True,
@@ -123,179 +155,1325 @@ def ui_integration(action):
         type=int,
         gooey_options={
             'validator': {
-                'test': 'int(user_input) < 90',
-                'message': 'Please enter an angle value less than 90°'
+                'test': '0 < int(user_input) < 90',
+                'message': 'Please enter an angle value between 0 and 90°'
+            }
+        },
+    )
+    # Cake integration
+    azymInteg.add_argument(
+        '--CAKE_INTEG',
+        metavar='Cake integration',
+        help='Enter the number of azimuthal sectors integrated at once, saved in a stacked file',
+        type=int,
+        gooey_options={
+            'validator': {
+                'test': '1 < int(user_input) <= 360',
+                'message': 'Please enter a number of sectors between 2 and 360'
             }
         },
     )
+    groupOptionInteg.add_argument(
+        '--CAKE_EXPORT',
+        metavar='Cake sectors to export',
+        nargs='*',
+        help='Sectors of the cake integration exported to .dat files (e.g. axis0 axis90)'
+    )
+    # Number of processes sharing the images
+    groupOptionInteg.add_argument(
+        '--WORKERS',
+        metavar='Number of workers',
+        default=1, type=int,
+        help='Number of processes integrating images in parallel'
+    )
+    # Streaming mode, decoding and writing in background threads
+    groupOptionInteg.add_argument(
+        '--STREAM',
+        metavar='Streaming mode',
+        action='store_true',
+        help='Decode the next images and write the diffractograms in background threads during the integration (single worker)'
+    )
+    groupOptionInteg.add_argument(
+        '--QUEUE_DEPTH',
+        metavar='Streaming queue depth',
+        default=4, type=int,
+        help='Number of images waiting between two stages of the streaming mode, limits the memory used'
+    )
+    # Cache of the integration lookup tables
+    groupOptionInteg.add_argument(
+        '--CACHE_DIR',
+        metavar='Integration cache folder',
+        default=CACHE_DIR,
+        help='Folder keeping the precomputed integration matrices between runs on the same geometry, and the list of the images of the folder',
+        widget="DirChooser",
+    )
+    groupOptionInteg.add_argument(
+        '--NO_CACHE',
+        metavar='Disable integration cache',
+        action='store_true',
+        help='Do not read or write the integration matrices, diffractograms and list of images on disk'
+    )
+    # Cache of the integrated diffractograms
+    groupOptionInteg.add_argument(
+        '--RESULT_CACHE_SIZE',
+        metavar='Result cache size (MB)',
+        default=RESULT_CACHE_SIZE, type=float,
+        help='Size limit of the cache of the integrated diffractograms, reused when only the post-processing or the output changes, '
+             '0 (default) to disable it. Each frame is then read twice on the first run and its diffractograms written to the cache folder'
+    )
+    # Other integrations of the same decoded frames
+    groupOptionInteg.add_argument(
+        '--SWEEP',
+        metavar='Parameter sweep',
+        nargs='*',
+        help='Other integrations run on each decoded frame, written to their own folder: '
+             'full or azimA (A: aperture in °), followed by :N for N points, e.g. full:3000 azim10 azim30:2000'
+    )
+    # Integration shared between independent workers
+    groupOptionInteg.add_argument(
+        '--SHARD',
+        metavar='Sharded integration',
+        action='store_true',
+        help='Share the series with other IntegXR2D runs on the same folder, from this node or other nodes of a shared '
+             'file system: each run claims batches of images, the last one merges the diffractograms. '
+             'Delete the <output folder>_SHARDS folder to integrate the series again'
+    )
+    groupOptionInteg.add_argument(
+        '--SHARD_BATCH',
+        metavar='Shard batch size',
+        default=100, type=int,
+        help='Number of images claimed at once by a run'
+    )
+    groupOptionInteg.add_argument(
+        '--SHARD_TIMEOUT',
+        metavar='Shard claim timeout (h)',
+        default=0, type=float,
+        help='Time without progress after which a batch or the merge claimed by a stopped run can be claimed again, 0 to never'
+    )
+    # Memory use of the integration processes
+    groupOptionInteg.add_argument(
+        '--LOW_MEMORY',
+        metavar='Low-memory mode',
+        action='store_true',
+        help='Decode the images in a reused float32 buffer, subtract the dark in place and integrate the pixels by chunks, '
+             'for large detectors with many workers'
+    )
+    # Binning of consecutive frames before integration
+    groupOptionInteg.add_argument(
+        '--BIN_SIZE',
+        metavar='Binning',
+        default=1, type=int,
+        help='Number of consecutive frames summed or averaged before integration, 1 to integrate every frame'
+    )
+    groupOptionInteg.add_argument(
+        '--BIN_STEP',
+        metavar='Binning step',
+        default=0, type=int,
+        help='Shift in frames between two bins, smaller than the binning for a sliding window, 0 for consecutive bins'
+    )
+    groupOptionInteg.add_argument(
+        '--BIN_MODE',
+        metavar='Binning mode',
+        choices=['sum', 'mean'],
+        default='sum',
+        help='Sum or average of the frames of a bin'
+    )
+    # Statistics of each frame for the triage of the series
+    groupOptionInteg.add_argument(
+        '--FRAME_STATS',
+        metavar='Frame statistics',
+        action='store_true',
+        help='Save a table with the total counts, maximum, saturated pixels, integrated intensity in 2theta windows '
+             'and strongest peak position of each frame, next to the diffractograms. '
+             'The image statistics of a group of binned frames cover all its frames'
+    )
+    groupOptionInteg.add_argument(
+        '--STATS_WINDOWS',
+        metavar='2theta windows of the statistics',
+        nargs='*',
+        help='2theta windows integrated in the frame statistics, as min:max in °, e.g. 10:12.5 20:21'
+    )
+    groupOptionInteg.add_argument(
+        '--SATURATION',
+        metavar='Saturation level',
+        default=SATURATION, type=float,
+        help='Counts from which a pixel is saturated in the frame statistics'
+    )
+    # Output format of the diffractograms
+    groupOptionInteg.add_argument(
+        '--OUTPUT_FORMAT',
+        metavar='Output format',
+        choices=['dat', 'stack'],
+        default='dat',
+        help='dat: one FullProf .dat file per diffractogram - stack: the whole series in a single .ixr file, .dat files can be exported from it'
+    )
+    # Run report
+    groupOptionInteg.add_argument(
+        '--REPORT',
+        metavar='Run report',
+        action='store_true',
+        help='Save a JSON report with the time of each stage and frame, the bytes read and written and the failures'
+    )
+    # Watch mode, integration of the new frames during the experiment
+    groupOptionInteg.add_argument(
+        '--WATCH',
+        metavar='Watch folder',
+        action='store_true',
+        help='Keep integrating the frames written in the folder, frames already integrated are skipped'
+    )
+    groupOptionInteg.add_argument(
+        '--WATCH_INTERVAL',
+        metavar='Watch interval (s)',
+        default=10, type=float,
+        help='Time between two scans of the folder'
+    )
+    groupOptionInteg.add_argument(
+        '--WATCH_IDLE',
+        metavar='Watch timeout (s)',
+        default=0, type=float,
+        help='Stop watching after this time without new frame, 0 to watch until stopped'
+    )
 
 
-def integrateXRD(args):
-    IMAGES_2D, PONI, DARK, ACCEL, NPT, ICOR = [
-        args.IMAGES_2D, args.PONI, args.DARK, args.ACCEL, args.NPT, args.ICOR]
-    TOTAL_INTEG, PARTIAL_INTEG = [args.TOTAL_INTEG, args.PARTIAL_INTEG]
-    DELIMITER_ON, FILE_PATTERN = [args.DELIMITER_ON, args.FILE_PATTERN]
+# Integration engine and dark of the current process, loaded once per worker
+_worker = {}
 
-    poni = pyFAI.load(PONI)
 
-    if DARK:
-        dark = fabio.open(DARK)
+def init_worker(PONI: str, DARK: str, settings: dict):
+    """Load the integration engine and the dark once for the process integrating images
+
+    Args:
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        settings (dict): Integration settings shared by every image of the series
+    """
+    _worker['poni'] = PONI
+    _worker['engines'] = {}
+    _engine(settings)
+    import fabio
+    _worker['dark'] = fabio.open(DARK) if DARK else None
+    _worker['buffer'] = None
+    _worker['image_stats'] = {}
+    # Low-memory mode: float32 dark subtracted in place from the reused frame buffer
+    if settings['low_memory'] and _worker['dark'] is not None:
+        _worker['dark'] = np.asarray(_worker['dark'].data, dtype=np.float32)
+    _worker['results'] = None
+    if settings['cache_dir'] and settings['result_cache'] > 0:
+        _worker['results'] = ResultCache(
+            os.path.join(settings['cache_dir'], 'results'),
+            parameters_key(PONI, DARK, settings['npt_tth'], settings['axes'] or TOTAL_GROUPS),
+            settings['result_cache'])
+
+
+def swap_worker(context: dict = None) -> dict:
+    """Replace the integration context of the process (engines, dark, result cache), e.g. to switch
+    between the series of a batch without loading their calibration and dark again
+
+    Args:
+        context (dict, optional): Context returned by a previous call. Defaults to None, empty context.
+
+    Returns:
+        dict: Previous context of the process
+    """
+    previous = dict(_worker)
+    _worker.clear()
+    _worker.update(context or {})
+    return previous
+
+
+def _engine(settings: dict) -> IntegrationEngine:
+    """Integration engine of the process for a number of points and sectors, created on first use
+
+    Args:
+        settings (dict): Integration settings of the series
+
+    Returns:
+        IntegrationEngine: Engine of the settings
+    """
+    key = (settings['npt_tth'], repr(settings['axes']))
+    if key not in _worker['engines']:
+        _worker['engines'][key] = IntegrationEngine(_worker['poni'], settings['npt_tth'], settings['axes'],
+                                                    settings['cache_dir'])
+    return _worker['engines'][key]
+
+
+def _read_image(settings: dict, img: str) -> tuple:
+    """Decode a 2D image of the series, unless its diffractograms are in the result cache
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image file or frame of a multi-frame container
+
+    Returns:
+        tuple: 2D image (None if cached), result cache key (None without cache)
+            and cached (2theta, intensities, chi range, image statistics) (None if not cached)
+    """
+    results = _worker.get('results')
+
+    # Group of binned frames, averaged
+    members = settings['bins'].get(img)
+    if members is not None:
+        if results is None:
+            return _decode(settings, img), None, None
+        content = b''.join(_frame_digest(settings, member) for member in members)
+        key = results.frame_key(content + settings['bin_mode'].encode())
+        cached = _cached(settings, key)
+        if cached is not None:
+            return None, key, cached
+        return _decode(settings, img), key, None
+
+    if results is None:
+        return _decode(settings, img), None, None
+
+    # Single-frame files are identified by their bytes, without decoding them
+    file, index = split_frame(img)
+    if index is None:
+        with open(os.path.join(settings['folder'], file), 'rb') as f:
+            key = results.frame_key(f.read())
+        cached = _cached(settings, key)
+        if cached is not None:
+            return None, key, cached
+        return _decode(settings, img), key, None
+
+    data = _decode(settings, img)
+    key = results.frame_key(data.tobytes() + repr((data.shape, data.dtype.str)).encode())
+    return data, key, _cached(settings, key)
+
+
+def _cached(settings: dict, key: str) -> tuple:
+    """Diffractograms of a frame in the result cache.
+    With frame statistics, entries without the statistics of the image at the saturation level
+    of the run are ignored, the image is integrated again.
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        key (str): Result cache key of the frame
+
+    Returns:
+        tuple: Cached (2theta, intensities, chi range, image statistics), None if not cached
+    """
+    cached = _worker['results'].get(key)
+    if cached is None or not settings['stats']:
+        return cached
+    stats = cached[3]
+    if stats is None or stats[-1] != settings['stats']['saturation']:
+        return None
+    return cached
+
+
+def _decode(settings: dict, img: str) -> np.ndarray:
+    """Decode a 2D image or the mean of a group of binned frames.
+    In low-memory mode the image is decoded in the float32 buffer of the process, reused
+    for every image, and the dark is subtracted in place.
+    The statistics of the image are computed here, before the dark subtraction, over the frames of a group.
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image file, frame of a multi-frame container or group of binned frames
+
+    Returns:
+        np.ndarray: 2D image
+    """
+    members = settings['bins'].get(img)
+    if not settings['low_memory']:
+        if members:
+            return _read_bin(settings, img)
+        data = read_frame(img, settings['folder'])
+        _image_stats(settings, img, data)
+        return data
+
+    if members:
+        if _worker['buffer'] is None:
+            _frame_buffer(read_frame(members[0], settings['folder']).shape)
+        buffer = _read_bin(settings, img, out=_worker['buffer'])
     else:
-        dark = None
+        data = read_frame(img, settings['folder'])
+        buffer = _frame_buffer(data.shape)
+        np.copyto(buffer, data, casting='unsafe')
+        del data
+        _image_stats(settings, img, buffer)
+    if _worker['dark'] is not None:
+        buffer -= _worker['dark']
+    return buffer
 
-    npt_tth = int(NPT)
-    npt_chi = 1
 
-    imagesArray = []
-    processedArray = []
+def _read_bin(settings: dict, img: str, out: np.ndarray = None) -> np.ndarray:
+    """Mean image of a group of binned frames, the statistics of its frames being kept by the process"""
+    if not settings['stats']:
+        return read_bin(settings['bins'][img], settings['folder'], out)
+    saturation = settings['stats']['saturation']
+    data, stats = read_bin(settings['bins'][img], settings['folder'], out, saturation)
+    _worker['image_stats'][img] = np.append(stats, saturation)
+    return data
 
-    os.chdir(IMAGES_2D)
 
-    # Isolate useful diffracograms by removing those produced during beam acceleration
-    if ACCEL == 'Oui':
-        print(stylize(">> Scanning acceleration files", attr("bold")))
-        IXR2D.file_parser(IMAGES_2D, imagesArray, processedArray, accel=True)
+def _image_stats(settings: dict, img: str, data: np.ndarray):
+    """Statistics of a decoded image, kept by the process until the image is integrated"""
+    if settings['stats']:
+        _worker['image_stats'][img] = np.append(image_stats(data, settings['stats']['saturation']),
+                                                settings['stats']['saturation'])
+
+
+def _frame_buffer(shape: tuple) -> np.ndarray:
+    """Float32 frame buffer of the process, allocated again only if the image shape changes"""
+    if _worker['buffer'] is None or _worker['buffer'].shape != tuple(shape):
+        _worker['buffer'] = np.empty(shape, dtype=np.float32)
+    return _worker['buffer']
+
+
+def _frame_digest(settings: dict, img: str) -> bytes:
+    """Hash of the content of a frame
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image file or frame of a multi-frame container
+
+    Returns:
+        bytes: Hash of the file bytes, or of the decoded frame of a container
+    """
+    file, index = split_frame(img)
+    if index is None:
+        with open(os.path.join(settings['folder'], file), 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=20).digest()
+    data = read_frame(img, settings['folder'])
+    return hashlib.blake2b(data.tobytes(), digest_size=20).digest()
+
+
+def _integrate_data(settings: dict, img: str, frame: tuple) -> tuple:
+    """Integrate a decoded 2D image
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): Name of the 2D image
+        frame (tuple): Decoded 2D image, result cache key and cached result, see _read_image
+
+    Returns:
+        tuple: List of (.dat file, tth, cts, chi) diffractograms, chi is None for partial integration,
+            and statistics of the frame (None without frame statistics)
+    """
+    data, key, cached = frame
+    image = _worker['image_stats'].pop(img, None)
+    if cached is not None:
+        radial, intensities, chi_range, cached_image = cached
+        image = cached_image if image is None else image
     else:
-        IXR2D.file_parser(IMAGES_2D, imagesArray, processedArray, accel=False)
+        engine, dark = _engine(settings), _worker['dark']
+        integrator = engine.integrator(data.shape)
+        if settings['low_memory']:
+            # Dark already subtracted, the output array of the integrator is reused by the next image
+            integrator.compact()
+            intensities = integrator.integrate_low_memory(data)
+            if settings['output'] == 'stack':
+                intensities = intensities.copy()
+        else:
+            intensities = integrator.integrate(
+                data, dark.data if dark is not None else None)
+        radial, chi_range = integrator.radial, integrator.chi_range
+        # The mean image of a bin is integrated, the integration being linear the sum is the mean times the bin size
+        if img in settings['bins'] and settings['bin_mode'] == 'sum':
+            intensities = intensities * len(settings['bins'][img])
+        if key is not None:
+            _worker['results'].put(key, radial, intensities, chi_range, image)
 
-    print(f"Integration of {len(imagesArray)} diffraction images")
+    stats = _frame_stats(settings, img, radial, intensities, image) if settings['stats'] else None
 
-    # Total integration of 2D diffractograms to 1D
-    if TOTAL_INTEG == True:
-        print(stylize(">> Total integration of 2D diffractograms", attr("bold")))
+    # Intensity post-processing in memory, before the first write of the diffractograms
+    post = settings['post']
+    if post and settings['output'] == 'dat':
+        index = [_frame_index(settings, img)] if post.monitor else None
+        intensities = post.apply(radial, intensities, index)
+
+    if settings['total']:
+        chi = [sum(chi_range) / 2]
+        return [(frame_basename(img) + '.dat', radial, intensities, chi)], stats
+
+    if settings['delimiter_on']:
+        index = IXR2D.delimiter_parser(frame_basename(img))[0]
+    else:
+        index = frame_basename(img).replace(settings['pattern'], '')
+
+    patterns = []
+    for i, axis in enumerate(_sector_axes(settings)):
+        file = IXR2D.azim_filename(settings['pattern'], axis, settings['aperture'], index) + '.dat'
+        patterns.append((file, radial, intensities[i], None))
+    return patterns, stats
+
+
+def _frame_stats(settings: dict, img: str, radial: np.ndarray, intensities: np.ndarray,
+                 image: np.ndarray) -> np.ndarray:
+    """Statistics of a frame: image statistics then statistics of the diffractograms before post-processing
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): Name of the 2D image
+        radial (np.ndarray): 2theta values
+        intensities (np.ndarray): Integrated intensities
+        image (np.ndarray): Statistics of the 2D image followed by the saturation level, None if unknown
+
+    Returns:
+        np.ndarray: Values in the order of the columns of the table
+    """
+    if image is None:
+        image = np.full(4, np.nan)
+    return np.concatenate([image[:-1], pattern_stats(radial, intensities, settings['stats']['windows'])])
+
+
+def _stats_index(settings: dict, img: str) -> int:
+    """Index of the diffractograms of an image, after the simplified numbering of the total integration
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): Name of the 2D image
+
+    Returns:
+        int: Numbering of the .dat files, or index of the frame in a stacked file
+    """
+    index = _frame_index(settings, img)
+    if settings['total'] and settings['output'] == 'dat' and settings['accel'] and not settings['bins']:
+        return index // 2
+    return index
+
+
+def save_stats(settings: dict, rows: list, file: str):
+    """Save the statistics of the frames of a series, merged with the table of a previous run
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        rows (list): (image, index, values) of each frame integrated
+        file (str): .csv table
+    """
+    if not settings['stats'] or not rows:
+        return
+    table = FrameStats.from_rows(stats_columns(settings['stats']['windows']), rows)
+    if os.path.exists(file):
+        try:
+            table = FrameStats.load(file).update(table)
+        except (OSError, ValueError, IndexError):
+            pass
+    table.save(file)
+    print(stylize(f"Frame statistics saved: {os.path.basename(file)}", fg("green")))
+
+
+def _sector_axes(settings: dict) -> list:
+    """Position in ° of the axes of the partial or cake integration sectors
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+
+    Returns:
+        list: Axis of each sector
+    """
+    if settings['cake']:
+        return [IXR2D.cake_axis(i, settings['cake']) for i in range(settings['cake'])]
+    return [int(IXR2D.get_axis(i)) for i in range(len(settings['axes']))]
+
+
+def _write_patterns(settings: dict, patterns: list) -> list:
+    """Write the diffractograms of an image next to it, or in the work folder of the settings
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        patterns (list): List of (.dat file, tth, cts, chi) diffractograms
+
+    Returns:
+        list: Written .dat files
+    """
+    # Diffractograms are kept in memory for the stacked output
+    if settings['output'] == 'stack':
+        return patterns
+
+    folder = settings['work_folder'] or settings['folder']
+    written = []
+    for file, tth, cts, chi in patterns:
+        if chi is not None:
+            IXR2D.saveazi(os.path.join(folder, file), (cts),
+                        tth, chi, settings['npt_tth'], settings['npt_chi'])
+        else:
+            IXR2D.save_to_file(os.path.join(folder, file), (tth, cts))
+        written.append(file)
+    return written
+
+
+def integrate_image(settings: dict, img: str) -> tuple:
+    """Integrate one 2D image and write the resulting 1D diffractogram(s) next to it
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image to integrate
 
-        for img in imagesArray:
-            try:
-                im = fabio.open(img)
-                print(f'Processing: {im.filename}')
-                
-                if DARK:
-                    cts, tth, chi = poni.integrate2d(im.data, npt_tth, npt_chi,
-                                                    unit="2th_deg", dark=dark.data, method="cython")
-                else:
-                    cts, tth, chi = poni.integrate2d(im.data, npt_tth, npt_chi,
-                                                    unit="2th_deg", method="cython")
-                
-                filename = os.path.splitext(img)[0] + '.dat'
-                
-                IXR2D.saveazi(filename, (cts),
-                            tth, chi, npt_tth, npt_chi)
-            except:
+    Returns:
+        tuple: Image name, list of written .dat files with the statistics of the frame (None if the integration failed)
+            and traceback of the failure (None if successful)
+    """
+    try:
+        data = _read_image(settings, img)
+        patterns, stats = _integrate_data(settings, img, data)
+        written = _write_patterns(settings, patterns)
+    except Exception:
+        return img, None, traceback.format_exc()
+
+    return img, (written, stats), None
+
+
+def integrate_images(imagesArray: list, PONI: str, DARK: str, settings: dict,
+                    workers: int = 1, queue_depth: int = 0):
+    """Integrate a series of 2D images, in parallel if several workers are requested.
+    Results are yielded in the order of imagesArray whatever the number of workers.
+
+    Args:
+        imagesArray (list): 2D images to integrate
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        settings (dict): Integration settings shared by every image of the series
+        workers (int, optional): Number of processes. Defaults to 1.
+        queue_depth (int, optional): Streaming mode with decoding and writing in background threads,
+            number of images waiting between two stages. Defaults to 0, no streaming.
+
+    Yields:
+        tuple: Image name, list of written .dat files with the statistics of the frame (None if the integration failed)
+            and traceback of the failure (None if successful)
+    """
+    integrate = partial(integrate_image, settings)
+
+    if workers <= 1 or len(imagesArray) <= 1:
+        init_worker(PONI, DARK, settings)
+        if queue_depth > 0:
+            yield from stream(imagesArray,
+                              partial(_read_image, settings),
+                              partial(_integrate_data, settings),
+                              lambda img, payload: (_write_patterns(settings, payload[0]), payload[1]),
+                              depth=queue_depth)
+        else:
+            yield from map(integrate, imagesArray)
+        return
+
+    yield from pool_map(integrate, imagesArray, workers, init_worker, (PONI, DARK, settings),
+                        [(PONI, settings, imagesArray[0])])
+
+
+def image_shape(settings: dict, img: str) -> tuple:
+    """Shape of the 2D images of a series, probed on one image or group of binned frames
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image file, frame of a multi-frame container or group of binned frames
+
+    Returns:
+        tuple: Shape of the decoded image
+    """
+    return _decode(dict(settings, stats=None, low_memory=False), img).shape
+
+
+def pool_map(function, items: list, workers: int, initializer, initargs: tuple, engines: list = ()):
+    """Apply a function to every item in a pool of processes, results being yielded in the order of items.
+    The lookup tables are computed once and cached on disk first, the workers then load them
+    instead of each computing them.
+
+    Args:
+        function (callable): Function applied to each item
+        items (list): Items to process
+        workers (int): Number of processes
+        initializer (callable): Initialization of each process
+        initargs (tuple): Arguments of the initializer
+        engines (list, optional): (PONI, settings, image) of each lookup table, the image giving its shape. Defaults to ().
+
+    Yields:
+        object: Result of each item
+    """
+    shapes = {}
+    for PONI, settings, img in engines:
+        if not settings['cache_dir']:
+            continue
+        try:
+            key = (settings['folder'], img)
+            if key not in shapes:
+                shapes[key] = image_shape(settings, img)
+            IntegrationEngine(PONI, settings['npt_tth'], settings['axes'],
+                              settings['cache_dir']).integrator(shapes[key])
+        except Exception:
+            # Unreadable image: the workers compute the lookup table and report the failure
+            pass
+
+    chunksize = max(1, len(items) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                            initargs=initargs) as executor:
+        yield from executor.map(function, items, chunksize=chunksize)
+
+
+def _sweep_image(configs: list, img: str) -> tuple:
+    """Decode one 2D image and integrate it with every configuration of a sweep
+
+    Args:
+        configs (list): Integration settings of each configuration
+        img (str): 2D image to integrate
+
+    Returns:
+        tuple: Image name, list of written .dat files for each configuration and traceback of the failure (None if successful)
+    """
+    try:
+        frame = _decode(configs[0], img), None, None
+        written = [_write_patterns(config, _integrate_data(config, img, frame)[0]) for config in configs]
+    except Exception:
+        return img, [], traceback.format_exc()
+
+    return img, written, None
+
+
+def sweep_images(imagesArray: list, PONI: str, DARK: str, configs: list, workers: int = 1):
+    """Integrate a series of 2D images with several configurations, each image being decoded once
+
+    Args:
+        imagesArray (list): 2D images to integrate
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        configs (list): Integration settings of each configuration
+        workers (int, optional): Number of processes. Defaults to 1.
+
+    Yields:
+        tuple: Image name, list of written .dat files for each configuration and traceback of the failure (None if successful)
+    """
+    sweep = partial(_sweep_image, configs)
+
+    if workers <= 1 or len(imagesArray) <= 1:
+        init_worker(PONI, DARK, configs[0])
+        yield from map(sweep, imagesArray)
+        return
+
+    yield from pool_map(sweep, imagesArray, workers, init_worker, (PONI, DARK, configs[0]),
+                        [(PONI, config, imagesArray[0]) for config in configs])
+
+
+def sweep_configs(settings: dict, specs: list) -> list:
+    """Integration settings of the configurations of a sweep, the first one being the settings of the run
+
+    Args:
+        settings (dict): Integration settings of the run
+        specs (list): Other configurations: full or azimA (A: aperture in °), followed by :N for N points
+
+    Returns:
+        list: Integration settings of each configuration, with their own output folder
+    """
+    configs = [dict(settings, suffix='')]
+    for spec in specs:
+        mode, _, npt = spec.lower().partition(':')
+        npt = int(npt) if npt else settings['npt_tth']
+        if mode == 'full':
+            config = dict(settings, total=True, aperture=None, axes=None, cake=None)
+        elif mode.startswith('azim') and mode[4:].isdigit() and int(mode[4:]) > 0:
+            aperture = int(mode[4:])
+            config = dict(settings, total=False, aperture=aperture, cake=None,
+                          axes=IXR2D.azim_sectors(aperture))
+        else:
+            raise ValueError(f"Invalid sweep configuration: {spec}")
+        # Number of points other than the one of the run written in the folder name
+        config.update(npt_tth=npt, suffix=f"_NPT{npt}" if npt != settings['npt_tth'] else '')
+        if not any(output_folder(config) == output_folder(other) for other in configs):
+            configs.append(config)
+    return configs
+
+
+def process_sweep(imagesArray: list, PONI: str, DARK: str, configs: list,
+                  workers: int = 1, report: RunReport = None) -> tuple:
+    """Integrate a batch of 2D images with several configurations, each one written to its own folder
+
+    Args:
+        imagesArray (list): 2D images to integrate
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        configs (list): Integration settings of each configuration, see sweep_configs
+        workers (int, optional): Number of processes. Defaults to 1.
+        report (RunReport, optional): Report of the run, completed with the timings. Defaults to None.
+
+    Returns:
+        tuple: List of the images integrated and list of (image, traceback) failures
+    """
+    if report is None:
+        report = RunReport()
+
+    print(stylize(f">> Integration sweep over {len(configs)} configurations", attr("bold")))
+    # Diffractograms are written directly in the output folder of their configuration
+    for config in configs:
+        config['work_folder'] = output_folder(config)
+        os.makedirs(config['work_folder'], exist_ok=True)
+        print(os.path.basename(config['work_folder']))
+
+    integrated = []
+    failures = []
+    processedArrays = [[] for _ in configs]
+    report.start_frames(len(imagesArray))
+    with report.stage('integration'):
+        for img, written, error in sweep_images(imagesArray, PONI, DARK, configs, workers):
+            nb_bytes = sum(file_size(os.path.join(config['work_folder'], file))
+                           for config, files in zip(configs, written) for file in files)
+            report.frame(img, _read_size(configs[0], img), nb_bytes, error)
+            if error:
+                failures.append((img, error))
                 print(stylize(f'>> Problem after image : {img}', fg(
                     "red") + attr("bold")))
+                continue
+            integrated.append(img)
+            for processedArray, files in zip(processedArrays, written):
+                processedArray.extend(files)
 
-        if DELIMITER_ON == True:
-            FILE_PATTERN = IXR2D.delimiter_parser(
-                os.path.splitext(imagesArray[0])[0])[1]
+    for config, processedArray in zip(configs, processedArrays):
+        finalize_outputs(config, processedArray, report)
 
-        INTEG_FOLDER = FILE_PATTERN + '_INTEG_FULL'
+    return integrated, failures
 
-        print(stylize(">> Cleaning working directory", attr("bold")))
 
-        if not os.path.exists(INTEG_FOLDER):
-            os.mkdir(INTEG_FOLDER)
+def evict_results(settings: dict):
+    """Keep the cache of the integrated diffractograms below its size limit
 
-        # Move integrated .dat files with overwrite if existing
-        for file in processedArray:
-            shutil.move(os.path.join(IMAGES_2D, file),
-                        os.path.join(INTEG_FOLDER, file))
-
-        # Apply intensity correction on diffractograms
-        if ICOR != 0:
-            print(
-                stylize(f">> Intensity correction of {ICOR}", attr("bold")))
-            for file in os.listdir(INTEG_FOLDER):
-                print(f'Processing: {file}')
-                IXR2D.intensity_correction(
-                    os.path.join(INTEG_FOLDER, file), ICOR)
-
-        time.sleep(1)
-
-        # Simplified numbering of diffractograms for easier management in FullpProf with overwrite
-        for file in os.listdir(INTEG_FOLDER):
-            if file in processedArray:
-                original = os.path.join(INTEG_FOLDER, file)
-                comment = str(f"### Original file: {file}")
-                IXR2D.prepend_line(original, comment, multi=False)
-
-                if(ACCEL == 'Yes'):
-                    output = os.path.join(INTEG_FOLDER, IXR2D.file_rename(
-                        file, FILE_PATTERN, accel=True))
-                else:
-                    output = os.path.join(INTEG_FOLDER, IXR2D.file_rename(
-                        file, FILE_PATTERN, accel=False))
-
-                try:
-                    os.rename(original, output)
-                except (FileNotFoundError, OSError):
-                    os.remove(output)
-                    os.rename(original, output)
-
-    # Intégration partielle des diffractogrammes 2D
-    if TOTAL_INTEG == False:
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+    """
+    if settings['cache_dir'] and settings['result_cache'] > 0:
+        ResultCache(os.path.join(settings['cache_dir'], 'results'), '',
+                    settings['result_cache']).evict()
+
+
+def report_failures(failures: list):
+    """Print the images which could not be integrated with the cause of the failure
+
+    Args:
+        failures (list): List of (image, traceback) tuples
+    """
+    if not failures:
+        return
+    print(stylize(f'>> {len(failures)} image(s) could not be integrated', fg(
+        "red") + attr("bold")))
+    for img, error in failures:
+        print(stylize(f'>> Problem with image : {img}', fg("red") + attr("bold")))
+        print(error)
+
+
+def integration_parameters(PONI: str, DARK: str, settings: dict) -> dict:
+    """Parameters defining the diffractograms of a frame, recorded in the watch manifest
+
+    Args:
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        settings (dict): Integration settings shared by every image of the series
+
+    Returns:
+        dict: Integration parameters
+    """
+    with open(PONI) as f:
+        poni = f.read()
+    return {
+        'poni': poni,
+        'dark': [DARK, os.path.getmtime(DARK)] if DARK else None,
+        'npt': settings['npt_tth'],
+        'total': settings['total'],
+        'aperture': settings['aperture'],
+        'cake': settings['cake'],
+        'icor': settings['icor'],
+        'post': _post_parameters(settings),
+    }
+
+
+def _post_parameters(settings: dict) -> dict:
+    """Post-processing parameters recorded with the diffractograms
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+
+    Returns:
+        dict: Post-processing parameters
+    """
+    return {
+        'scale': settings['post'].scale,
+        'monitor': settings['monitor'],
+        'background': settings['background'],
+        'background_poly': settings['post'].background_degree,
+    }
+
+
+def _frame_index(settings: dict, img: str) -> int:
+    """Numbering of a 2D image in the series
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): Name of the 2D image
+
+    Returns:
+        int: Index of the image
+    """
+    name = frame_basename(img)
+    if settings['delimiter_on']:
+        return IXR2D.delimiter_parser(name)[0]
+    return int(name.replace(settings['pattern'], '').replace('_', '').replace('-', ''))
+
+
+def _read_size(settings: dict, img: str) -> int:
+    """Bytes read for an image, a share of the file for a frame of a container
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        img (str): 2D image file or frame of a multi-frame container
+
+    Returns:
+        int: Size in bytes
+    """
+    file, index = split_frame(img)
+    read = file_size(os.path.join(settings['folder'], file))
+    if index is not None:
+        read //= max(1, nb_frames(os.path.join(settings['folder'], file)))
+    return read
+
+
+def track_results(results, settings: dict, report: RunReport, integrated: list, failures: list, stats: list = None):
+    """Record the integrated images in the run report and collect the failures
+
+    Args:
+        results (iterable): (image, (output, statistics), error) tuples given by integrate_images
+        settings (dict): Integration settings shared by every image of the series
+        report (RunReport): Report of the run
+        integrated (list): List completed with the images successfully integrated
+        failures (list): List completed with the (image, traceback) failures
+        stats (list, optional): List completed with the (image, index, values) statistics of the frames. Defaults to None.
+
+    Yields:
+        tuple: Image, output and error, the statistics being collected
+    """
+    for img, result, error in results:
+        output, values = result if result else ([], None)
+        if stats is not None and values is not None and not error:
+            stats.append((img, _stats_index(settings, img), values))
+        if error or not output:
+            written = 0
+        elif settings['output'] == 'stack':
+            written = sum(4 * np.size(cts) for _, _, cts, _ in output)
+        else:
+            folder = settings['work_folder'] or settings['folder']
+            written = sum(file_size(os.path.join(folder, file)) for file in output)
+        read = sum(_read_size(settings, frame) for frame in settings['bins'].get(img, [img]))
+        report.frame(img, read, written, error)
+
+        if error:
+            failures.append((img, error))
+            print(stylize(f'>> Problem after image : {img}', fg(
+                "red") + attr("bold")))
+        else:
+            integrated.append(img)
+        yield img, output, error
+
+
+def _process_stack(imagesArray: list, PONI: str, DARK: str, settings: dict,
+                   workers: int = 1, queue_depth: int = 0, report: RunReport = None) -> tuple:
+    """Integrate a batch of 2D images into a single stacked file instead of .dat files
+
+    Args:
+        Same as process_images
+
+    Returns:
+        tuple: List of the images integrated and list of (image, traceback) failures
+    """
+    FILE_PATTERN = settings['pattern']
+    integrated = []
+    failures = []
+    stats = []
+
+    if settings['total']:
+        print(stylize(">> Total integration of 2D diffractograms", attr("bold")))
+        STACK_FILE = FILE_PATTERN + '_INTEG_FULL' + EXTENSION
+        sectors = ['full']
+    elif settings['cake']:
+        print(stylize(f">> Cake integration in {settings['cake']} sectors", attr("bold")))
+        STACK_FILE = f"{FILE_PATTERN}_INTEG_CAKE_{settings['cake']}" + EXTENSION
+        sectors = [f"axis{axis}" for axis in _sector_axes(settings)]
+    else:
         print(stylize(">> Partial integration", attr("bold")))
+        STACK_FILE = f"{FILE_PATTERN}_INTEG_AZIM_{settings['aperture']}" + EXTENSION
+        sectors = [f"axis{axis}" for axis in _sector_axes(settings)]
 
-        axis0, axis90 = IXR2D.azim_angles(PARTIAL_INTEG)
-
-        if DELIMITER_ON == True:
-            FILE_PATTERN = IXR2D.delimiter_parser(
-                os.path.splitext(imagesArray[0])[0])[1]
-
-        AZIM_INTEG_FOLDER = f"{FILE_PATTERN}_INTEG_AZIM_{PARTIAL_INTEG}"
-        azim_array = []
-
-        for img in imagesArray:
-            try:
-                im = fabio.open(img)
-                print(f'> Processing: {im.filename}')
-                azim_axis = [
-                    IXR2D.azim_sum(poni, dark, im, axis0, npt_tth),
-                    IXR2D.azim_sum(poni, dark, im, axis90, npt_tth)
-                ]
-
-                for i in range(len(azim_axis)):
-                    if DELIMITER_ON == True:
-                        index = IXR2D.delimiter_parser(
-                            os.path.splitext(img)[0])[0]
-                    else:
-                        index = os.path.splitext(
-                            img)[0].replace(FILE_PATTERN, '')
-                    file = IXR2D.azim_filename(FILE_PATTERN, int(
-                        IXR2D.get_axis(i)), PARTIAL_INTEG, index) + '.dat'
-                    IXR2D.save_to_file(file, azim_axis[int(i)])
-                    azim_array.append(file)
-                    print(f"File saved: {file}")
-            except:
-                print(stylize(f'>> Problem after image : {img}', fg(
-                    "red") + attr("bold")))
+    # Frames are stored by increasing index so that a range of the stack is a range of the series
+    imagesArray = sorted(imagesArray, key=lambda img: _frame_index(settings, img))
+    frames = [{'file': img, 'index': _frame_index(settings, img)} for img in imagesArray]
+    attrs = {
+        'pattern': FILE_PATTERN,
+        'total': settings['total'],
+        'accel': settings['accel'] and not settings['bins'],
+        'binning': settings['binning'],
+        'aperture': settings['aperture'],
+        'cake': settings['cake'],
+        'icor': settings['icor'],
+        'post': _post_parameters(settings),
+        'poni': PONI,
+        'dark': DARK,
+    }
+    stack = SeriesStack.create(os.path.join(settings['folder'], STACK_FILE),
+                               frames, settings['npt_tth'], sectors, attrs)
+
+    report.start_frames(len(imagesArray))
+    with report.stage('integration'):
+        results = integrate_images(imagesArray, PONI, DARK, settings, workers, queue_depth)
+        for i, (img, patterns, error) in enumerate(track_results(results, settings, report, integrated, failures, stats)):
+            if error:
+                continue
+            cts = np.concatenate([np.reshape(cts, (-1, settings['npt_tth'])) for _, _, cts, _ in patterns])
+            stack.write_frame(i, patterns[0][1], cts)
+
+    # Intensity post-processing of the whole series at once
+    if settings['post']:
+        print(stylize(">> Intensity post-processing", attr("bold")))
+        with report.stage('postprocessing'):
+            settings['post'].apply_stack(stack)
+    stack.flush()
+    print(stylize(f"Stacked diffractograms saved: {STACK_FILE}", fg("green")))
+    save_stats(settings, stats, os.path.join(settings['folder'], os.path.splitext(STACK_FILE)[0] + STATS_SUFFIX))
+
+    # Chosen sectors of the cake exported to FullProf files, next to the stacked file
+    if settings['cake'] and settings['cake_export']:
+        stack_file = os.path.join(settings['folder'], STACK_FILE)
+        with report.stage('export'):
+            written = export_dat(stack_file, os.path.splitext(stack_file)[0],
+                                 sectors=settings['cake_export'])
+        print(stylize(f"{len(written)} diffractograms exported to {os.path.splitext(STACK_FILE)[0]}", fg("green")))
+
+    return integrated, failures
+
+
+def process_images(imagesArray: list, PONI: str, DARK: str, settings: dict,
+                   workers: int = 1, queue_depth: int = 0, report: RunReport = None) -> tuple:
+    """Integrate a batch of 2D images, move the diffractograms to the output folder
+    and simplify their numbering
+
+    Args:
+        imagesArray (list): 2D images to integrate
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        settings (dict): Integration settings shared by every image of the series
+        workers (int, optional): Number of processes. Defaults to 1.
+        queue_depth (int, optional): Queue depth of the streaming mode, 0 to disable it. Defaults to 0.
+        report (RunReport, optional): Report of the run, completed with the timings. Defaults to None.
+
+    Returns:
+        tuple: List of the images integrated and list of (image, traceback) failures
+    """
+    if report is None:
+        report = RunReport()
 
-        print(stylize(">> Cleaning working directory", attr("bold")))
+    if settings['output'] == 'stack':
+        return _process_stack(imagesArray, PONI, DARK, settings, workers, queue_depth, report)
 
-        if not os.path.exists(AZIM_INTEG_FOLDER):
-            os.mkdir(AZIM_INTEG_FOLDER)
+    integrated = []
+    failures = []
 
-        # Move integrated .dat files with overwrite if existing
-        for file in azim_array:
-            shutil.move(os.path.join(IMAGES_2D, file),
-                        os.path.join(AZIM_INTEG_FOLDER, file))
+    if settings['total']:
+        print(stylize(">> Total integration of 2D diffractograms", attr("bold")))
+    else:
+        print(stylize(">> Partial integration", attr("bold")))
+
+    processedArray = []
+    stats = []
+    report.start_frames(len(imagesArray))
+    with report.stage('integration'):
+        results = integrate_images(imagesArray, PONI, DARK, settings, workers, queue_depth)
+        for img, written, error in track_results(results, settings, report, integrated, failures, stats):
+            processedArray.extend(written)
 
-        # Apply intensity correction on diffractograms
-        if ICOR != 0:
-            print(
-                stylize(f">> Intensity correction of {ICOR}", attr("bold")))
-            for file in os.listdir(AZIM_INTEG_FOLDER):
-                print(f'Processing: {file}')
-                IXR2D.intensity_correction(
-                    os.path.join(AZIM_INTEG_FOLDER, file), ICOR)
+    finalize_outputs(settings, processedArray, report)
+    save_stats(settings, stats, os.path.join(output_folder(settings), settings['pattern'] + STATS_SUFFIX))
 
-        time.sleep(1)
+    return integrated, failures
 
-        # Add integration parameters to the header of the file
-        for file in os.listdir(AZIM_INTEG_FOLDER):
-            if file in azim_array:
-                original = os.path.join(AZIM_INTEG_FOLDER, file)
-                comment = str(f"### Original file: {file}")
+
+def output_folder(settings: dict) -> str:
+    """Folder of the .dat diffractograms of a series
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+
+    Returns:
+        str: <pattern>_INTEG_FULL or <pattern>_INTEG_AZIM_<aperture> folder next to the images
+    """
+    if settings['total']:
+        name = settings['pattern'] + '_INTEG_FULL'
+    else:
+        name = f"{settings['pattern']}_INTEG_AZIM_{settings['aperture']}"
+    return os.path.join(settings['folder'], name + settings.get('suffix', ''))
+
+
+def finalize_outputs(settings: dict, processedArray: list, report: RunReport):
+    """Move the diffractograms to the output folder, simplify their numbering or complete their header.
+    Each diffractogram is written with its header to the output folder, then removed from the working
+    folder: finalizing again the files of an interrupted call only processes the files left.
+
+    Args:
+        settings (dict): Integration settings shared by every image of the series
+        processedArray (list): Written .dat files
+        report (RunReport): Report of the run, completed with the timings
+    """
+    FILE_PATTERN, PARTIAL_INTEG = settings['pattern'], settings['aperture']
+    WORK_FOLDER = settings['work_folder'] or settings['folder']
+    OUTPUT_FOLDER = output_folder(settings)
+
+    print(stylize(">> Cleaning working directory", attr("bold")))
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+    # Total integration: simplified numbering of diffractograms for easier management in FullpProf with overwrite
+    # Partial integration: add integration parameters to the header of the file
+    with report.stage('renumbering' if settings['total'] else 'header'):
+        for file in processedArray:
+            original = os.path.join(WORK_FOLDER, file)
+            if not os.path.exists(original):
+                # Already finalized by an interrupted call
+                continue
+            comment = str(f"### Original file: {file}")
+            if settings['total']:
+                output = os.path.join(OUTPUT_FOLDER, IXR2D.file_rename(
+                    file, FILE_PATTERN, accel=settings['accel'] and not settings['bins']))
+                header = [comment]
+            else:
+                output = os.path.join(OUTPUT_FOLDER, file)
                 azim_comment = str(
-                    f"### Azimutal integration parameters: \n### Angle: {PARTIAL_INTEG} deg - Npt: {npt_tth}")
-                IXR2D.prepend_line(
-                    original, [comment, azim_comment], multi=True)
+                    f"### Azimutal integration parameters: \n### Angle: {PARTIAL_INTEG} deg - Npt: {settings['npt_tth']}")
+                header = [comment, azim_comment]
+
+            IXR2D.prepend_line(original, header, multi=True, output=output)
+            if os.path.abspath(original) != os.path.abspath(output):
+                os.remove(original)
+            report.add_written(file_size(output))
+
+
+def bin_series(imagesArray: list, settings: dict, size: int, step: int = 0) -> list:
+    """Replace the frames of a series by groups of consecutive frames, numbered from 0
+
+    Args:
+        imagesArray (list): 2D images of the series
+        settings (dict): Integration settings, completed with the frames of each group
+        size (int): Number of frames of a group
+        step (int, optional): Shift between two groups, smaller than size for a sliding window. Defaults to 0, step = size.
+
+    Returns:
+        list: Names of the groups, integrated as single images
+    """
+    frames = sorted(imagesArray, key=lambda img: _frame_index(settings, img))
+    groups = bin_frames(frames, size, step)
+    settings['bins'] = {bin_name(settings['pattern'], i, settings['delimiter_on']): group
+                        for i, group in enumerate(groups)}
+    settings['binning'] = {'size': size, 'step': step or size, 'mode': settings['bin_mode']}
+
+    # Monitor of a group: sum or mean of the monitors of its frames
+    post = settings['post']
+    if post.monitor:
+        monitors = [post.monitors([_frame_index(settings, img) for img in group]) for group in groups]
+        post.monitor = {i: float(m.sum() if settings['bin_mode'] == 'sum' else m.mean())
+                        for i, m in enumerate(monitors)}
+
+    left_out = len(frames) - ((len(groups) - 1) * (step or size) + size if groups else 0)
+    print(stylize(f">> Binning of {len(frames)} frames in {len(groups)} groups of {size} ({settings['bin_mode']})", attr("bold")))
+    if left_out:
+        print(f"{left_out} last frame(s) not filling a group are not integrated")
+    return list(settings['bins'])
+
+
+def write_report(report: RunReport, settings: dict):
+    """Print the throughput of the run and write the JSON report next to the images
+
+    Args:
+        report (RunReport): Report of the run
+        settings (dict): Integration settings shared by every image of the series
+    """
+    summary = report.summary()
+    rate = f" ({summary['frames_per_s']:.1f} frames/s)" if summary['frames_per_s'] else ''
+    print(stylize(f">> {summary['nb_frames']} images in {summary['wall_seconds']:.1f} s{rate}", attr("bold")))
+    memory = summary['peak_memory_mb']
+    if memory['process'] is not None:
+        workers = f", largest worker {memory['workers']:.0f} MB" if memory['workers'] else ''
+        print(f"Peak memory: main process {memory['process']:.0f} MB{workers}")
+    if settings['report']:
+        report_file = os.path.join(settings['folder'], f"{settings['pattern']}_run_report.json")
+        report.write(report_file)
+        print(stylize(f"Run report saved: {report_file}", fg("green")))
+
+
+def series_settings(args, folder: str = None) -> dict:
+    """Integration settings of a series from the arguments of the integration action
+
+    Args:
+        args (object): Arguments of the integration action, options missing from args take their default value
+        folder (str, optional): Absolute folder of the images. Defaults to None, IMAGES_2D of args.
+
+    Raises:
+        ValueError: Invalid aperture of the partial integration or 2theta window of the frame statistics
+
+    Returns:
+        dict: Integration settings shared by every image of the series
+    """
+    ICOR, PARTIAL_INTEG = args.ICOR, args.PARTIAL_INTEG
+    # The command line and the batch configuration do not go through the validator of the UI
+    if PARTIAL_INTEG is not None and PARTIAL_INTEG <= 0:
+        raise ValueError(f"Invalid aperture of the partial integration: {PARTIAL_INTEG}°, expected more than 0°")
+    MONITOR, BACKGROUND = getattr(args, 'MONITOR', None), getattr(args, 'BACKGROUND', None)
+
+    settings = {
+        'folder': folder or os.path.abspath(args.IMAGES_2D),
+        'total': args.TOTAL_INTEG == True,
+        'npt_tth': int(args.NPT),
+        'npt_chi': 1,
+        'pattern': args.FILE_PATTERN,
+        'delimiter_on': args.DELIMITER_ON == True,
+        'accel': args.ACCEL == 'Yes',
+        'icor': ICOR,
+        'aperture': PARTIAL_INTEG,
+        'axes': IXR2D.azim_sectors(PARTIAL_INTEG) if PARTIAL_INTEG is not None else None,
+        'cake': getattr(args, 'CAKE_INTEG', None),
+        'cake_export': getattr(args, 'CAKE_EXPORT', None),
+        'cache_dir': None if getattr(args, 'NO_CACHE', False) else getattr(args, 'CACHE_DIR', None) or CACHE_DIR,
+        'result_cache': getattr(args, 'RESULT_CACHE_SIZE', RESULT_CACHE_SIZE) or 0,
+        'output': getattr(args, 'OUTPUT_FORMAT', 'dat'),
+        'report': getattr(args, 'REPORT', False),
+        'monitor': os.path.abspath(MONITOR) if MONITOR else None,
+        'background': os.path.abspath(BACKGROUND) if BACKGROUND else None,
+        'work_folder': None,
+        'low_memory': getattr(args, 'LOW_MEMORY', False),
+        'stats': None,
+        'binning': None,
+        'bins': {},
+        'bin_mode': getattr(args, 'BIN_MODE', 'sum'),
+    }
+    # Statistics of each frame, saved in a table next to the diffractograms
+    if getattr(args, 'FRAME_STATS', False):
+        windows = parse_windows(getattr(args, 'STATS_WINDOWS', None))
+        settings['stats'] = {'saturation': getattr(args, 'SATURATION', SATURATION), 'windows': windows}
+    # Intensity correction, normalization and background subtraction applied on the integrated intensities
+    settings['post'] = PostProcessing(
+        offset=ICOR,
+        scale=getattr(args, 'SCALE', 1.0),
+        monitor=load_monitor(settings['monitor']) if MONITOR else None,
+        background=load_background(settings['background']) if BACKGROUND else None,
+        background_degree=getattr(args, 'BACKGROUND_POLY', 0))
+    return settings
+
+
+def integrateXRD(args):
+    IMAGES_2D, PONI, DARK, ACCEL = [args.IMAGES_2D, args.PONI, args.DARK, args.ACCEL]
+    PARTIAL_INTEG = args.PARTIAL_INTEG
+    CAKE_INTEG = getattr(args, 'CAKE_INTEG', None)
+    DELIMITER_ON = args.DELIMITER_ON
+    WORKERS = getattr(args, 'WORKERS', 1) or 1
+    QUEUE_DEPTH = max(1, getattr(args, 'QUEUE_DEPTH', 4)) if getattr(args, 'STREAM', False) else 0
+    WATCH = getattr(args, 'WATCH', False)
+
+    IMAGES_2D = os.path.abspath(IMAGES_2D)
+    PONI = os.path.abspath(PONI)
+    if DARK:
+        DARK = os.path.abspath(DARK)
+
+    imagesArray = []
+    processedArray = []
+
+    os.chdir(IMAGES_2D)
+
+    try:
+        settings = series_settings(args, IMAGES_2D)
+    except ValueError as error:
+        print(stylize(f'>> {error}', fg("red") + attr("bold")))
+        return
+    BIN_SIZE, BIN_STEP = getattr(args, 'BIN_SIZE', 1) or 1, getattr(args, 'BIN_STEP', 0) or 0
+
+    # Cake integration: sectors of equal aperture covering 360°, always saved in a stacked file
+    if CAKE_INTEG:
+        if WATCH:
+            print(stylize(">> Cake integration is not available in watch mode", fg("red") + attr("bold")))
+            return
+        width = 360 / CAKE_INTEG
+        settings['aperture'] = int(width) if width.is_integer() else width
+        settings['axes'] = IXR2D.cake_sectors(CAKE_INTEG)
+        settings['output'] = 'stack'
+
+    SWEEP = getattr(args, 'SWEEP', None)
+    SHARD = getattr(args, 'SHARD', False)
+    if SHARD and (WATCH or CAKE_INTEG):
+        print("Sharded integration is not available for cake integration or in watch mode")
+        SHARD = False
+    elif SHARD:
+        if settings['output'] == 'stack' or SWEEP:
+            print("Sharded integration writes the diffractograms of the run as .dat files, without sweep")
+        settings['output'] = 'dat'
+        SWEEP = None
+    if SWEEP and (WATCH or settings['output'] == 'stack' or CAKE_INTEG):
+        print("Parameter sweeps are only available for .dat outputs, without watch mode")
+        SWEEP = None
+    elif SWEEP and QUEUE_DEPTH:
+        print("Streaming mode is not available for parameter sweeps, it is disabled")
+        QUEUE_DEPTH = 0
+    if SWEEP and settings['stats']:
+        print("Frame statistics are not available for parameter sweeps")
+        settings['stats'] = None
+
+    if settings['low_memory'] and QUEUE_DEPTH:
+        print("Streaming mode is not available in low-memory mode, it is disabled")
+        QUEUE_DEPTH = 0
+
+    if WATCH and BIN_SIZE > 1:
+        print("Binning is not available in watch mode, every frame is integrated")
+        BIN_SIZE = 1
+
+    if WATCH and settings['output'] == 'stack':
+        print("Stacked output is not available in watch mode, diffractograms are saved as .dat files")
+        settings['output'] = 'dat'
+
+    if WORKERS > 1:
+        print(f"Integration shared between {WORKERS} workers")
+        if QUEUE_DEPTH:
+            print("Streaming mode is only available with a single worker, it is disabled")
+    elif QUEUE_DEPTH:
+        print(f"Streaming mode with a queue depth of {QUEUE_DEPTH} images")
+
+    report = RunReport({key: value for key, value in vars(args).items() if key != 'action'})
+
+    if WATCH:
+        def process(images):
+            if settings['delimiter_on']:
+                settings['pattern'] = IXR2D.delimiter_parser(
+                    frame_basename(images[0]))[1]
+            integrated, failures = process_images(images, PONI, DARK, settings, WORKERS, QUEUE_DEPTH, report)
+            evict_results(settings)
+            report_failures(failures)
+            write_report(report, settings)
+            return integrated
+
+        watch_folder(IMAGES_2D, process, integration_parameters(PONI, DARK, settings),
+                     accel=settings['accel'],
+                     interval=getattr(args, 'WATCH_INTERVAL', 10),
+                     idle_timeout=getattr(args, 'WATCH_IDLE', 0))
+        return
+
+    # Isolate useful diffracograms by removing those produced during beam acceleration
+    # The catalog of the folder is kept with the integration cache
+    CATALOG_DIR = os.path.join(settings['cache_dir'], 'catalog') if settings['cache_dir'] else None
+    with report.stage('discovery'):
+        if ACCEL == 'Yes':
+            print(stylize(">> Scanning acceleration files", attr("bold")))
+            IXR2D.file_parser(IMAGES_2D, imagesArray, processedArray, accel=True, cache_dir=CATALOG_DIR)
+        else:
+            IXR2D.file_parser(IMAGES_2D, imagesArray, processedArray, accel=False, cache_dir=CATALOG_DIR)
+
+    print(f"Integration of {len(imagesArray)} diffraction images")
+
+    if DELIMITER_ON == True:
+        settings['pattern'] = IXR2D.delimiter_parser(
+            frame_basename(imagesArray[0]))[1]
+
+    # Binning of consecutive frames, after the removal of the acceleration frames
+    if BIN_SIZE > 1:
+        imagesArray = bin_series(imagesArray, settings, BIN_SIZE, BIN_STEP)
+
+    if SHARD:
+        # The sharded integration builds on this module
+        from src.shard import process_shards
+        integrated, failures = process_shards(imagesArray, PONI, DARK, settings, WORKERS, QUEUE_DEPTH, report,
+                                              getattr(args, 'SHARD_BATCH', 100), getattr(args, 'SHARD_TIMEOUT', 0))
+    elif SWEEP:
+        configs = sweep_configs(settings, SWEEP)
+        integrated, failures = process_sweep(imagesArray, PONI, DARK, configs, WORKERS, report)
+    else:
+        integrated, failures = process_images(imagesArray, PONI, DARK, settings, WORKERS, QUEUE_DEPTH, report)
+    evict_results(settings)
+
+    report_failures(failures)
+    write_report(report, settings)
@@ -0,0 +1,114 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the streaming pipeline
+import threading
+import traceback
+from queue import Queue, Empty, Full
+
+# Marker of the end of the stream
+_END = object()
+
+
+def _put(q: Queue, item: object, stop: threading.Event) -> bool:
+    """Put an item in a bounded queue, giving up if the pipeline is stopped
+
+    Returns:
+        bool: True if the item was queued
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _reader(items: list, read, read_q: Queue, stop: threading.Event):
+    """Decoding stage, run in a background thread"""
+    for item in items:
+        try:
+            entry = (item, read(item), None)
+        except Exception:
+            entry = (item, None, traceback.format_exc())
+        if not _put(read_q, entry, stop):
+            return
+    _put(read_q, _END, stop)
+
+
+def _writer(write, write_q: Queue, done_q: Queue, stop: threading.Event):
+    """Output stage, run in a background thread"""
+    while not stop.is_set():
+        try:
+            entry = write_q.get(timeout=0.1)
+        except Empty:
+            continue
+        if entry is _END:
+            done_q.put(_END)
+            return
+        item, payload, error = entry
+        result = None
+        if error is None:
+            try:
+                result = write(item, payload)
+            except Exception:
+                error = traceback.format_exc()
+        done_q.put((item, result, error))
+
+
+def stream(items: list, read, process, write, depth: int = 4):
+    """Three-stage streaming pipeline: decoding and writing run in background threads
+    while process runs in the calling thread. Bounded queues between the stages limit
+    the number of items held in memory.
+
+    Args:
+        items (list): Items to process, in order
+        read (callable): Decoding stage, read(item) -> data
+        process (callable): Processing stage, process(item, data) -> payload
+        write (callable): Output stage, write(item, payload) -> result
+        depth (int, optional): Maximum number of items waiting between two stages. Defaults to 4.
+
+    Yields:
+        tuple: Item, result of the output stage and traceback of the failure (None if successful),
+            in the order of items
+    """
+    stop = threading.Event()
+    read_q, write_q, done_q = Queue(maxsize=depth), Queue(maxsize=depth), Queue()
+    threads = [
+        threading.Thread(target=_reader, args=(items, read, read_q, stop), daemon=True),
+        threading.Thread(target=_writer, args=(write, write_q, done_q, stop), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            entry = read_q.get()
+            if entry is _END:
+                _put(write_q, _END, stop)
+                break
+            item, data, error = entry
+            payload = None
+            if error is None:
+                try:
+                    payload = process(item, data)
+                except Exception:
+                    error = traceback.format_exc()
+            del data
+            _put(write_q, (item, payload, error), stop)
+
+            while not done_q.empty():
+                yield done_q.get()
+
+        while True:
+            entry = done_q.get()
+            if entry is _END:
+                break
+            yield entry
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
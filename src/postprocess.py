@@ -0,0 +1,154 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the post-processing of the diffractograms
+import numpy as np
+from numpy.polynomial import polynomial
+
+
+def load_monitor(file: str) -> dict:
+    """Read the monitor counts of the frames from a 2-column file: frame index and monitor value
+
+    Args:
+        file (str): Monitor file, lines starting with # are ignored
+
+    Returns:
+        dict: Monitor value by frame index
+    """
+    table = np.loadtxt(file, comments='#', ndmin=2)
+    return {int(index): float(value) for index, value in table[:, :2]}
+
+
+def load_background(file: str) -> tuple:
+    """Read a reference background pattern from a 2-column XY file (e.g. a .dat diffractogram)
+
+    Args:
+        file (str): Background file, lines starting with # are ignored
+
+    Returns:
+        tuple: 2theta values and intensities of the background
+    """
+    table = np.loadtxt(file, comments='#', ndmin=2)
+    return table[:, 0], table[:, 1]
+
+
+def fit_background(radial: np.ndarray, intensities: np.ndarray, degree: int, iterations: int = 10) -> np.ndarray:
+    """Polynomial background of a series of diffractograms, all fitted at once.
+    Peaks are excluded iteratively by keeping only the points below the previous fit.
+
+    Args:
+        radial (np.ndarray): 2theta values, npt points
+        intensities (np.ndarray): Diffractograms, an array (..., npt)
+        degree (int): Degree of the polynomial
+        iterations (int, optional): Number of peak exclusion iterations. Defaults to 10.
+
+    Returns:
+        np.ndarray: Background of each diffractogram, same shape as intensities
+    """
+    shape = intensities.shape
+    y = np.reshape(intensities, (-1, shape[-1])).astype(np.float64)
+    # 2theta scaled to [-1, 1] for a well-conditioned fit
+    x = (radial - radial.min()) / max(np.ptp(radial), 1e-12) * 2 - 1
+    vander = polynomial.polyvander(x, degree)
+    valid = np.isfinite(y)
+    weights = valid.astype(np.float64)
+    y = np.where(valid, y, 0)
+    eye = np.eye(degree + 1) * 1e-12
+
+    for _ in range(iterations):
+        lhs = np.einsum('fn,nd,ne->fde', weights, vander, vander) + eye
+        rhs = np.einsum('fn,nd,fn->fd', weights, vander, y)
+        coefficients = np.linalg.solve(lhs, rhs[..., None])[..., 0]
+        background = coefficients @ vander.T
+        below = valid & (y <= background)
+        # Keep the previous selection if too few points remain to fit the polynomial
+        enough = below.sum(axis=1) > degree + 1
+        weights[enough] = below[enough]
+
+    return np.reshape(background, shape)
+
+
+class PostProcessing:
+    """Intensity post-processing applied with NumPy to whole diffractograms or a whole series:
+    normalization by the frame monitor and a scale factor, background subtraction, then offset.
+
+    I = I / monitor * scale - background + offset
+    """
+
+    def __init__(self, offset: float = 0, scale: float = 1.0, monitor: dict = None,
+                 background: tuple = None, background_degree: int = 0):
+        """Define the post-processing
+
+        Args:
+            offset (float, optional): Intensity added to every point (intensity correction). Defaults to 0.
+            scale (float, optional): Scale factor. Defaults to 1.0.
+            monitor (dict, optional): Monitor value by frame index. Defaults to None.
+            background (tuple, optional): Reference background, 2theta values and intensities. Defaults to None.
+            background_degree (int, optional): Degree of a fitted polynomial background, 0 to disable it. Defaults to 0.
+        """
+        self.offset = float(offset)
+        self.scale = float(scale)
+        self.monitor = monitor or {}
+        self.background = background
+        self.background_degree = int(background_degree or 0)
+
+    def __bool__(self) -> bool:
+        return bool(self.offset != 0 or self.scale != 1 or self.monitor
+                    or self.background is not None or self.background_degree > 0)
+
+    def monitors(self, indices: list) -> np.ndarray:
+        """Monitor values of frames, 1 for frames without monitor
+
+        Args:
+            indices (list): Frame indices
+
+        Returns:
+            np.ndarray: Monitor value of each frame
+        """
+        return np.array([self.monitor.get(int(i), 1.0) for i in indices], dtype=np.float64)
+
+    def apply(self, radial: np.ndarray, intensities: np.ndarray, indices: list = None) -> np.ndarray:
+        """Apply the post-processing to a series of diffractograms
+
+        Args:
+            radial (np.ndarray): 2theta values, npt points
+            intensities (np.ndarray): Diffractograms, an array (frames, ..., npt)
+            indices (list, optional): Frame index of each diffractogram, for the monitor normalization. Defaults to None.
+
+        Returns:
+            np.ndarray: Processed diffractograms, same shape as intensities
+        """
+        result = np.array(intensities, dtype=np.float64)
+        if self.monitor and indices is not None:
+            monitors = self.monitors(indices)
+            result /= monitors.reshape((-1,) + (1,) * (result.ndim - 1))
+        if self.scale != 1:
+            result *= self.scale
+        if self.background is not None:
+            result -= np.interp(radial, *self.background)
+        if self.background_degree > 0:
+            result -= fit_background(radial, result, self.background_degree)
+        if self.offset != 0:
+            result += self.offset
+        return result
+
+    def apply_stack(self, stack: object, chunk: int = 256):
+        """Apply the post-processing in place to every integrated frame of a stacked series
+
+        Args:
+            stack (SeriesStack): Stack opened for writing
+            chunk (int, optional): Number of frames processed at once, limits the memory used. Defaults to 256.
+        """
+        indices = [frame['index'] for frame in stack.frames]
+        for start in range(0, len(stack), chunk):
+            stop = min(start + chunk, len(stack))
+            done = stack.status[start:stop].astype(bool)
+            if not done.any():
+                continue
+            # Each sector has its own 2theta values
+            for s in range(len(stack.sectors)):
+                block = stack.data[start:stop, s][done]
+                stack.data[start:stop, s][done] = self.apply(stack.radial[s], block,
+                                                              np.array(indices[start:stop])[done])
@@ -0,0 +1,160 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for reading single and multi-frame 2D images
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+
+# Multi-frame containers: HDF5/NeXus (e.g. Eiger master files) and EDF stacks
+CONTAINER_EXTENSIONS = ('.h5', '.hdf5', '.nxs', '.edf')
+# Separator between the container file and the frame index in a frame name
+FRAME_SEPARATOR = '#'
+# Number of containers kept open by a process
+MAX_OPEN_CONTAINERS = 4
+# Eiger data file, holding frames also reached through the <stem>_master.h5 file
+EIGER_DATA_REGEX = re.compile(r'^(?P<stem>.+)_data_\d{6}(?P<ext>\.h5|\.hdf5)$', re.IGNORECASE)
+
+# Containers opened by the current process, most recently used last
+_containers = OrderedDict()
+
+
+def is_container(file: str) -> bool:
+    """Check if a file may hold several frames
+
+    Args:
+        file (str): Image file
+
+    Returns:
+        bool: True for HDF5/NeXus and EDF files
+    """
+    return os.path.splitext(file)[1].lower() in CONTAINER_EXTENSIONS
+
+
+def master_files(files: list) -> list:
+    """Containers of a folder without the Eiger data files of a master file of the same folder,
+    the frames of a series being listed once, through its master file
+
+    Args:
+        files (list): Container files of a folder
+
+    Returns:
+        list: Files kept, in the same order
+    """
+    names = set(files)
+    kept = []
+    for file in files:
+        match = EIGER_DATA_REGEX.match(file)
+        if match and match.group('stem') + '_master' + match.group('ext') in names:
+            continue
+        kept.append(file)
+    return kept
+
+
+def frame_name(container: str, index: int) -> str:
+    """Name of a frame of a container, used in the lists of images like a file name
+
+    Args:
+        container (str): Container file
+        index (int): Frame index in the container
+
+    Returns:
+        str: Frame name, e.g. Sample_master.h5#12
+    """
+    return f"{container}{FRAME_SEPARATOR}{index}"
+
+
+def split_frame(img: str) -> tuple:
+    """File and frame index of an image or a frame of a container
+
+    Args:
+        img (str): Image file or frame name
+
+    Returns:
+        tuple: File and frame index, None for a single-frame file
+    """
+    file, sep, index = img.rpartition(FRAME_SEPARATOR)
+    if sep and index.isdigit() and is_container(file):
+        return file, int(index)
+    return img, None
+
+
+def frame_basename(img: str) -> str:
+    """Name without extension used for the diffractograms of an image or a frame of a container
+
+    Args:
+        img (str): Image file or frame name
+
+    Returns:
+        str: e.g. Sample_X_000 for Sample_X_000.cbf, Sample_master_12 for Sample_master.h5#12
+    """
+    file, index = split_frame(img)
+    if index is None:
+        return os.path.splitext(img)[0]
+    return f"{os.path.splitext(file)[0]}_{index}"
+
+
+def _open_container(file: str) -> object:
+    """Open a container, kept open for the next frames of the same file"""
+    if file in _containers:
+        _containers.move_to_end(file)
+        return _containers[file]
+    import fabio
+    image = fabio.open(file)
+    _containers[file] = image
+    while len(_containers) > MAX_OPEN_CONTAINERS:
+        _, oldest = _containers.popitem(last=False)
+        oldest.close()
+    return image
+
+
+def nb_frames(file: str) -> int:
+    """Number of frames of an image file
+
+    Args:
+        file (str): Image file
+
+    Returns:
+        int: Number of frames, 1 for a single-frame file
+    """
+    if not is_container(file):
+        return 1
+    return _open_container(file).nframes
+
+
+def list_frames(file: str) -> list:
+    """Images of a file: the file itself, or a frame name for each frame of a container
+
+    Args:
+        file (str): Image file
+
+    Returns:
+        list: Image file or frame names
+    """
+    if not is_container(file):
+        return [file]
+    n = nb_frames(file)
+    if n == 1 and os.path.splitext(file)[1].lower() == '.edf':
+        return [file]
+    return [frame_name(file, i) for i in range(n)]
+
+
+def read_frame(img: str, folder: str = '') -> np.ndarray:
+    """Decode an image or a frame of a container
+
+    Args:
+        img (str): Image file or frame name
+        folder (str, optional): Folder of relative image files. Defaults to ''.
+
+    Returns:
+        np.ndarray: 2D image
+    """
+    file, index = split_frame(img)
+    file = os.path.join(folder, file)
+    if index is None:
+        import fabio
+        return fabio.open(file).data
+    return _open_container(file).getframe(index).data
@@ -0,0 +1,157 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the run report
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory is not reported
+    resource = None
+
+# Progress line parsed by the Gooey progress bar, see PROGRESS_REGEX
+PROGRESS_REGEX = r"^Progress: (?P<current>\d+)/(?P<total>\d+)"
+PROGRESS_EXPR = "current / total * 100"
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def peak_memory() -> dict:
+    """Peak resident memory of the current process and of the largest worker process terminated
+
+    Returns:
+        dict: Peak memory in MB of 'process' and 'workers', None if not available
+    """
+    if resource is None:
+        return {'process': None, 'workers': None}
+    # ru_maxrss is in bytes on macOS and in kB on Linux
+    unit = 1 if sys.platform == 'darwin' else 1024
+    process = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 ** 2
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 ** 2
+    return {'process': round(process, 1), 'workers': round(workers, 1) if workers else None}
+
+
+class RunReport:
+    """Timing of a run: wall time per stage and per frame, bytes read and written and failures.
+    Prints a progress line with the estimated remaining time and writes a JSON report.
+    """
+
+    def __init__(self, parameters: dict = None):
+        """Start the report
+
+        Args:
+            parameters (dict, optional): Parameters of the run recorded in the report. Defaults to None.
+        """
+        self.parameters = parameters or {}
+        self.stages = {}
+        self.frames = []
+        self.failures = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._start = time.perf_counter()
+        self._last_frame = None
+        self._progress_start = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the wall time of a stage, a stage run several times is accumulated
+
+        Args:
+            name (str): Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def start_frames(self, total: int):
+        """Start the timing of a batch of frames
+
+        Args:
+            total (int): Number of frames of the batch
+        """
+        self._total = total
+        self._done = 0
+        self._progress_start = self._last_frame = time.perf_counter()
+
+    def frame(self, name: str, read: int = 0, written: int = 0, error: str = None):
+        """Record a processed frame and print the progress line
+
+        Args:
+            name (str): Frame name
+            read (int, optional): Bytes read for the frame. Defaults to 0.
+            written (int, optional): Bytes written for the frame. Defaults to 0.
+            error (str, optional): Traceback if the frame failed. Defaults to None.
+        """
+        now = time.perf_counter()
+        if self._last_frame is None:
+            self.start_frames(1)
+        self.frames.append({'frame': name, 'seconds': now - self._last_frame,
+                            'bytes_read': read, 'bytes_written': written, 'failed': error is not None})
+        self._last_frame = now
+        self.bytes_read += read
+        self.bytes_written += written
+        if error is not None:
+            self.failures.append({'frame': name, 'traceback': error})
+
+        self._done += 1
+        elapsed = now - self._progress_start
+        remaining = elapsed / self._done * (self._total - self._done)
+        print(f"Progress: {self._done}/{self._total} ({self._done / max(self._total, 1):.0%})"
+              f" - {name} - ETA {_format_duration(remaining)}")
+        sys.stdout.flush()
+
+    def add_written(self, nbytes: int):
+        """Record bytes written outside of the frames, e.g. by the post-processing"""
+        self.bytes_written += nbytes
+
+    def summary(self) -> dict:
+        """Content of the report
+
+        Returns:
+            dict: Report of the run
+        """
+        wall = time.perf_counter() - self._start
+        frame_time = sum(f['seconds'] for f in self.frames)
+        return {
+            'parameters': self.parameters,
+            'python': platform.python_version(),
+            'wall_seconds': wall,
+            'stages_seconds': self.stages,
+            'nb_frames': len(self.frames),
+            'nb_failures': len(self.failures),
+            'frames_per_s': len(self.frames) / frame_time if frame_time > 0 else None,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_memory_mb': peak_memory(),
+            'frames': self.frames,
+            'failures': self.failures,
+        }
+
+    def write(self, file: str):
+        """Write the report as JSON
+
+        Args:
+            file (str): Name for the file
+        """
+        with open(file, 'w') as f:
+            json.dump(self.summary(), f, indent=1, default=str)
+
+
+def file_size(file: str) -> int:
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(file)
+    except OSError:
+        return 0
@@ -0,0 +1,147 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the cache of the integrated diffractograms
+import os
+import hashlib
+import numpy as np
+from src.utils import atomic_write
+
+# Default size limit of the cache, in MB: disabled, a first run hashes every frame
+# and writes its diffractograms to the cache, which only pays off when the series is integrated again
+RESULT_CACHE_SIZE = 0
+
+
+def parameters_key(PONI: str, DARK: str, npt: int, groups: tuple) -> str:
+    """Hash of the integration inputs shared by every frame of a series
+
+    Args:
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        npt (int): Number of points of the 1D diffractograms
+        groups (tuple): Groups of [start, end] sectors in degrees
+
+    Returns:
+        str: Hash of the content of the .poni and dark files, the number of points and the sectors
+    """
+    key = hashlib.blake2b(digest_size=20)
+    for file in (PONI, DARK):
+        if file:
+            with open(file, 'rb') as f:
+                key.update(hashlib.blake2b(f.read()).digest())
+        else:
+            key.update(b'none')
+    key.update(repr((int(npt), [[tuple(float(a) for a in sector) for sector in group]
+                                for group in groups])).encode())
+    return key.hexdigest()
+
+
+class ResultCache:
+    """Raw integrated diffractograms of the frames, before any post-processing.
+
+    An entry is keyed by the content of the frame and the integration inputs (see parameters_key),
+    so that a new run changing only the post-processing, the naming or the output folder
+    reads the diffractograms instead of decoding and integrating the frames again.
+    The modification time of an entry is its last use, the least recently used entries
+    are removed when the cache exceeds its size limit.
+    """
+
+    def __init__(self, cache_dir: str, parameters: str, size_limit: float = RESULT_CACHE_SIZE):
+        """Open the cache of a series
+
+        Args:
+            cache_dir (str): Folder of the cache
+            parameters (str): Hash of the integration inputs, see parameters_key
+            size_limit (float, optional): Size limit of the cache in MB. Defaults to RESULT_CACHE_SIZE.
+        """
+        self.cache_dir = cache_dir
+        self.parameters = parameters
+        self.size_limit = int(size_limit * 1024 ** 2)
+
+    def frame_key(self, content: bytes) -> str:
+        """Key of a frame
+
+        Args:
+            content (bytes): Bytes of the image file, or of the decoded frame of a container
+
+        Returns:
+            str: Hash of the frame content and the integration inputs
+        """
+        key = hashlib.blake2b(content, digest_size=20)
+        key.update(self.parameters.encode())
+        return key.hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def get(self, key: str) -> tuple:
+        """Diffractograms of a frame, if cached
+
+        Args:
+            key (str): Key of the frame
+
+        Returns:
+            tuple: 2theta values, intensities (groups, npt), chi range and statistics of the 2D image
+                (None if not stored), None if the frame is not cached
+        """
+        file = self._file(key)
+        try:
+            with np.load(file) as f:
+                result = (f['radial'], f['intensities'], tuple(f['chi_range'].tolist()),
+                          f['image_stats'] if 'image_stats' in f.files else None)
+            os.utime(file)
+            return result
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, radial: np.ndarray, intensities: np.ndarray, chi_range: tuple,
+            image_stats: np.ndarray = None):
+        """Store the diffractograms of a frame, written to a temporary file then renamed
+
+        Args:
+            key (str): Key of the frame
+            radial (np.ndarray): 2theta values
+            intensities (np.ndarray): Intensities, an array (groups, npt)
+            chi_range (tuple): Azimuthal range of the detector
+            image_stats (np.ndarray, optional): Statistics of the 2D image. Defaults to None.
+        """
+        file = self._file(key)
+        try:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with atomic_write(file, 'wb') as f:
+                arrays = {} if image_stats is None else {'image_stats': image_stats}
+                np.savez(f, radial=radial, intensities=intensities, chi_range=np.array(chi_range), **arrays)
+        except OSError:
+            # The cache is an optimization, integration goes on without it
+            pass
+
+    def evict(self) -> int:
+        """Remove the least recently used entries until the cache is below its size limit
+
+        Returns:
+            int: Number of entries removed
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith('.npz'):
+                    try:
+                        stat = os.stat(os.path.join(root, file))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, file in sorted(entries):
+            if total <= self.size_limit:
+                break
+            try:
+                os.remove(file)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
@@ -3,8 +3,15 @@ from colored import stylize, attr, fg, set_tty_aware
 set_tty_aware(False)
 # Imports for reversing diffractograms
 import os
+import json
 import shutil
+import tempfile
 import src.utils as IXR2D
+from src.catalog import scan
+from src.frame_stats import exclude_files
+
+# Provenance of the reversed diffractograms, written in the reverse folder
+MANIFEST_FILE = 'reverse_manifest.json'
 
 
 
@@ -49,22 +56,88 @@ def ui_reverse_fp(action):
             }
         },
     )
+    # Copy instead of hard links
+    groupReverse_fp.add_argument(
+        '--COPY',
+        metavar='Copy files',
+        action='store_true',
+        help='Write copies of the diffractograms instead of hard links to the original files'
+    )
+    # Exclusion of frames from the statistics saved during the integration
+    groupReverse_fp.add_argument(
+        '--EXCLUDE',
+        metavar='Excluded frames',
+        nargs='*',
+        help='Exclude the diffractograms whose frame matches one of the conditions on the frame statistics, '
+             'e.g. saturated>0 total<1e6'
+    )
+    groupReverse_fp.add_argument(
+        '--STATS',
+        metavar='Frame statistics',
+        help='Table of frame statistics (*_frame_stats.csv), defaults to the one in the folder of the diffractograms',
+        widget='FileChooser'
+    )
+
+
+def _link_or_copy(source: str, destination: str, copy: bool = False) -> str:
+    """Create a diffractogram of the reversed series, as a hard link to the original file when possible
+
+    Args:
+        source (str): Original diffractogram
+        destination (str): Reversed diffractogram
+        copy (bool, optional): Always write a copy of the file. Defaults to False.
+
+    Returns:
+        str: 'link' or 'copy'
+    """
+    if not copy:
+        try:
+            os.link(source, destination)
+            return 'link'
+        except OSError:
+            # File system without hard links or destination on another device
+            pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+def _replace_folder(temp_folder: str, folder: str):
+    """Replace a folder by a completely populated one
+
+    Args:
+        temp_folder (str): Populated folder, on the same file system
+        folder (str): Folder to replace
+    """
+    if not os.path.exists(folder):
+        os.rename(temp_folder, folder)
+        return
+    old_folder = tempfile.mkdtemp(prefix='.' + os.path.basename(folder) + '.old-',
+                                  dir=os.path.dirname(folder))
+    os.rename(folder, os.path.join(old_folder, 'previous'))
+    os.rename(temp_folder, folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
 
 
 def reverse_fp(args):
     FOLDER, DELIMITER_ON, FILE_PATTERN = [
         args.FOLDER, args.DELIMITER_ON, args.FILE_PATTERN]
-    fileArray = []
-    reversedArray = []
+    COPY = getattr(args, 'COPY', False)
+    reversedArray = {}
     FILE_EXTENSION = '.dat'
 
+    FOLDER = os.path.abspath(FOLDER)
     os.chdir(FOLDER)
 
     print(stylize(">> Scan of diffractograms to be inverted", attr("bold")))
 
-    for file in os.listdir(FOLDER):
-        if os.path.splitext(file)[1] == FILE_EXTENSION:
-            fileArray.append(file)
+    # Numbered 1D diffractograms, sorted by index
+    fileArray = scan(FOLDER, (FILE_EXTENSION,)).files(numbered=True)
+    # Frames excluded from the statistics are left out of the reversed numbering
+    try:
+        fileArray = exclude_files(fileArray, getattr(args, 'EXCLUDE', None), getattr(args, 'STATS', None))
+    except (OSError, ValueError) as error:
+        print(stylize(f'>> {error}', fg("red") + attr("bold")))
+        return
 
     print(f"Reversing {len(fileArray)} diffractograms")
 
@@ -74,33 +147,39 @@ def reverse_fp(args):
 
     REVERSE_FOLDER = FILE_PATTERN + '_REVERSE'
 
-    if not os.path.exists(REVERSE_FOLDER):
-        os.mkdir(REVERSE_FOLDER)
-
     # Creation of the list of reversed diffractograms index
     reversed_index = [i for i in range(1, len(fileArray) + 1)]
 
-    # Numerical sorting of the 1D diffractograms
-    sortedFiles = sorted(fileArray, key=lambda x: int(os.path.splitext(
-        x)[0].replace(FILE_PATTERN, '').replace(FILE_EXTENSION, '').replace('_', '')))
+    # The reversed series is built in a temporary folder, renamed once complete:
+    # an interrupted run never leaves a partially populated reverse folder
+    temp_folder = tempfile.mkdtemp(prefix='.' + REVERSE_FOLDER + '.tmp-', dir=FOLDER)
+    try:
+        for file, index in zip(reversed(fileArray), reversed_index):
+            try:
+                print(f'Processing: {file}')
+                reversed_filename = REVERSE_FOLDER + \
+                    '_' + str(index) + FILE_EXTENSION
+                _link_or_copy(os.path.join(FOLDER, file),
+                              os.path.join(temp_folder, reversed_filename), COPY)
+                reversedArray[reversed_filename] = file
+            except OSError:
+                print(stylize(f'>> Problem after file : {file}', fg(
+                    "red") + attr("bold")))
+
+        # Origin of every reversed diffractogram in one file instead of a header line in each file
+        manifest = {
+            'source': FOLDER,
+            'pattern': FILE_PATTERN,
+            'files': reversedArray,
+        }
+        with open(os.path.join(temp_folder, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+        # mkdtemp creates the folder private to its owner
+        os.chmod(temp_folder, IXR2D.created_mode(0o777))
+        _replace_folder(temp_folder, os.path.join(FOLDER, REVERSE_FOLDER))
+    except BaseException:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
 
-    for file, index in zip(reversed(sortedFiles), reversed_index):
-        try:
-            print(f'Processing: {file}')
-            reversed_filename = REVERSE_FOLDER + \
-                '_' + str(index) + FILE_EXTENSION
-            reversedArray.append(reversed_filename)
-            shutil.copy(file, reversed_filename)
-            comment = f'### Reversed file from: {file}'
-            IXR2D.prepend_line(reversed_filename, comment, multi=False)
-        except:
-            print(stylize(f'>> Problem after file : {file}', fg(
-                "red") + attr("bold")))
-
-    print(stylize(">> Cleaning working directory", attr("bold")))
-
-    pathDestFolder = os.path.join(FOLDER, REVERSE_FOLDER)
-
-    for revfile in reversedArray:
-        shutil.move(os.path.join(FOLDER, revfile),
-                    os.path.join(pathDestFolder, revfile))
+    print(stylize(f"Reversed diffractograms saved: {REVERSE_FOLDER}", fg("green")))
@@ -0,0 +1,183 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the sector integration
+import numpy as np
+
+# Number of pixels gathered at once by the low-memory integration
+CHUNK = 1 << 20
+
+
+class SectorIntegrator:
+    """Integration of several azimuthal sectors of a 2D image in a single pass over the pixels.
+
+    The pixel to (2theta bin, sector) mapping is computed once for a geometry, an image shape
+    and a set of sectors, then reused for every image of the series.
+    Each sector is a [start, end] interval in degrees using the pyFAI -180°/180° convention,
+    an interval going through ±180° is written with end > 180 (e.g. [165, 195]).
+    Sectors are gathered in groups, the pattern of a group being the sum of the patterns of its sectors.
+    """
+
+    def __init__(self, poni: object, shape: tuple, npt: int, groups: list):
+        """Build the pixel mapping of the sectors
+
+        Args:
+            poni (object): pyFAI geometry loaded from the .poni file
+            shape (tuple): Shape of the 2D images
+            npt (int): Number of points of the 1D diffractograms
+            groups (list): List of groups, each one being a list of [start, end] sectors in degrees
+        """
+        self.shape = tuple(shape)
+        self.npt = int(npt)
+        self.groups = [[tuple(float(a) for a in sector) for sector in group] for group in groups]
+
+        tth = np.ascontiguousarray(poni.center_array(self.shape, unit="2th_deg")).ravel()
+        chi = np.ascontiguousarray(poni.center_array(self.shape, unit="chi_deg")).ravel()
+        solid_angle = np.ascontiguousarray(poni.solidAngleArray(self.shape)).ravel()
+
+        valid = np.ones(tth.size, dtype=bool)
+        if poni.detector.mask is not None and poni.detector.mask.shape == self.shape:
+            valid &= np.logical_not(poni.detector.mask.ravel())
+
+        # Same radial range as pyFAI: pixel centers of the whole detector
+        tth_min, tth_max = tth[valid].min(), tth[valid].max()
+        self.chi_range = (float(chi[valid].min()), float(chi[valid].max()))
+        step = (tth_max - tth_min) / self.npt
+        self.radial = tth_min + (np.arange(self.npt) + 0.5) * step
+        tth_bin = np.clip(((tth - tth_min) / step).astype(np.int64), 0, self.npt - 1)
+
+        pixels, bins = [], []
+        self.nb_sectors = 0
+        for group in self.groups:
+            for start, end in group:
+                width = end - start
+                # Angular distance from the start of the sector, wrapped through ±180°
+                inside = valid & (np.mod(chi - start, 360.0) <= width)
+                selected = np.flatnonzero(inside)
+                pixels.append(selected)
+                bins.append(tth_bin[selected] + self.nb_sectors * self.npt)
+                self.nb_sectors += 1
+
+        self._pixels = np.concatenate(pixels)
+        self._bins = np.concatenate(bins)
+        self._size = self.nb_sectors * self.npt
+        normalization = np.bincount(self._bins, weights=solid_angle[self._pixels],
+                                    minlength=self._size)
+        with np.errstate(divide='ignore'):
+            self._inv_normalization = np.where(normalization > 0, 1.0 / normalization, 0.0)
+
+        # Sum of the sector patterns belonging to each group
+        self._group_of_sector = np.repeat(np.arange(len(self.groups)),
+                                          [len(group) for group in self.groups])
+
+    def save(self, file: str):
+        """Save the pixel mapping to a .npz file
+
+        Args:
+            file (str): File opened in binary mode or name of the file
+        """
+        np.savez(file,
+                 shape=np.array(self.shape), npt=self.npt,
+                 sectors=np.array([sector for group in self.groups for sector in group]).reshape(-1, 2),
+                 group_sizes=np.array([len(group) for group in self.groups]),
+                 radial=self.radial, chi_range=np.array(self.chi_range),
+                 pixels=self._pixels, bins=self._bins,
+                 inv_normalization=self._inv_normalization)
+
+    @classmethod
+    def load(cls, file: str) -> 'SectorIntegrator':
+        """Load a pixel mapping saved with save, without recomputing the geometry
+
+        Args:
+            file (str): File opened in binary mode or name of the file
+
+        Returns:
+            SectorIntegrator: Integrator ready to use
+        """
+        integrator = cls.__new__(cls)
+        with np.load(file) as saved:
+            integrator.shape = tuple(int(n) for n in saved['shape'])
+            integrator.npt = int(saved['npt'])
+            sectors = [tuple(float(a) for a in sector) for sector in saved['sectors']]
+            bounds = np.cumsum(np.concatenate(([0], saved['group_sizes'])))
+            integrator.groups = [sectors[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+            integrator.radial = saved['radial']
+            integrator.chi_range = tuple(float(a) for a in saved['chi_range'])
+            integrator._pixels = saved['pixels']
+            integrator._bins = saved['bins']
+            integrator._inv_normalization = saved['inv_normalization']
+        integrator.nb_sectors = len(sectors)
+        integrator._size = integrator.nb_sectors * integrator.npt
+        integrator._group_of_sector = np.repeat(np.arange(len(integrator.groups)),
+                                                [len(group) for group in integrator.groups])
+        return integrator
+
+    def integrate_sectors(self, data: np.ndarray, dark: np.ndarray = None) -> np.ndarray:
+        """Integrate every sector of an image in a single pass
+
+        Args:
+            data (np.ndarray): 2D image
+            dark (np.ndarray, optional): Dark image subtracted from data. Defaults to None.
+
+        Returns:
+            np.ndarray: Array (number of sectors, npt) of the intensities of each sector
+        """
+        signal = np.asarray(data).ravel()[self._pixels].astype(np.float64)
+        if dark is not None:
+            signal -= np.asarray(dark).ravel()[self._pixels]
+        sums = np.bincount(self._bins, weights=signal, minlength=self._size)
+        sums *= self._inv_normalization
+        return sums.reshape(self.nb_sectors, self.npt)
+
+    def integrate(self, data: np.ndarray, dark: np.ndarray = None) -> np.ndarray:
+        """Integrate every group of sectors of an image in a single pass
+
+        Args:
+            data (np.ndarray): 2D image
+            dark (np.ndarray, optional): Dark image subtracted from data. Defaults to None.
+
+        Returns:
+            np.ndarray: Array (number of groups, npt) of the intensities of each group
+        """
+        sectors = self.integrate_sectors(data, dark)
+        groups = np.zeros((len(self.groups), self.npt))
+        np.add.at(groups, self._group_of_sector, sectors)
+        return groups
+
+    def compact(self):
+        """Store the pixel mapping with 32-bit indices, halving its memory"""
+        if self._pixels.dtype != np.int32 and self.shape[0] * self.shape[1] < 2 ** 31 and self._size < 2 ** 31:
+            self._pixels = self._pixels.astype(np.int32)
+            self._bins = self._bins.astype(np.int32)
+
+    def integrate_low_memory(self, data: np.ndarray) -> np.ndarray:
+        """Integrate every group of sectors of an image, gathering the pixels by chunks
+        into buffers reused from one image to the next. The dark must already be subtracted.
+        The returned array is overwritten by the next call.
+
+        Args:
+            data (np.ndarray): 2D image, float32 for the lowest memory use
+
+        Returns:
+            np.ndarray: Array (number of groups, npt) of the intensities of each group
+        """
+        if getattr(self, '_buffers', None) is None or self._buffers[0].dtype != data.dtype:
+            self._buffers = (np.empty(min(CHUNK, self._pixels.size), dtype=data.dtype),
+                             np.empty(self._size),
+                             np.empty((len(self.groups), self.npt)))
+        signal, sums, groups = self._buffers
+
+        flat = np.asarray(data).ravel()
+        sums[:] = 0
+        for start in range(0, self._pixels.size, CHUNK):
+            pixels = self._pixels[start:start + CHUNK]
+            np.take(flat, pixels, out=signal[:pixels.size], mode='clip')
+            sums += np.bincount(self._bins[start:start + CHUNK], weights=signal[:pixels.size],
+                                minlength=self._size)
+        sums *= self._inv_normalization
+
+        groups[:] = 0
+        np.add.at(groups, self._group_of_sector, sums.reshape(self.nb_sectors, self.npt))
+        return groups
@@ -0,0 +1,318 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# GUI import
+from colored import stylize, attr, fg, set_tty_aware
+set_tty_aware(False)
+# Imports for the sharing of a series between independent workers
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+from src.utils import atomic_write
+from src.watch import parameters_hash
+from src.report import RunReport
+from src.frame_stats import FrameStats, STATS_SUFFIX
+from src.integration import (integrate_images, integration_parameters, track_results, finalize_outputs,
+                             output_folder, save_stats)
+
+# Description of the job, written by the first worker
+JOB_FILE = 'job.json'
+# Marker of the merged job
+MERGED_FILE = 'merged.json'
+# Lock of the merge, held by the run merging the batches
+MERGE_LOCK = 'merge.lock'
+
+
+def _write_json(file: str, content: dict):
+    """Write a JSON file atomically, other workers never read a partial file"""
+    with atomic_write(file) as f:
+        json.dump(content, f, indent=1)
+
+
+def _create_exclusive(file: str, content: dict) -> bool:
+    """Create a file only if it does not exist, atomic on local and NFS file systems
+
+    Args:
+        file (str): File to create
+        content (dict): JSON content
+
+    Returns:
+        bool: True if this call created the file
+    """
+    try:
+        fd = os.open(file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump(content, f)
+    return True
+
+
+def _owner() -> dict:
+    """Identity of the current worker, recorded in its claims"""
+    return {'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()}
+
+
+class ShardJob:
+    """Series shared between independent workers through a folder of a shared file system.
+
+    The first worker writes the list of images and the integration parameters in job.json.
+    Images are split in batches, a worker claims a batch by creating its lock file
+    claims/batch_<n>.lock exclusively, integrates it in batches/batch_<n>/ and records the
+    written files in done/batch_<n>.json. The worker completing the last batch claims the
+    merge, which moves every batch to the usual output folder and records each merged batch
+    in merged/batch_<n>.json, a merge taken over from a stopped run goes on from there.
+    A worker refreshes the modification time of its lock while it works, a lock left
+    unchanged for longer than the timeout belongs to a stopped worker and can be taken over.
+    """
+
+    def __init__(self, folder: str, job: dict):
+        self.folder = folder
+        self.images = job['images']
+        self.bins = job.get('bins', {})
+        self.parameters = job['parameters']
+        self.batch_size = job['batch_size']
+        self.nb_batches = (len(self.images) + self.batch_size - 1) // self.batch_size
+
+    @classmethod
+    def open(cls, folder: str, images: list, parameters: str, batch_size: int, bins: dict = None) -> 'ShardJob':
+        """Join the job of a folder, created with the given images if it does not exist
+
+        Args:
+            folder (str): Folder of the job, on the file system shared by the workers
+            images (list): Images of the series, used if the job is created
+            parameters (str): Hash of the integration parameters, must be the same for every worker
+            batch_size (int): Number of images claimed at once, used if the job is created
+            bins (dict, optional): Frames of each group of binned frames. Defaults to None.
+
+        Raises:
+            ValueError: The job was created with other integration parameters
+            RuntimeError: The worker creating the job stopped before describing it
+
+        Returns:
+            ShardJob: Job of the folder
+        """
+        for subfolder in ('claims', 'done', 'batches', 'merged'):
+            os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+
+        job_file = os.path.join(folder, JOB_FILE)
+        job = {'images': images, 'bins': bins or {}, 'parameters': parameters,
+               'batch_size': max(1, int(batch_size)), 'created': _owner()}
+        if not _create_exclusive(job_file + '.lock', _owner()):
+            # Another worker creates or created the job, wait for its description
+            start = time.time()
+            while not os.path.exists(job_file):
+                if time.time() - start > 60:
+                    raise RuntimeError(f"{job_file}.lock exists without job description, remove it to start the job again")
+                time.sleep(0.5)
+            with open(job_file) as f:
+                job = json.load(f)
+        else:
+            _write_json(job_file, job)
+
+        if job['parameters'] != parameters:
+            raise ValueError(f"The job {folder} was created with other integration parameters")
+        return cls(folder, job)
+
+    def _name(self, batch: int) -> str:
+        return f"batch_{batch:05d}"
+
+    def batch_images(self, batch: int) -> list:
+        """Images of a batch"""
+        return self.images[batch * self.batch_size:(batch + 1) * self.batch_size]
+
+    def batch_folder(self, batch: int) -> str:
+        """Folder of the diffractograms of a batch, created if needed"""
+        folder = os.path.join(self.folder, 'batches', self._name(batch))
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _lock(self, batch: int) -> str:
+        """Lock file of a batch, of the merge if batch is None"""
+        if batch is None:
+            return os.path.join(self.folder, MERGE_LOCK)
+        return os.path.join(self.folder, 'claims', self._name(batch) + '.lock')
+
+    def is_done(self, batch: int) -> bool:
+        return os.path.exists(os.path.join(self.folder, 'done', self._name(batch) + '.json'))
+
+    def claim(self, timeout: float = 0) -> int:
+        """Claim the next batch neither done nor claimed by another worker
+
+        Args:
+            timeout (float, optional): Time in hours after which the claim of a batch
+                not done is considered abandoned and can be claimed again, 0 to never. Defaults to 0.
+
+        Returns:
+            int: Batch claimed, None if there is no batch left
+        """
+        for batch in range(self.nb_batches):
+            if not self.is_done(batch) and self._acquire(self._lock(batch), timeout):
+                return batch
+        return None
+
+    def heartbeat(self, batch: int = None):
+        """Refresh the claim of a batch being integrated, or of the merge if batch is None,
+        so that it is not taken over as abandoned
+
+        Args:
+            batch (int, optional): Batch claimed by the current worker. Defaults to None.
+        """
+        try:
+            os.utime(self._lock(batch))
+        except OSError:
+            pass
+
+    def _acquire(self, lock: str, timeout: float) -> bool:
+        """Create a lock recording the current worker, taking over a lock not refreshed for timeout hours"""
+        if _create_exclusive(lock, _owner()):
+            return True
+        return timeout > 0 and self._release_stale(lock, timeout) and _create_exclusive(lock, _owner())
+
+    def _release_stale(self, lock: str, timeout: float) -> bool:
+        """Remove a lock not refreshed for timeout hours, only one worker succeeds in renaming it"""
+        try:
+            if time.time() - os.path.getmtime(lock) < timeout * 3600:
+                return False
+            os.rename(lock, f"{lock}.stale-{uuid.uuid4().hex}")
+            return True
+        except OSError:
+            return False
+
+    def complete(self, batch: int, written: list, failures: list):
+        """Record a batch as integrated
+
+        Args:
+            batch (int): Batch integrated
+            written (list): .dat files written in the folder of the batch
+            failures (list): List of (image, traceback) failures
+        """
+        _write_json(os.path.join(self.folder, 'done', self._name(batch) + '.json'),
+                    {'written': written, 'failures': failures, 'owner': _owner()})
+
+    def done_batches(self) -> list:
+        """Record of each batch, None for the batches not done yet"""
+        records = []
+        for batch in range(self.nb_batches):
+            try:
+                with open(os.path.join(self.folder, 'done', self._name(batch) + '.json')) as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                records.append(None)
+        return records
+
+    def is_batch_merged(self, batch: int) -> bool:
+        return os.path.exists(os.path.join(self.folder, 'merged', self._name(batch) + '.json'))
+
+    def batch_merged(self, batch: int):
+        """Record a batch as moved to the output folder"""
+        _write_json(os.path.join(self.folder, 'merged', self._name(batch) + '.json'), _owner())
+
+    def is_merged(self) -> bool:
+        return os.path.exists(os.path.join(self.folder, MERGED_FILE))
+
+    def claim_merge(self, timeout: float = 0) -> bool:
+        """Claim the merge of the job, once every batch is done
+
+        Args:
+            timeout (float, optional): Time in hours after which the merge of a stopped run
+                is claimed again, 0 to never. Defaults to 0.
+
+        Returns:
+            bool: True if the current worker must merge the job
+        """
+        if self.is_merged() or any(record is None for record in self.done_batches()):
+            return False
+        return self._acquire(self._lock(None), timeout)
+
+    def merged(self):
+        """Record the job as merged and remove the emptied batch folders"""
+        _write_json(os.path.join(self.folder, MERGED_FILE), _owner())
+        shutil.rmtree(os.path.join(self.folder, 'batches'), ignore_errors=True)
+
+
+def process_shards(imagesArray: list, PONI: str, DARK: str, settings: dict, workers: int = 1,
+                   queue_depth: int = 0, report: RunReport = None, batch_size: int = 100,
+                   timeout: float = 0) -> tuple:
+    """Integrate the batches of a series shared with other runs, then merge them if every batch is done
+
+    Args:
+        imagesArray (list): 2D images to integrate, used by the first run only
+        PONI (str): Detector calibration .poni file
+        DARK (str): Dark file, None if no dark is used
+        settings (dict): Integration settings shared by every image of the series
+        workers (int, optional): Number of processes of this run. Defaults to 1.
+        queue_depth (int, optional): Queue depth of the streaming mode, 0 to disable it. Defaults to 0.
+        report (RunReport, optional): Report of the run, completed with the timings. Defaults to None.
+        batch_size (int, optional): Number of images claimed at once. Defaults to 100.
+        timeout (float, optional): Time in hours after which an abandoned claim is claimed again, 0 to never. Defaults to 0.
+
+    Returns:
+        tuple: List of the images integrated by this run and list of (image, traceback) failures
+    """
+    if report is None:
+        report = RunReport()
+
+    try:
+        job = ShardJob.open(output_folder(settings) + '_SHARDS', imagesArray,
+                            parameters_hash(integration_parameters(PONI, DARK, settings)), batch_size,
+                            settings['bins'])
+    except (OSError, ValueError, RuntimeError) as error:
+        print(stylize(f'>> {error}', fg("red") + attr("bold")))
+        return [], []
+    settings['bins'] = job.bins
+    if job.is_merged():
+        print(stylize(f">> The series was already integrated and merged: {job.folder}", attr("bold")))
+        return [], []
+
+    print(stylize(f">> Sharded integration of {len(job.images)} images in {job.nb_batches} batches", attr("bold")))
+    integrated = []
+    failures = []
+    while True:
+        batch = job.claim(timeout)
+        if batch is None:
+            break
+        images = job.batch_images(batch)
+        print(stylize(f">> Batch {batch + 1}/{job.nb_batches}", attr("bold")))
+        batch_settings = dict(settings, work_folder=job.batch_folder(batch))
+        written = []
+        batch_failures = []
+        batch_stats = []
+        report.start_frames(len(images))
+        with report.stage('integration'):
+            results = integrate_images(images, PONI, DARK, batch_settings, workers, queue_depth)
+            for img, files, error in track_results(results, batch_settings, report, integrated, batch_failures,
+                                                   batch_stats):
+                written.extend(files)
+                job.heartbeat(batch)
+        save_stats(settings, batch_stats, os.path.join(job.batch_folder(batch), settings['pattern'] + STATS_SUFFIX))
+        job.complete(batch, written, batch_failures)
+        failures.extend(batch_failures)
+
+    # The run completing the last batch merges the batches of every run
+    if not job.claim_merge(timeout):
+        print("Batches left are integrated by other runs, the last one merges the diffractograms")
+        return integrated, failures
+
+    print(stylize(">> Merge of the batches", attr("bold")))
+    failures = []
+    stats = []
+    for batch, record in enumerate(job.done_batches()):
+        # Batches already moved by a stopped merge are skipped
+        if not job.is_batch_merged(batch):
+            finalize_outputs(dict(settings, work_folder=job.batch_folder(batch)), record['written'], report)
+            job.batch_merged(batch)
+        failures.extend((img, error) for img, error in record['failures'])
+        batch_stats = os.path.join(job.batch_folder(batch), settings['pattern'] + STATS_SUFFIX)
+        if settings['stats'] and os.path.exists(batch_stats):
+            stats.extend(FrameStats.load(batch_stats).rows())
+        job.heartbeat()
+    save_stats(settings, stats, os.path.join(output_folder(settings), settings['pattern'] + STATS_SUFFIX))
+    job.merged()
+    print(stylize(f"Diffractograms of {job.nb_batches} batches merged in {output_folder(settings)}", fg("green")))
+    return integrated, failures
@@ -0,0 +1,200 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for the stacked output of a series
+import os
+import json
+import struct
+import numpy as np
+from src.writers import get_writer
+
+# File layout:
+#   8 bytes    magic number
+#   8 bytes    length of the JSON header (little-endian unsigned integer)
+#   header     JSON metadata, padded with spaces to a multiple of ALIGN bytes
+#   radial     float64 (sectors, npt), 2theta values shared by every frame
+#   data       float32 (frames, sectors, npt), one row of each sector per frame
+#   status     uint8 (frames,), 1 once the frame has been integrated
+MAGIC = b'IXR2DSTK'
+ALIGN = 64
+EXTENSION = '.ixr'
+# Frames of a sector read from the stack at once when exporting .dat files
+EXPORT_BLOCK = 256
+
+
+class SeriesStack:
+    """Diffractograms of a whole series stored in a single memory-mapped file.
+
+    Each frame is a fixed-size row of the file, so any frame is read or written
+    in O(1) without touching the others, and the 2theta axis of each sector is stored once.
+    Per-frame metadata (original image file and index) is kept in the JSON header.
+    """
+
+    def __init__(self, file: str, header: dict, mode: str):
+        self.file = file
+        self.header = header
+        self.npt = header['npt']
+        self.sectors = header['sectors']
+        self.frames = header['frames']
+        nb_frames, nb_sectors = len(self.frames), len(self.sectors)
+
+        offset = header['offset']
+        self.radial = np.memmap(file, dtype='<f8', mode=mode, offset=offset,
+                                shape=(nb_sectors, self.npt))
+        offset += self.radial.nbytes
+        self.data = np.memmap(file, dtype='<f4', mode=mode, offset=offset,
+                              shape=(nb_frames, nb_sectors, self.npt))
+        offset += self.data.nbytes
+        self.status = np.memmap(file, dtype='u1', mode=mode, offset=offset,
+                                shape=(nb_frames,))
+
+    @classmethod
+    def create(cls, file: str, frames: list, npt: int, sectors: list, attrs: dict = None) -> 'SeriesStack':
+        """Create the file of a series, every frame row is allocated
+
+        Args:
+            file (str): Name for the file
+            frames (list): Metadata of each frame, e.g. {'file': ..., 'index': ...}
+            npt (int): Number of points per diffractogram
+            sectors (list): Name of each sector, e.g. ['axis0', 'axis90']
+            attrs (dict, optional): Metadata of the series. Defaults to None.
+
+        Returns:
+            SeriesStack: Stack opened for writing
+        """
+        header = {'npt': int(npt), 'sectors': list(sectors), 'frames': list(frames),
+                  'attrs': attrs or {}, 'offset': 0}
+        # The offset is part of the header, its length is fixed before computing the padding
+        header['offset'] = 10 ** 15
+        length = len(json.dumps(header).encode())
+        offset = -(-(16 + length) // ALIGN) * ALIGN
+        header['offset'] = offset
+        encoded = json.dumps(header).encode().ljust(offset - 16)
+
+        size = offset + len(sectors) * int(npt) * 8 + len(frames) * (len(sectors) * int(npt) * 4 + 1)
+        with open(file, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(encoded)))
+            f.write(encoded)
+            f.truncate(size)
+        stack = cls(file, header, 'r+')
+        stack.data[:] = np.nan
+        return stack
+
+    @classmethod
+    def open(cls, file: str, mode: str = 'r') -> 'SeriesStack':
+        """Open an existing stack
+
+        Args:
+            file (str): Name of the file
+            mode (str, optional): 'r' to read, 'r+' to read and write. Defaults to 'r'.
+
+        Returns:
+            SeriesStack: Stack of the series
+        """
+        with open(file, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f'{file} is not an IntegXR2D stack file')
+            length = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(length).decode())
+        return cls(file, header, mode)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def write_frame(self, i: int, radial: np.ndarray, intensities: np.ndarray):
+        """Store the diffractograms of a frame
+
+        Args:
+            i (int): Frame position in the stack
+            radial (np.ndarray): 2theta values, npt points
+            intensities (np.ndarray): Intensities, an array (sectors, npt)
+        """
+        if not self.status.any():
+            self.radial[:] = np.broadcast_to(radial, self.radial.shape)
+        self.data[i] = np.reshape(intensities, self.data.shape[1:])
+        self.status[i] = 1
+
+    def frame(self, i: int) -> tuple:
+        """Diffractograms of a frame
+
+        Args:
+            i (int): Frame position in the stack
+
+        Returns:
+            tuple: 2theta values (sectors, npt) and intensities (sectors, npt)
+        """
+        return self.radial, self.data[i]
+
+    def flush(self):
+        """Write the pending changes to the disk"""
+        for array in (self.radial, self.data, self.status):
+            if array.mode != 'r':
+                array.flush()
+
+
+def dat_filename(stack: SeriesStack, i: int, sector: int) -> str:
+    """FullProf file name of a diffractogram of the stack, same as the integration output
+
+    Args:
+        stack (SeriesStack): Stack of the series
+        i (int): Frame position in the stack
+        sector (int): Sector position in the stack
+
+    Returns:
+        str: File name
+    """
+    attrs = stack.header['attrs']
+    pattern, index = attrs['pattern'], stack.frames[i]['index']
+    if attrs.get('total', True):
+        divider = 2 if attrs.get('accel') else 1
+        return f"{pattern}_{int(index / divider)}.dat"
+    axis = stack.sectors[sector].replace('axis', '')
+    return f"{pattern}_axis{axis}_apert{attrs['aperture']}_{index}.dat"
+
+
+def export_dat(file: str, folder: str, start: int = 0, stop: int = None, sectors: list = None) -> list:
+    """Export a range of frames of a stack to FullProf .dat files
+
+    Args:
+        file (str): Stack file
+        folder (str): Output folder, created if needed
+        start (int, optional): First frame position. Defaults to 0.
+        stop (int, optional): Frame position after the last one. Defaults to None, end of the series.
+        sectors (list, optional): Sector names to export. Defaults to None, all sectors.
+
+    Returns:
+        list: Written files
+    """
+    stack = SeriesStack.open(file)
+    os.makedirs(folder, exist_ok=True)
+    writer = get_writer(stack.npt)
+    selected = [s for s, name in enumerate(stack.sectors) if sectors is None or name in sectors]
+    attrs = stack.header['attrs']
+
+    def header(i: int) -> list:
+        lines = [f"### Original file: {stack.frames[i]['file']}"]
+        if not attrs.get('total', True):
+            lines.append(f"### Azimutal integration parameters: ")
+            lines.append(f"### Angle: {attrs['aperture']} deg - Npt: {stack.npt}")
+        return lines
+
+    frames = [i for i in range(start, len(stack) if stop is None else min(stop, len(stack))) if stack.status[i]]
+    written = []
+    for s in selected:
+        # The diffractograms of a sector share its 2theta values, written by blocks of frames
+        for first in range(0, len(frames), EXPORT_BLOCK):
+            block = frames[first:first + EXPORT_BLOCK]
+            names = [dat_filename(stack, i, s) for i in block]
+            writer.write_many([os.path.join(folder, name) for name in names], stack.radial[s],
+                              stack.data[block, s], [header(i) for i in block])
+            written.extend(names)
+    return written
@@ -5,7 +5,57 @@
 
 import re
 import os
+import tempfile
+from contextlib import contextmanager
 import numpy as np
+from src.writers import get_writer
+from src.readers import is_container, nb_frames, frame_name, frame_basename, master_files, CONTAINER_EXTENSIONS
+from src.catalog import scan
+
+# Permission bits masked on creation, read once: os.umask can only be read by setting it
+_UMASK = None
+
+
+def created_mode(mode: int = 0o666) -> int:
+    """Permissions given by the process umask to a file (0o666) or a folder (0o777) created with open or mkdir
+
+    Args:
+        mode (int, optional): Requested permissions. Defaults to 0o666.
+
+    Returns:
+        int: Permissions of the created file or folder
+    """
+    global _UMASK
+    if _UMASK is None:
+        _UMASK = os.umask(0o022)
+        os.umask(_UMASK)
+    return mode & ~_UMASK
+
+
+@contextmanager
+def atomic_write(file: str, mode: str = 'w', **kwargs):
+    """Write a file through a temporary file of the same folder, renamed once complete:
+    readers never see a partial file and an interrupted write keeps the previous version.
+    The file gets the permissions of a file created with open, not the 0600 of mkstemp.
+
+    Args:
+        file (str): File to write
+        mode (str, optional): Opening mode, 'w' or 'wb'. Defaults to 'w'.
+        **kwargs: Other arguments of open, e.g. newline
+
+    Yields:
+        object: Opened temporary file
+    """
+    fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(file)))
+    try:
+        os.chmod(temp_file, created_mode())
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(temp_file, file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
 
 
 def saveazi(fname: object, cts, tth, chi, npt_tth: int, npt_chi: int) -> object:
@@ -22,42 +72,36 @@ def saveazi(fname: object, cts, tth, chi, npt_tth: int, npt_chi: int) -> object:
     Returns:
         object: .dat file with header
     """
-    f = open(fname, "w")
-    ligne = "### tth/chi " + \
-        str(npt_tth) + "  2theta values / " + str(npt_chi) + "  sectors  \n"
-    f.write(ligne)
-    f.write("### tth/chi  ")
-    f.write("  ".join(["%.2f" % (c) for c in chi]))
-    f.write("\n")
-    for i in range(len(tth)):
-        f.write("%f  " % (tth[i]))
-        f.write("  ".join(["%.4f" % (c) for c in cts[:, i]]))
-        f.write("\n")
-    f.close()
-
-
-def prepend_line(file: object, line: str, multi: bool) -> object:
+    header = [
+        "### tth/chi " + str(npt_tth) + "  2theta values / " + str(npt_chi) + "  sectors  ",
+        "### tth/chi  " + "  ".join(["%.2f" % (c) for c in chi]),
+    ]
+    cts = np.asarray(cts)
+    get_writer(len(tth), cts.shape[0]).write(fname, tth, cts, header)
+
+
+def prepend_line(file: object, line: str, multi: bool, output: str = None) -> object:
     """Add a line in the file header
 
     Args:
         file (object): File to modify
         line (str): Line to add
         multi (bool): Add several lines, line is then a list 
+        output (str, optional): File receiving the result, file being left unchanged. Defaults to None, file modified.
 
     Returns:
         object: File modified with new line added
     """
-    temp_file = file + '.bak'
-    with open(file, 'r') as read_file, open(temp_file, 'w') as write_file:
+    with open(file, 'r') as read_file:
+        content = read_file.read()
+    # Written atomically: an interrupted call leaves either the previous or the complete file
+    with atomic_write(output or file) as write_file:
         if multi == True:
             for l in line:
                 write_file.write(l + '\n')
         else:
             write_file.write(line + '\n')
-        for line in read_file:
-            write_file.write(line)
-    os.remove(file)
-    os.rename(temp_file, file)
+        write_file.write(content)
 
 
 def delimiter_parser(filename: str) -> list:
@@ -76,25 +120,35 @@ def delimiter_parser(filename: str) -> list:
     return [file_index, file_pattern]
 
 
-def file_parser(dir: object, imageArr: list, processedArr: list, accel: bool):
+def file_parser(dir: object, imageArr: list, processedArr: list, accel: bool, cache_dir: str = None):
     """Upstream determination of useful files and results obtained to limit the number of integration operations
+    Multi-frame containers (HDF5/NeXus, EDF) add one image per frame, the acceleration frames being the odd frame indices.
+    The frames of an Eiger series are read through its master file, its data files are skipped
     
     Args:
         dir (object): Directory containing files to be integrated
         imageArr (list): List containing 2D images to be integrated
         processedArr (list): List containing 1D integrations according to imageArr
         accel (bool): Boolean to take into account files created during acceleration
+        cache_dir (str, optional): Folder keeping the catalog of the folder between runs. Defaults to None, not kept.
     """
-    for file in os.listdir(dir):
-        img = os.path.splitext(file)
-        if(img[1] == '.cbf'):
-            if accel == True:
-                if accel_parser(img[0]) == True:
-                    imageArr.append(file)
-                    processedArr.append(img[0] + '.dat')
-            else:
-                imageArr.append(file)
-                processedArr.append(img[0] + '.dat')
+    # Single scan of the folder, reused while the folder is unchanged
+    catalog = scan(dir, ('.cbf',) + CONTAINER_EXTENSIONS, cache_dir)
+    images = np.char.endswith(catalog.name, '.cbf')
+
+    for file in catalog.name[images & catalog.select(accel=accel == True)].tolist():
+        imageArr.append(file)
+        processedArr.append(os.path.splitext(file)[0] + '.dat')
+
+    for file in master_files(catalog.name[~images].tolist()):
+        if is_container(file):
+            # Each frame of a multi-frame container is an image, numbered by its frame index
+            for i in range(nb_frames(os.path.join(dir, file))):
+                frame = frame_name(file, i)
+                if accel == True and accel_parser(frame_basename(frame)) != True:
+                    continue
+                imageArr.append(frame)
+                processedArr.append(frame_basename(frame) + '.dat')
 
 
 def accel_parser(file: object) -> bool:
@@ -184,6 +238,55 @@ def azim_angles(aperture: int) -> tuple:
     return axis0, axis90
 
 
+def azim_sectors(aperture: int) -> tuple:
+    """Generation of the sectors integrated around the 0° and 90° axes for a given aperture
+    The sector around 180° goes through ±180° and is written as a single sector [180-a/2, 180+a/2]
+
+    Args:
+        aperture (int): Aperture angle
+
+    Returns:
+        tuple: Tuple of the sectors for axis 0 and axis 90
+    """
+    if aperture > 90:
+        aperture = 90
+    half_aperture = aperture / 2
+
+    axis0 = ([- half_aperture, half_aperture],
+            [180-half_aperture, 180+half_aperture])
+    axis90 = ([-90-half_aperture, -90+half_aperture],
+            [90-half_aperture, 90+half_aperture])
+
+    return axis0, axis90
+
+
+def cake_sectors(nb_sectors: int) -> tuple:
+    """Generation of the sectors of a cake integration, dividing the 360° in equal sectors
+    The sector k is centered on k*360/nb_sectors degrees
+
+    Args:
+        nb_sectors (int): Number of sectors
+
+    Returns:
+        tuple: Tuple of the sectors, each one alone in its group
+    """
+    width = 360 / nb_sectors
+    return tuple(([k * width - width / 2, k * width + width / 2],) for k in range(nb_sectors))
+
+
+def cake_axis(i: int, nb_sectors: int) -> str:
+    """Obtain the ° position of the center of a sector of a cake integration
+
+    Args:
+        i (int): Index of the sector
+        nb_sectors (int): Number of sectors
+
+    Returns:
+        str: Position in ° of the sector center, e.g. 22.5
+    """
+    return f"{i * 360 / nb_sectors:g}"
+
+
 def azim_integ(poni: object, dark: object, im: object, nb_pts: int, interval_angle: list):
     """Azimuthal integration for two given angular bounds
 
@@ -254,9 +357,4 @@ def save_to_file(file: str, data: object):
         file (str): Name for the file
         data (object): Data to be saved in two column format
     """
-    f = open(file, "w")
-    for i in range(len(data[0])):
-        f.write("%f  " % (data[0][i]))
-        f.write("%.4f" % (data[1][i]))
-        f.write("\n")
-    f.close()
\ No newline at end of file
+    get_writer(len(data[0]), 1).write(file, data[0], data[1])
\ No newline at end of file
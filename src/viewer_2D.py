@@ -3,10 +3,11 @@ from colored import stylize, attr, fg, set_tty_aware
 set_tty_aware(False)
 
 #import pour la conversion des images 2D en tiff
-import os
+import traceback
 import numpy as np
-import matplotlib.pyplot as plt
-import fabio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from src.readers import list_frames, read_frame, frame_basename
 
 def ui_viewer_2D(action):
     viewer_2D = action.add_parser('viewer_2D', prog='Convert 2D image to tiff')
@@ -15,7 +16,7 @@ def ui_viewer_2D(action):
             "IMAGES",
             nargs='*',
             metavar='2D images',
-            help="Select the 2D images to convert",
+            help="Select the 2D images to convert, each frame of HDF5/NeXus and EDF files is converted",
             widget="MultiFileChooser",
             gooey_options={
                         'full_width': True, 
@@ -27,31 +28,131 @@ def ui_viewer_2D(action):
             help="Select the dark file associated with the images to be converted",
             widget='FileChooser',
     )
+    groupViewer_2D.add_argument(
+            "--SCALING",
+            metavar="Intensity scaling",
+            choices=['linear', 'log', 'percentile'],
+            default='linear',
+            help="linear: minimum to maximum, log: logarithm of the intensity, percentile: linear between two percentiles",
+    )
+    groupViewer_2D.add_argument(
+            "--PERCENTILES",
+            metavar="Percentiles",
+            nargs=2, type=float, default=[1, 99.9],
+            help="Low and high percentiles of the intensity clipped by the percentile scaling",
+    )
+    groupViewer_2D.add_argument(
+            "--BITS",
+            metavar="Bit depth",
+            choices=[8, 16], type=int, default=16,
+            help="Bit depth of the TIFF images",
+    )
+    groupViewer_2D.add_argument(
+            "--WORKERS",
+            metavar="Number of workers",
+            default=1, type=int,
+            help="Number of processes sharing the images",
+    )
+
+
+# Dark of the current process, loaded once per worker
+_worker = {}
+
+
+def _init_worker(DARK: str):
+    """Load the dark once for the process converting images
+
+    Args:
+        DARK (str): Dark file, None if no dark is used
+    """
+    import fabio
+    _worker['dark'] = np.asarray(fabio.open(DARK).data, dtype=np.float32) if DARK else None
+
+
+def scale_image(data: np.ndarray, scaling: str = 'linear', percentiles: tuple = (1, 99.9), bits: int = 16) -> np.ndarray:
+    """Scale the intensity of a 2D image to the range of an unsigned integer image
+
+    Args:
+        data (np.ndarray): 2D image, dark subtracted
+        scaling (str, optional): 'linear', 'log' or 'percentile'. Defaults to 'linear'.
+        percentiles (tuple, optional): Low and high percentiles of the percentile scaling. Defaults to (1, 99.9).
+        bits (int, optional): 8 or 16 bits. Defaults to 16.
+
+    Returns:
+        np.ndarray: uint8 or uint16 image
+    """
+    # Negative values of masked pixels and of the dark subtraction are not displayed
+    img = np.nan_to_num(np.asarray(data, dtype=np.float32), nan=0, posinf=0, neginf=0)
+    np.maximum(img, 0, out=img)
+
+    if scaling == 'log':
+        np.log1p(img, out=img)
+    if scaling == 'percentile':
+        low, high = np.percentile(img, percentiles)
+    else:
+        low, high = img.min(), img.max()
+
+    maximum = 2 ** bits - 1
+    img -= low
+    img *= maximum / (high - low) if high > low else 0
+    np.clip(img, 0, maximum, out=img)
+    return img.astype(np.uint8 if bits == 8 else np.uint16)
+
+
+def convert_image(settings: dict, image: str) -> tuple:
+    """Convert a 2D image to a full resolution TIFF image next to it
+
+    Args:
+        settings (dict): Conversion settings: scaling, percentiles and bits
+        image (str): 2D image file or frame of a multi-frame container
+
+    Returns:
+        tuple: Image, TIFF image written and traceback, None if the conversion succeeded
+    """
+    from PIL import Image
+    try:
+        img = np.asarray(read_frame(image), dtype=np.float32)
+        if _worker['dark'] is not None:
+            img -= _worker['dark']
+        image_name = frame_basename(image) + '.tiff'
+        Image.fromarray(scale_image(img, settings['scaling'], settings['percentiles'],
+                                    settings['bits'])).save(image_name)
+        return image, image_name, None
+    except Exception:
+        return image, None, traceback.format_exc()
+
 
 def viewer_2D(args):
     IMAGES, DARK = args.IMAGES, args.DARK
-    if DARK:
-        im_dark = fabio.open(DARK)
-    
+    WORKERS = getattr(args, 'WORKERS', 1) or 1
+    IMAGES = [frame for image in IMAGES for frame in list_frames(image)]
+    settings = {
+        'scaling': getattr(args, 'SCALING', 'linear'),
+        'percentiles': tuple(getattr(args, 'PERCENTILES', (1, 99.9))),
+        'bits': int(getattr(args, 'BITS', 16)),
+    }
+
     print(stylize(f">> Converting {len(IMAGES)} 2D images to .tiff", attr("bold")))
 
-    for image in IMAGES:
-        try:
+    convert = partial(convert_image, settings)
+    if WORKERS > 1:
+        executor = ProcessPoolExecutor(WORKERS, initializer=_init_worker, initargs=(DARK,))
+        results = executor.map(convert, IMAGES, chunksize=max(1, len(IMAGES) // (4 * WORKERS)))
+    else:
+        executor = None
+        _init_worker(DARK)
+        results = map(convert, IMAGES)
+
+    try:
+        for image, image_name, error in results:
             print(f'Processing: {image}')
-            data = fabio.open(image)
-            im = np.array(data.data, dtype=np.uint8)
-            if DARK:
-                dk = np.array(im_dark.data, dtype=np.uint8)
-                img = im - dk
+            if error:
+                print(stylize(f'>> Problem after image : {image}', fg(
+                        "red") + attr("bold")))
+                print(error)
             else:
-                img = im
-            plt.imshow(img, cmap="gray", vmin=0, vmax=255)
-            plt.axis('off')
-            image_name = os.path.splitext(image)[0] + '.tiff'
-            plt.savefig(image_name)
-            print(stylize(f'Image saved:  {image_name}',  fg(
-                    "green")))
-
-        except:
-            print(stylize(f'>> Problem after image : {img}', fg(
-                    "red") + attr("bold")))
\ No newline at end of file
+                print(stylize(f'Image saved:  {image_name}',  fg(
+                        "green")))
+    finally:
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,156 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# GUI import
+from colored import stylize, attr, fg, set_tty_aware
+set_tty_aware(False)
+# Imports for the incremental integration of a folder
+import os
+import json
+import time
+import hashlib
+import src.utils as IXR2D
+
+# Manifest of the integrated frames, kept in the folder of the 2D images
+MANIFEST_FILE = '.IntegXR2D_manifest.json'
+
+
+def parameters_hash(parameters: dict) -> str:
+    """Hash of the integration parameters recorded for each frame
+
+    Args:
+        parameters (dict): Integration parameters, JSON serializable
+
+    Returns:
+        str: Hash of the parameters
+    """
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class Manifest:
+    """Frames already integrated in a folder, with their size, modification time and integration parameters"""
+
+    def __init__(self, folder: str, parameters: dict):
+        """Load the manifest of a folder, empty if it does not exist
+
+        Args:
+            folder (str): Folder containing the 2D images
+            parameters (dict): Integration parameters of the current run
+        """
+        self.file = os.path.join(folder, MANIFEST_FILE)
+        self.parameters = parameters_hash(parameters)
+        self.frames = {}
+        if os.path.exists(self.file):
+            try:
+                with open(self.file) as f:
+                    self.frames = json.load(f).get('frames', {})
+            except (OSError, ValueError):
+                print(stylize(f'>> Unreadable manifest, all frames will be integrated: {self.file}', fg(
+                    "red") + attr("bold")))
+
+    def is_done(self, name: str, size: int, mtime: float) -> bool:
+        """Check if a frame was integrated with the same content and parameters
+
+        Args:
+            name (str): Frame file name
+            size (int): Size of the file in bytes
+            mtime (float): Modification time of the file
+
+        Returns:
+            bool: True if the frame does not need to be integrated again
+        """
+        entry = self.frames.get(name)
+        return entry is not None and entry['size'] == size \
+            and entry['mtime'] == mtime and entry['parameters'] == self.parameters
+
+    def mark_done(self, name: str, size: int, mtime: float):
+        """Record a frame as integrated with the parameters of the current run"""
+        self.frames[name] = {'size': size, 'mtime': mtime, 'parameters': self.parameters}
+
+    def save(self):
+        """Write the manifest atomically, an interrupted run keeps the previous version"""
+        with IXR2D.atomic_write(self.file) as f:
+            json.dump({'frames': self.frames}, f, indent=1)
+
+
+def scan_frames(folder: str, accel: bool) -> dict:
+    """List the 2D images of a folder with their size and modification time
+
+    Args:
+        folder (str): Folder containing the 2D images
+        accel (bool): Boolean to take into account files created during acceleration
+
+    Returns:
+        dict: Size and modification time of each image, by file name
+    """
+    frames = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            if ext != '.cbf' or not entry.is_file():
+                continue
+            if accel and IXR2D.accel_parser(name) != True:
+                continue
+            stat = entry.stat()
+            frames[entry.name] = (stat.st_size, stat.st_mtime)
+    return frames
+
+
+def watch_folder(folder: str, process, parameters: dict, accel: bool = False,
+                 interval: float = 10, idle_timeout: float = 0):
+    """Integrate the frames of a folder as they are written, skipping those recorded in the manifest.
+    A frame is integrated once its size and modification time are stable between two scans.
+    A frame which could not be integrated is only tried again once its size or modification time changes.
+
+    Args:
+        folder (str): Folder containing the 2D images
+        process (callable): Integration of a list of frames, returns the frames successfully integrated
+        parameters (dict): Integration parameters, a frame integrated with other parameters is integrated again
+        accel (bool, optional): Boolean to take into account files created during acceleration. Defaults to False.
+        interval (float, optional): Time between two scans of the folder in seconds. Defaults to 10.
+        idle_timeout (float, optional): Stop after this time in seconds without new frame, 0 to watch
+            until interrupted. Defaults to 0.
+    """
+    manifest = Manifest(folder, parameters)
+    print(stylize(f">> Watching {folder} for new frames", attr("bold")))
+    print(f"{len(manifest.frames)} frames in the manifest")
+
+    previous = {}
+    # Size and modification time of the frames whose integration failed
+    failed = {}
+    idle_since = time.time()
+    try:
+        while True:
+            frames = scan_frames(folder, accel)
+            now = time.time()
+            ready = [
+                name for name, (size, mtime) in sorted(frames.items())
+                if not manifest.is_done(name, size, mtime) and failed.get(name) != (size, mtime)
+                and (previous.get(name) == (size, mtime) or now - mtime > interval)
+            ]
+            previous = frames
+
+            if ready:
+                print(f"Integration of {len(ready)} new diffraction images")
+                done = set(process(ready))
+                for name in ready:
+                    if name in done:
+                        manifest.mark_done(name, *frames[name])
+                        failed.pop(name, None)
+                    else:
+                        failed[name] = frames[name]
+                manifest.save()
+                if done:
+                    idle_since = time.time()
+                if len(done) < len(ready):
+                    print(f"{len(ready) - len(done)} images not integrated, tried again once modified")
+
+            if idle_timeout and time.time() - idle_since > idle_timeout:
+                print(stylize(f">> No new frame for {idle_timeout} s, end of watch", attr("bold")))
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        manifest.save()
+        print(stylize(">> Watch interrupted, manifest saved", attr("bold")))
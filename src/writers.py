@@ -0,0 +1,89 @@
+# =============================================================================
+# Created By  : VALLOT Sylvain
+# Created Date: 2021
+# =============================================================================
+
+# Imports for writing the 1D diffractograms
+import numpy as np
+
+
+class DatWriter:
+    """Bulk writer of 1D diffractograms in the FullProf .dat format.
+
+    A whole diffractogram is formatted in a single operation from the NumPy arrays:
+    2theta with %f and each intensity column with %.4f, separated by two spaces.
+    The format template and the interleaving buffer are kept between calls,
+    so a series of diffractograms with the same number of points reuses them.
+    """
+
+    def __init__(self, npt: int, nb_columns: int = 1):
+        """Prepare the template of a diffractogram
+
+        Args:
+            npt (int): Number of points per diffractogram
+            nb_columns (int, optional): Number of intensity columns. Defaults to 1.
+        """
+        self.npt = int(npt)
+        self.nb_columns = int(nb_columns)
+        self._template = ("%f" + "  %.4f" * self.nb_columns + "\n") * self.npt
+        self._buffer = np.empty((self.npt, self.nb_columns + 1))
+
+    def format(self, tth: np.ndarray, cts: np.ndarray) -> str:
+        """Format a diffractogram
+
+        Args:
+            tth (np.ndarray): 2theta values, npt points
+            cts (np.ndarray): Intensities, npt points or an array (nb_columns, npt)
+
+        Returns:
+            str: Diffractogram in the .dat format
+        """
+        self._buffer[:, 0] = tth
+        self._buffer[:, 1:] = np.reshape(cts, (self.nb_columns, self.npt)).T
+        return self._template % tuple(self._buffer.ravel().tolist())
+
+    def write(self, file: str, tth: np.ndarray, cts: np.ndarray, header: list = None):
+        """Write a diffractogram to a file
+
+        Args:
+            file (str): Name for the file
+            tth (np.ndarray): 2theta values, npt points
+            cts (np.ndarray): Intensities, npt points or an array (nb_columns, npt)
+            header (list, optional): Header lines written before the data. Defaults to None.
+        """
+        with open(file, "w") as f:
+            if header:
+                f.write("".join(line + "\n" for line in header))
+            f.write(self.format(tth, cts))
+
+    def write_many(self, files: list, tth: np.ndarray, patterns: np.ndarray, headers: list = None):
+        """Write a series of diffractograms sharing the same 2theta values
+
+        Args:
+            files (list): Names for the files
+            tth (np.ndarray): 2theta values, npt points
+            patterns (np.ndarray): Intensities, one diffractogram per row
+            headers (list, optional): Header lines of each file. Defaults to None.
+        """
+        for i, file in enumerate(files):
+            self.write(file, tth, patterns[i], headers[i] if headers else None)
+
+
+# Writers kept between calls, one per diffractogram layout
+_writers = {}
+
+
+def get_writer(npt: int, nb_columns: int = 1) -> DatWriter:
+    """Writer for a given number of points and intensity columns, reused between calls
+
+    Args:
+        npt (int): Number of points per diffractogram
+        nb_columns (int, optional): Number of intensity columns. Defaults to 1.
+
+    Returns:
+        DatWriter: Writer of the diffractograms
+    """
+    key = (int(npt), int(nb_columns))
+    if key not in _writers:
+        _writers[key] = DatWriter(*key)
+    return _writers[key]